@@ -0,0 +1,227 @@
+"""
+Micro-benchmarks of rendering, layout, card operations, card drawing and the wire encoding.
+
+Every run builds the same board from a seed: large hands, a long list of rainbow SUP buildings and the board of an
+opponent received through the entity sync. The results are printed as JSON, so that runs on different commits can be compared:
+
+    python benchmarks.py --output before.json
+    python benchmarks.py --baseline before.json --threshold 0.25 # exits with 1 if a benchmark got more than 25% slower
+"""
+
+from shared_definitions import *
+from entity_sync import EntitySyncSender, EntitySyncReceiver, encode_ack, decode_ack
+from game import GameController, move_to_opponent_side
+from bot import BotClient
+from game_state import PlayerState, GameState
+from renderer import TerminalRenderer
+import argparse
+import gc
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+HAND_SIZE: int = 40
+SUP_BUILDING_COUNT: int = 25
+
+def fill_hand(player: PlayerState, rng: random.Random) -> None:
+    for _ in range(HAND_SIZE):
+        player.draw_card(WarriorCard, rng = rng)
+        player.draw_card(BandageCard, rng = rng)
+    for _ in range(SUP_BUILDING_COUNT):
+        player.main_building_list.append(BuildingCard(SUPER_BUILDING_PREFIX + face_values.BARRACKS, level = colors.RAINBOW))
+
+def build_board(seed: int) -> None:
+    """Sets up GameController the way game.main() does for the first player, then fills both boards"""
+    rng = random.Random(seed)
+    GameController.player_num = 1
+    GameController.player_color = PLAYER_COLORS[1]
+    GameController.add_player_side_borders()
+    GameController.my_entities.update(GameController.player.public_entities)
+    fill_hand(GameController.player, rng)
+    GameController.set_footer(Entity("It's your turn", colors.NONE, coords = GameController.get_footer_start_coordinates()))
+
+    opponent = BotClient(rng = rng)
+    fill_hand(opponent.player, rng)
+    _, added = EntitySyncReceiver().apply_update(EntitySyncSender().encode_update(opponent.player.public_entities))
+    for entity in added:
+        move_to_opponent_side(entity)
+        GameController.received_entities.add(entity)
+
+def time_calls(function: Callable[[], Any], number: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(number):
+        function()
+    return time.perf_counter() - started_at
+
+##### BENCHMARKS #####
+# each benchmark prepares what it needs outside of the timed part, calls the measured operation `number` times and returns the elapsed seconds
+
+def bench_get_game_field_string(number: int) -> float:
+    return time_calls(GameController.get_game_field_string, number)
+
+def bench_render_cursor_move(number: int) -> float:
+    """A frame of the renderer after the cursor moved between two cards"""
+    marker = Entity(content = CURSOR_UP, color = colors.WHITE, coords = Coordinates(MAIN_WARRIOR_LIST_COORDINATES.x, MAIN_WARRIOR_LIST_COORDINATES.y + 1))
+    entities = flatten_iterable(GameController.all_entities) + [marker]
+    renderer = TerminalRenderer(io.StringIO())
+    renderer.render(entities)
+    def move_and_render() -> None:
+        marker.set_coords(Coordinates(marker.coords.x ^ 1, marker.coords.y))
+        renderer.render(entities)
+    return time_calls(move_and_render, number)
+
+def bench_all_entities(number: int) -> float:
+    return time_calls(lambda: GameController.all_entities, number)
+
+def bench_get_shift_to_free_space(number: int) -> float:
+    cards = list(GameController.player.main_warrior_list)
+    cards_iterator = iter(cards * (number // len(cards) + 1))
+    return time_calls(lambda: GameController.get_shift_to_free_space(next(cards_iterator)), number)
+
+def bench_cursor_select_next(number: int) -> float:
+    cursor = Cursor(GameController.get_shift_to_free_space, scope = GameController.my_entities)
+    elapsed = 0.0
+    remaining = number
+    while remaining > 0:
+        cursor.select(0)
+        steps = min(remaining, len(cursor.selectable_scope) - 1)
+        elapsed += time_calls(cursor.select_next, steps)
+        remaining -= steps
+    cursor.hide()
+    return elapsed
+
+def bench_update_card_coordinates(number: int) -> float:
+    building_list = GameController.player.main_building_list
+    return time_calls(lambda: building_list.update_card_coordinates(begin = 0, end = len(building_list)), number)
+
+def bench_upgrade_level(number: int) -> float:
+    cards = [WarriorCard(state_index = i % len(WARRIOR_FACE_VALUES)) for i in range(number)]
+    cards_iterator = iter(cards)
+    return time_calls(lambda: next(cards_iterator).upgrade_level(), number)
+
+def bench_draw_a_card(number: int) -> float:
+    rng = random.Random(0)
+    card_list = CardList(card_type = WarriorCard, coords = MAIN_WARRIOR_LIST_COORDINATES)
+    return time_calls(lambda: draw_a_card(WarriorCard, card_list, public = True, rng = rng), number)
+
+def bench_draw_cards(number: int) -> float:
+    """A batch of 1000 warriors drawn into a PackedCardList, the way a simulation deals them"""
+    rng = random.Random(0)
+    card_list = PackedCardList(WarriorCard)
+    return time_calls(lambda: draw_cards(WarriorCard, card_list, 1000, public = True, rng = rng), number)
+
+def bench_game_state_clone(number: int) -> float:
+    """A clone of a game in which both players hold the benchmark's hand"""
+    rng = random.Random(0)
+    game = GameState(rng = rng)
+    for player in game.players.values():
+        fill_hand(player, rng)
+    return time_calls(game.clone, number)
+
+def bench_wire_round_trip(number: int) -> float:
+    """A keyframe of the whole board: encoded, framed, sent through a socket, received, decoded and acknowledged"""
+    entities = [e for e in GameController.my_entities if e.public]
+    sender = EntitySyncSender()
+    sender_socket, receiver_socket = socket.socketpair()
+    with Connection(sender_socket) as sending_end, Connection(receiver_socket) as receiving_end:
+        def round_trip() -> None:
+            sender.force_keyframe()
+            sending_end.send_message(SOCKET_SHARED_ENTITIES_UPDATE, sender.encode_update(entities))
+            _, payload = receiving_end.recv_message()
+            receiver = EntitySyncReceiver()
+            receiver.apply_update(payload)
+            receiving_end.send_message(SOCKET_ENTITIES_ACK, encode_ack(receiver.received_version, receiver.version))
+            _, payload = sending_end.recv_message()
+            sender.on_ack(*decode_ack(payload))
+        return time_calls(round_trip, number)
+
+BENCHMARKS: Dict[str, Tuple[Callable[[int], float], int]] = { # name -> (benchmark, number of calls per repeat)
+    "get_game_field_string": (bench_get_game_field_string, 20),
+    "render_cursor_move": (bench_render_cursor_move, 100),
+    "all_entities": (bench_all_entities, 200),
+    "get_shift_to_free_space": (bench_get_shift_to_free_space, 100),
+    "cursor_select_next": (bench_cursor_select_next, 50),
+    "update_card_coordinates": (bench_update_card_coordinates, 100),
+    "upgrade_level": (bench_upgrade_level, 20000),
+    "draw_a_card": (bench_draw_a_card, 200),
+    "draw_cards": (bench_draw_cards, 20),
+    "game_state_clone": (bench_game_state_clone, 50),
+    "wire_round_trip": (bench_wire_round_trip, 100)
+}
+#####
+
+def run_benchmarks(names: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        benchmark, number = BENCHMARKS[name]
+        timings: List[float] = []
+        for _ in range(repeat):
+            gc.collect()
+            gc.disable() # like timeit, so that a collection does not land in a random repeat
+            try:
+                timings.append(benchmark(number) / number)
+            finally:
+                gc.enable()
+        results[name] = {"number": number, "repeat": repeat,
+                         "min_us": round(min(timings) * 1e6, 3), "median_us": round(statistics.median(timings) * 1e6, 3)}
+    return results
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def find_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Compares the minimums, which are far less noisy than the medians"""
+    regressions: List[str] = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        allowed = baseline[name]["min_us"] * (1 + threshold)
+        if result["min_us"] > allowed:
+            regressions.append(f"{name}: {result['min_us']} us, the baseline is {baseline[name]['min_us']} us (at most {round(allowed, 3)} us allowed)")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Runs the micro-benchmarks and prints the results as JSON.")
+    parser.add_argument("names", nargs = "*", help = f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--repeat", type = int, default = 7, help = "the median and the minimum of this many repeats are reported")
+    parser.add_argument("--seed", type = int, default = 1717, help = "seed of the board")
+    parser.add_argument("--output", help = "write the results to this file instead of printing them")
+    parser.add_argument("--baseline", help = "results of an earlier run to compare against")
+    parser.add_argument("--threshold", type = float, default = 0.25, help = "allowed slowdown relative to the baseline, 0.25 is 25%%")
+    args = parser.parse_args()
+    unknown_names = [name for name in args.names if name not in BENCHMARKS]
+    if unknown_names:
+        parser.error(f"unknown benchmarks: {', '.join(unknown_names)}")
+
+    build_board(args.seed)
+    report = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "benchmarks": run_benchmarks(args.names or list(BENCHMARKS), args.repeat)
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+    else:
+        print(json.dumps(report, indent = 2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+        regressions = find_regressions(report["benchmarks"], baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file = sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+A headless client that plays the game by itself, speaking the same protocol as GameController in game.py.
+It is used by loadgen.py, but it can also be run on its own: python bot.py
+"""
+
+from shared_definitions import *
+from codec import CodecError
+from entity_sync import EntitySyncSender, EntitySyncReceiver, encode_ack, decode_ack
+from game_state import PlayerState
+from handshake import get_capabilities, parse_connection_established, get_compression
+import time
+
+BOT_MESSAGE_TIMEOUT: float = float(getenv('BOT_MESSAGE_TIMEOUT') or 30) # a bot gives up if the server is silent for longer than this while it waits
+
+class BotStats:
+    """Counters shared by all bots of a load generator run"""
+    def __init__(self) -> None:
+        self.games_started: int = 0
+        self.games_finished: int = 0
+        self.turns: int = 0
+        self.messages_sent: int = 0
+        self.messages_received: int = 0
+        self.bytes_sent: int = 0
+        self.bytes_received: int = 0
+        self.keyframes_requested: int = 0
+        self.resumes: int = 0
+        self.relay_latencies: List[float] = [] # seconds from sending an update until the opponent's ack for it arrives
+        self.errors: Dict[str, int] = {}
+
+    def add_error(self, error: str) -> None:
+        self.errors[error] = self.errors.get(error, 0) + 1
+
+class BotClient:
+    def __init__(self, host: str = HOST, port: int = PORT, turns: int = 20, think_time: float = 0.5, rng: random.Random | None = None, stats: BotStats | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.turns = turns # the bot leaves the game after playing this many turns
+        self.think_time = think_time
+        self.rng = rng or random.Random()
+        self.stats = stats or BotStats()
+
+        self.connection: StreamConnection = None
+        self.player_num: int = 0
+        self.my_turn: bool = False
+        self.second_player_joined: bool = False
+        self.turns_played: int = 0
+        self.resume_token: bytes | None = None
+        self.entity_sync_sender = EntitySyncSender()
+        self.entity_sync_receiver = EntitySyncReceiver()
+        self.__update_sent_at: Dict[int, float] = {} # version -> time.perf_counter() when it was sent
+
+        self.player = PlayerState()
+
+    @property
+    def done(self) -> bool:
+        return self.turns_played >= self.turns and self.entity_sync_sender.acked_version == self.entity_sync_sender.version
+
+    async def send(self, message_type: int, payload: bytes = b"") -> None:
+        self.stats.bytes_sent += await self.connection.send_message(message_type, payload)
+        self.stats.messages_sent += 1
+
+    async def recv(self) -> Tuple[int, bytes]:
+        timeout = HEARTBEAT_TIMEOUT if self.connection.peer_sends_heartbeats and HEARTBEAT_INTERVAL > 0 else BOT_MESSAGE_TIMEOUT # a server that sends heartbeats is never silent for long
+        message_type, payload = await asyncio.wait_for(self.connection.recv_message(), timeout)
+        self.stats.messages_received += 1
+        self.stats.bytes_received += self.connection.last_message_size
+        return message_type, payload
+
+    async def connect(self, resume_token: bytes | None = None) -> bool:
+        """Returns False if the server is full, TerminationRequest is raised if the session to resume has ended"""
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit = SOCKET_STREAM_LIMIT)
+        self.connection = StreamConnection(reader, writer)
+        await self.send(SOCKET_CONNECTION_ESTABLISHED, get_capabilities(resume_token))
+        message_type, payload = await self.recv()
+        if message_type == SOCKET_LOBBY_FULL:
+            return False
+        established = parse_connection_established(payload)
+        self.player_num, self.resume_token = established.player_num, established.resume_token
+        self.connection.compression = get_compression(established.accepted)
+        self.my_turn = established.current_player_num == self.player_num
+        return True
+
+    async def resume(self) -> bool:
+        """Connects again after the connection was lost, False if the session can not be resumed"""
+        if self.resume_token is None:
+            return False
+        await self.connection.close()
+        deadline = time.monotonic() + RESUME_GRACE
+        while time.monotonic() < deadline:
+            try:
+                if not await self.connect(self.resume_token):
+                    return False
+            except TerminationRequest: # the session has ended meanwhile
+                return False
+            except (ConnectionError, OSError): # e.g. the network is still down
+                await asyncio.sleep(RESUME_RETRY_INTERVAL)
+                continue
+            self.stats.resumes += 1
+            # the entities the opponent holds are unknown, and whatever was in flight is lost
+            self.__update_sent_at.clear()
+            self.entity_sync_sender.force_keyframe()
+            await self.send_public_entities()
+            return True
+        return False
+
+    async def send_heartbeats(self) -> None:
+        """Keeps the server from dropping the bot while it waits for its opponent"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL / 2)
+            if needs_heartbeat(self.connection, time.monotonic()):
+                self.connection.write_message(SOCKET_HEARTBEAT) # not drained, so that it never waits alongside another send
+
+    async def send_public_entities(self) -> None:
+        payload = self.entity_sync_sender.encode_update(self.player.public_entities)
+        self.__update_sent_at[self.entity_sync_sender.version] = time.perf_counter()
+        await self.send(SOCKET_SHARED_ENTITIES_UPDATE, payload)
+
+    async def end_turn(self) -> None:
+        self.my_turn = False
+        await self.send(SOCKET_YOUR_TURN)
+
+    async def receive_public_entities(self) -> bool:
+        """Handles one message from the server, returns False once it is the bot's turn"""
+        message_type, payload = await self.recv()
+        if message_type == SOCKET_ENTITIES_ACK:
+            received_version, held_version = decode_ack(payload)
+            sent_at = self.__update_sent_at.pop(received_version, None)
+            if sent_at is not None:
+                self.stats.relay_latencies.append(time.perf_counter() - sent_at)
+            if self.entity_sync_sender.on_ack(received_version, held_version):
+                self.stats.keyframes_requested += 1
+                await self.send_public_entities()
+        elif message_type == SOCKET_SHARED_ENTITIES_UPDATE:
+            self.entity_sync_receiver.apply_update(payload)
+            await self.send(SOCKET_ENTITIES_ACK, encode_ack(self.entity_sync_receiver.received_version, self.entity_sync_receiver.version))
+            if not self.second_player_joined:
+                self.second_player_joined = True
+                self.stats.games_started += 1
+        elif message_type == SOCKET_YOUR_TURN:
+            self.my_turn = True
+            return False
+        return True
+
+    def play_turn(self) -> None:
+        """Does one of the things a player can do in a turn"""
+        player = self.player
+        plus_bandages = [card for card in player.main_bandage_list if player.can_upgrade_value_with(card)]
+        upgradable_warriors = [card for card in player.main_warrior_list if card.state_index < WarriorCard.LAST_STATE_INDEX]
+        choice = self.rng.random()
+        if plus_bandages and upgradable_warriors and choice < 0.3:
+            player.upgrade_value(plus_bandages[0], self.rng.choice(upgradable_warriors))
+        elif len(player.main_warrior_list) > 0 and player.can_put_out_to_battle(player.main_warrior_list[-1]) and choice < 0.4:
+            player.put_out_to_battle(player.main_warrior_list[-1])
+        elif choice < 0.7:
+            player.draw_card(WarriorCard, rng = self.rng)
+        else:
+            player.draw_card(BandageCard, rng = self.rng)
+
+    async def take_turns(self) -> None:
+        while not self.done:
+            while not self.my_turn or not self.second_player_joined:
+                await self.receive_public_entities()
+            if self.turns_played >= self.turns: # the opponent has played its last turn, the game is over
+                break
+            await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.think_time)
+            self.play_turn()
+            await self.send_public_entities()
+            await self.end_turn()
+            self.turns_played += 1
+            self.stats.turns += 1
+
+    async def play(self) -> None:
+        """Plays a whole game: connects, takes turns until `turns` are played and leaves"""
+        if not await self.connect():
+            self.stats.add_error("lobby full")
+            return
+        self.player.deal_starting_hand()
+        heartbeat_task = asyncio.create_task(self.send_heartbeats()) if HEARTBEAT_INTERVAL > 0 else None
+        try:
+            await self.send_public_entities()
+            while True:
+                try:
+                    await self.take_turns()
+                    break
+                except ConnectionError:
+                    if not await self.resume():
+                        raise
+            self.stats.games_finished += 1
+            try: # the game is over, so the server does not have to keep the bot's place
+                await self.send(SOCKET_TERMINATION_REQUEST)
+            except ConnectionError:
+                pass
+        except TerminationRequest:
+            if self.done:
+                self.stats.games_finished += 1
+            else:
+                self.stats.add_error("opponent disconnected")
+        finally:
+            if heartbeat_task is not None:
+                heartbeat_task.cancel()
+            await self.connection.close()
+
+async def run_bot(bot: BotClient) -> None:
+    """Plays a game with `bot` and records the reason if it fails"""
+    try:
+        await bot.play()
+    except asyncio.TimeoutError:
+        bot.stats.add_error("timeout")
+    except CodecError:
+        bot.stats.add_error("malformed update")
+    except (ConnectionRefusedError, ConnectionResetError, BrokenPipeError):
+        bot.stats.add_error("connection refused or reset")
+    except (ConnectionError, OSError):
+        bot.stats.add_error("connection lost")
+
+if __name__ == "__main__":
+    bot = BotClient()
+    asyncio.run(run_bot(bot))
+    print(f"Player {bot.player_num}: played {bot.turns_played} turns, errors: {bot.stats.errors or 'none'}")
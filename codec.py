@@ -0,0 +1,235 @@
+"""
+Binary encoding of the public entities that players share through the server.
+
+A message is laid out as:
+    version (1 byte) | number of entities (varint) | entities
+
+and every entity as:
+    kind (1 byte) | flags (1 byte) | x, y (2 varints, only if FLAG_HAS_COORDS is set) | kind-specific fields
+
+where the kind-specific fields are described by ENTITY_SCHEMAS. Cards are identified by their type id
+(an index in CARD_TYPES) and their state index, so nothing but plain data is ever sent or decoded.
+"""
+
+from shared_definitions import *
+
+CODEC_VERSION: int = 1
+
+class CodecError(ValueError):
+    pass
+
+# the order of these tables is a part of the wire format, new values must only be appended
+CARD_TYPES: List[Type[Card]] = [WarriorCard, BandageCard, BuildingCard, GuardCard]
+CARD_TYPE_IDS: Dict[Type[Card], int] = {card_type: type_id for type_id, card_type in enumerate(CARD_TYPES)}
+COLOR_TABLE: List[str | None] = [colors.NONE, colors.GRAY, colors.WHITE, colors.RAINBOW, colors.GREEN, colors.BLUE, colors.YELLOW, colors.RED]
+COLOR_IDS: Dict[str | None, int] = {color: color_id for color_id, color in enumerate(COLOR_TABLE)}
+CUSTOM_COLOR_ID: int = 0xFF # the color is not in COLOR_TABLE, so it is sent as a string
+
+KIND_ENTITY: int = 0
+KIND_CARD: int = 1
+KIND_CARD_LIST: int = 2
+
+FLAG_PUBLIC: int = 1 << 0
+FLAG_SELECTABLE: int = 1 << 1
+FLAG_HAS_COORDS: int = 1 << 2
+FLAG_EMPTY_LABEL: int = 1 << 3
+
+##### PRIMITIVES #####
+def write_varint(buffer: bytearray, value: int) -> None:
+    if value < 0:
+        raise CodecError(f"varint cannot be negative: {value}")
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result: int = 0
+    shift: int = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise CodecError("varint is too long")
+
+def write_string(buffer: bytearray, value: str) -> None:
+    encoded: bytes = value.encode()
+    write_varint(buffer, len(encoded))
+    buffer += encoded
+
+def read_string(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = read_varint(data, pos)
+    if pos + length > len(data):
+        raise CodecError("string exceeds the message")
+    return bytes(data[pos:pos + length]).decode(), pos + length
+
+def write_color(buffer: bytearray, color: str | None) -> None:
+    color_id = COLOR_IDS.get(color)
+    if color_id is None:
+        buffer.append(CUSTOM_COLOR_ID)
+        write_string(buffer, color)
+    else:
+        buffer.append(color_id)
+
+def read_color(data: bytes, pos: int) -> Tuple[str | None, int]:
+    color_id = data[pos]
+    if color_id == CUSTOM_COLOR_ID:
+        return read_string(data, pos + 1)
+    if color_id >= len(COLOR_TABLE):
+        raise CodecError(f"unknown color id {color_id}")
+    return COLOR_TABLE[color_id], pos + 1
+
+def write_card_type(buffer: bytearray, card_type: Type[Card]) -> None:
+    try:
+        buffer.append(CARD_TYPE_IDS[card_type])
+    except KeyError:
+        raise CodecError(f"{card_type} cannot be encoded")
+
+def read_card_type(data: bytes, pos: int) -> Tuple[Type[Card], int]:
+    type_id = data[pos]
+    if type_id >= len(CARD_TYPES):
+        raise CodecError(f"unknown card type id {type_id}")
+    return CARD_TYPES[type_id], pos + 1
+
+def read_state_index(data: bytes, pos: int, card_type: Type[Card]) -> Tuple[int, int]:
+    state_index, pos = read_varint(data, pos)
+    if state_index >= card_type.COUNT:
+        raise CodecError(f"{card_type.__name__} has no state with index {state_index}")
+    return state_index, pos
+
+def get_flags(entity: Entity) -> int:
+    return ((FLAG_PUBLIC if entity.public else 0) |
+            (FLAG_SELECTABLE if entity.selectable else 0) |
+            (FLAG_HAS_COORDS if entity.coords is not None else 0) |
+            (FLAG_EMPTY_LABEL if isinstance(entity, CardList) and entity.empty_label else 0))
+#####
+
+##### ENTITY SCHEMAS #####
+# each schema writes and reads the fields that follow the common kind, flags and coordinates
+
+def write_plain_entity(buffer: bytearray, entity: Entity) -> None:
+    write_color(buffer, entity.color)
+    write_string(buffer, entity.content)
+
+def read_plain_entity(data: bytes, pos: int, flags: int, coords: Coordinates | None) -> Tuple[Entity, int]:
+    color, pos = read_color(data, pos)
+    content, pos = read_string(data, pos)
+    return Entity(content = content, color = color, coords = coords, selectable = bool(flags & FLAG_SELECTABLE), public = bool(flags & FLAG_PUBLIC)), pos
+
+def write_card(buffer: bytearray, card: Card) -> None:
+    write_card_type(buffer, type(card))
+    write_varint(buffer, card.state_index)
+
+def read_card(data: bytes, pos: int, flags: int, coords: Coordinates | None) -> Tuple[Card, int]:
+    card_type, pos = read_card_type(data, pos)
+    state_index, pos = read_state_index(data, pos, card_type)
+    return card_type.from_state_index(state_index, coords = coords, selectable = bool(flags & FLAG_SELECTABLE), public = bool(flags & FLAG_PUBLIC)), pos
+
+def write_card_list(buffer: bytearray, card_list: CardList) -> None:
+    write_card_type(buffer, card_list.card_type)
+    write_varint(buffer, card_list.max_size or 0)
+    write_varint(buffer, len(card_list))
+    for card in card_list: # the coordinates of the cards are not sent, they are derived from the coordinates of the list
+        write_card(buffer, card)
+        buffer.append(get_flags(card) & ~FLAG_HAS_COORDS)
+
+def read_card_list(data: bytes, pos: int, flags: int, coords: Coordinates | None) -> Tuple[CardList, int]:
+    if coords is None:
+        raise CodecError("card list must have coordinates")
+    card_type, pos = read_card_type(data, pos)
+    max_size, pos = read_varint(data, pos)
+    count, pos = read_varint(data, pos)
+    if max_size and count > max_size:
+        raise CodecError(f"card list of {count} cards exceeds its maximum size of {max_size}")
+    cards: List[Card] = []
+    for _ in range(count):
+        card, pos = read_card(data, pos, 0, None)
+        card_flags = data[pos]
+        card.public = bool(card_flags & FLAG_PUBLIC)
+        card.selectable = bool(card_flags & FLAG_SELECTABLE)
+        cards.append(card)
+        pos += 1
+    card_list = CardList(coords = coords, card_type = card_type, cards = cards, max_size = max_size or None,
+                         empty_label = bool(flags & FLAG_EMPTY_LABEL), selectable = bool(flags & FLAG_SELECTABLE), public = bool(flags & FLAG_PUBLIC))
+    card_list.update_card_coordinates(begin = 0, end = len(card_list))
+    return card_list, pos
+
+ENTITY_SCHEMAS: Dict[int, Tuple[Callable[[bytearray, Any], None], Callable[[bytes, int, int, Coordinates | None], Tuple[Entity, int]]]] = {
+    KIND_ENTITY: (write_plain_entity, read_plain_entity),
+    KIND_CARD: (write_card, read_card),
+    KIND_CARD_LIST: (write_card_list, read_card_list)
+}
+
+def get_kind(entity: Entity) -> int:
+    if isinstance(entity, CardList):
+        return KIND_CARD_LIST
+    if isinstance(entity, Card):
+        return KIND_CARD
+    return KIND_ENTITY
+#####
+
+def write_entity(buffer: bytearray, entity: Entity) -> None:
+    kind = get_kind(entity)
+    buffer.append(kind)
+    buffer.append(get_flags(entity))
+    if entity.coords is not None:
+        write_varint(buffer, entity.coords.x)
+        write_varint(buffer, entity.coords.y)
+    ENTITY_SCHEMAS[kind][0](buffer, entity)
+
+def read_entity(data: bytes, pos: int) -> Tuple[Entity, int]:
+    kind = data[pos]
+    flags = data[pos + 1]
+    pos += 2
+    if kind not in ENTITY_SCHEMAS:
+        raise CodecError(f"unknown entity kind {kind}")
+    coords = None
+    if flags & FLAG_HAS_COORDS:
+        x, pos = read_varint(data, pos)
+        y, pos = read_varint(data, pos)
+        coords = Coordinates(x, y)
+    return ENTITY_SCHEMAS[kind][1](data, pos, flags, coords)
+
+def encode_entity(entity: Entity) -> bytes:
+    buffer = bytearray()
+    write_entity(buffer, entity)
+    return bytes(buffer)
+
+def decode_entity(data: bytes) -> Entity:
+    try:
+        entity, pos = read_entity(data, 0)
+    except IndexError:
+        raise CodecError("entity is truncated")
+    except UnicodeDecodeError as e:
+        raise CodecError(f"malformed string: {e}")
+    if pos != len(data):
+        raise CodecError(f"{len(data) - pos} unexpected bytes at the end of the entity")
+    return entity
+
+def encode_entities(entities: List[Entity]) -> bytes:
+    buffer = bytearray((CODEC_VERSION,))
+    write_varint(buffer, len(entities))
+    for entity in entities:
+        write_entity(buffer, entity)
+    return bytes(buffer)
+
+def decode_entities(data: bytes) -> List[Entity]:
+    try:
+        if data[0] != CODEC_VERSION:
+            raise CodecError(f"unsupported codec version {data[0]}")
+        count, pos = read_varint(data, 1)
+        entities: List[Entity] = []
+        for _ in range(count):
+            entity, pos = read_entity(data, pos)
+            entities.append(entity)
+    except IndexError:
+        raise CodecError("message is truncated")
+    except UnicodeDecodeError as e:
+        raise CodecError(f"malformed string: {e}")
+    if pos != len(data):
+        raise CodecError(f"{len(data) - pos} unexpected bytes at the end of the message")
+    return entities
@@ -0,0 +1,99 @@
+"""
+Negotiated compression of the message payloads with deflate and a preset dictionary.
+
+Compression is offered and accepted in the capability handshake (see handshake.py), together with the id of the dictionary:
+clients that do not offer it never see a compressed message, and it is used only if both sides built the same dictionary,
+e.g. a client and a server whose codec differs fall back to uncompressed messages instead of failing.
+
+Once accepted, either side compresses the payloads of at least COMPRESSION_THRESHOLD bytes and marks them with
+SOCKET_COMPRESSED_FLAG in the message type. The payloads are tiny binary updates (see entity_sync.py), which deflate alone
+barely shrinks, so the dictionary is made of typical updates: it is built by playing a few games with a fixed seed, which
+gives every process the same bytes without shipping a binary file. Raw deflate streams are used, the dictionary id of the
+handshake replaces the zlib header and checksum.
+
+The server relays the received compressed bytes as they are instead of compressing them again (see WirePayload), and only
+decompresses them when it needs the plain payload: for the recorder, the debug log, spectators, a peer without compression
+or the snapshot of a resumed player.
+"""
+
+from shared_definitions import *
+from game_state import GameState
+from entity_sync import EntitySyncSender
+from functools import lru_cache
+import zlib
+
+COMPRESSION: bool = (getenv('COMPRESSION') or "1") != "0" # offered by clients and accepted by the server
+COMPRESSION_THRESHOLD: int = int(getenv('COMPRESSION_THRESHOLD') or 24) # smaller payloads are sent as they are
+
+COMPRESSION_LEVEL: int = 6
+COMPRESSION_WBITS: int = -15 # a raw deflate stream
+COMPRESSION_MEM_LEVEL: int = 4 # the payloads are small, so a smaller hash table is as good and faster to copy
+DICTIONARY_SIZE: int = 8192
+DICTIONARY_SEED: int = 1717
+DICTIONARY_GAMES: int = 8
+DICTIONARY_TURNS: int = 60
+
+##### DICTIONARY #####
+def get_sample_payloads(seed: int, turns: int) -> List[bytes]:
+    """The updates that the players of a game send, with a short keyframe interval, so that both kinds are well represented"""
+    rng = random.Random(seed)
+    game = GameState(rng)
+    senders: Dict[int, EntitySyncSender] = {1: EntitySyncSender(keyframe_interval = 8), 2: EntitySyncSender(keyframe_interval = 8)}
+    payloads: List[bytes] = []
+    for _ in range(turns):
+        player = game.current_player
+        bandages = [card for card in player.main_bandage_list if player.can_upgrade_value_with(card)]
+        warriors = [card for card in player.main_warrior_list if card.state_index < WarriorCard.LAST_STATE_INDEX]
+        choice = rng.random()
+        if bandages and warriors and choice < 0.3:
+            game.upgrade_value(bandages[0], rng.choice(warriors))
+        elif len(player.main_warrior_list) > 0 and player.can_put_out_to_battle(player.main_warrior_list[-1]) and choice < 0.4:
+            game.put_out_to_battle(player.main_warrior_list[-1])
+        else:
+            game.draw_card(WarriorCard if choice < 0.7 else BandageCard)
+        sender = senders[3 - game.current_player_num] # the player that has just moved
+        payloads.append(sender.encode_update(player.public_entities))
+        sender.on_ack(sender.version, sender.version)
+    return payloads
+
+@lru_cache(maxsize = None)
+def get_dictionary() -> bytes:
+    payloads: List[bytes] = []
+    for game in range(DICTIONARY_GAMES):
+        payloads += get_sample_payloads(DICTIONARY_SEED + game, DICTIONARY_TURNS)
+    return b"".join(payloads)[-DICTIONARY_SIZE:] # deflate prefers matches at the end of the dictionary
+
+def get_dictionary_id() -> int:
+    return zlib.adler32(get_dictionary())
+
+@lru_cache(maxsize = None)
+def get_primed_compressor() -> Any:
+    """A compressor that has already processed the dictionary, copying it is cheaper than setting the dictionary again"""
+    return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, COMPRESSION_WBITS, COMPRESSION_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, get_dictionary())
+#####
+
+class PayloadCompression:
+    """Set as the compression of a Connection or StreamConnection once it has been accepted"""
+    def __init__(self, threshold: int = COMPRESSION_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.dictionary = get_dictionary()
+        self.compressor = get_primed_compressor()
+
+    def compress(self, message_type: int, payload: bytes) -> Tuple[int, bytes]:
+        if len(payload) < self.threshold:
+            return message_type, payload
+        compressor = self.compressor.copy()
+        compressed = compressor.compress(payload) + compressor.flush()
+        if len(compressed) >= len(payload):
+            return message_type, payload
+        return message_type | SOCKET_COMPRESSED_FLAG, compressed
+
+    def decompress(self, message_type: int, payload: bytes) -> Tuple[int, bytes]:
+        decompressor = zlib.decompressobj(COMPRESSION_WBITS, self.dictionary)
+        try:
+            decompressed = decompressor.decompress(payload, SOCKET_MAX_PAYLOAD_SIZE)
+        except zlib.error as e:
+            raise ConnectionError(f"corrupted compressed payload ({e})")
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ConnectionError("compressed payload is truncated or exceeds the maximum size")
+        return message_type & ~SOCKET_COMPRESSED_FLAG, decompressed
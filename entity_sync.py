@@ -0,0 +1,191 @@
+"""
+Versioned synchronization of the public entities.
+
+Every entity that a player shares gets a sync id, and every SOCKET_SHARED_ENTITIES_UPDATE carries a new version
+of the shared entities, laid out as:
+    codec version (1 byte) | flags (1 byte) | version (varint) | base version (varint) |
+    number of removed ids (varint) | removed ids (varints) |
+    number of upserts (varint) | upserts: sync id (varint), length (varint), entity encoded by codec.encode_entity
+
+A delta only contains the entities that were added, removed or changed since the base version, which is the last
+version acknowledged by the receiver (SOCKET_ENTITIES_ACK). A keyframe contains all entities and replaces whatever
+the receiver holds; keyframes are sent periodically and whenever the receiver is not known to hold the base version.
+"""
+
+from shared_definitions import *
+from codec import CODEC_VERSION, CodecError, write_varint, read_varint, encode_entity, decode_entity
+
+KEYFRAME_INTERVAL: int = int(getenv('KEYFRAME_INTERVAL') or 32) # every n-th version is sent as a keyframe
+
+FLAG_KEYFRAME: int = 1 << 0
+
+SyncUpdate = namedtuple("SyncUpdate", ["version", "base_version", "keyframe", "removed", "upserts"]) # upserts is a list of (sync id, encoded entity)
+
+def encode_update(update: SyncUpdate) -> bytes:
+    buffer = bytearray((CODEC_VERSION, FLAG_KEYFRAME if update.keyframe else 0))
+    write_varint(buffer, update.version)
+    write_varint(buffer, update.base_version)
+    write_varint(buffer, len(update.removed))
+    for sync_id in update.removed:
+        write_varint(buffer, sync_id)
+    write_varint(buffer, len(update.upserts))
+    for sync_id, encoded_entity in update.upserts:
+        write_varint(buffer, sync_id)
+        write_varint(buffer, len(encoded_entity))
+        buffer += encoded_entity
+    return bytes(buffer)
+
+def parse_update(data: bytes) -> SyncUpdate:
+    """Splits an update into its parts without decoding the entities"""
+    try:
+        if data[0] != CODEC_VERSION:
+            raise CodecError(f"unsupported codec version {data[0]}")
+        keyframe = bool(data[1] & FLAG_KEYFRAME)
+        version, pos = read_varint(data, 2)
+        base_version, pos = read_varint(data, pos)
+        removed_count, pos = read_varint(data, pos)
+        removed: List[int] = []
+        for _ in range(removed_count):
+            sync_id, pos = read_varint(data, pos)
+            removed.append(sync_id)
+        upsert_count, pos = read_varint(data, pos)
+        upserts: List[Tuple[int, bytes]] = []
+        for _ in range(upsert_count):
+            sync_id, pos = read_varint(data, pos)
+            length, pos = read_varint(data, pos)
+            if pos + length > len(data):
+                raise CodecError("entity exceeds the message")
+            upserts.append((sync_id, bytes(data[pos:pos + length])))
+            pos += length
+    except IndexError:
+        raise CodecError("message is truncated")
+    if pos != len(data):
+        raise CodecError(f"{len(data) - pos} unexpected bytes at the end of the message")
+    return SyncUpdate(version, base_version, keyframe, removed, upserts)
+
+def is_keyframe(data: bytes) -> bool:
+    """Reads only the flags of an update, False if it is not an update of this codec at all"""
+    return len(data) >= 2 and data[0] == CODEC_VERSION and bool(data[1] & FLAG_KEYFRAME)
+
+def apply_update_to_state(state: Dict[int, bytes], update: SyncUpdate) -> None:
+    """Patches a state of encoded entities (sync id -> encoded entity), the caller must check that the update applies to it"""
+    if update.keyframe:
+        state.clear()
+    for sync_id in update.removed:
+        state.pop(sync_id, None)
+    for sync_id, encoded_entity in update.upserts:
+        state[sync_id] = encoded_entity
+
+def encode_ack(received_version: int, held_version: int) -> bytes:
+    # the held version differs from the received one if the receiver could not apply the update
+    buffer = bytearray()
+    write_varint(buffer, received_version)
+    write_varint(buffer, held_version)
+    return bytes(buffer)
+
+def decode_ack(data: bytes) -> Tuple[int, int]:
+    try:
+        received_version, pos = read_varint(data, 0)
+        held_version, pos = read_varint(data, pos)
+    except IndexError:
+        raise CodecError("ack is truncated")
+    if pos != len(data):
+        raise CodecError(f"{len(data) - pos} unexpected bytes at the end of the ack")
+    return received_version, held_version
+
+def get_public_view(entity: Entity) -> Entity:
+    return entity.get_public_slice() if isinstance(entity, CardList) else entity
+
+class EntitySyncSender:
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL) -> None:
+        self.keyframe_interval = keyframe_interval
+        self.version: int = 0
+        self.acked_version: int = 0
+        self.__acked_state: Dict[int, bytes] = {}
+        self.__sent_state: Dict[int, bytes] = {} # the state of the last sent version, it becomes acked once the receiver confirms it
+        self.__sync_ids: Dict[int, Tuple[int, Entity]] = {} # id(entity) -> (sync id, entity), the entity is kept so that its id() can not be reused while it is mapped
+        self.__next_sync_id: int = 1
+        self.__force_keyframe: bool = True
+
+    def __get_sync_id(self, entity: Entity) -> int:
+        mapping = self.__sync_ids.get(id(entity))
+        if mapping is None:
+            mapping = (self.__next_sync_id, entity)
+            self.__sync_ids[id(entity)] = mapping
+            self.__next_sync_id += 1
+        return mapping[0]
+
+    def force_keyframe(self) -> None:
+        self.__force_keyframe = True
+
+    def encode_update(self, entities: Iterable[Entity]) -> bytes:
+        """Encodes the public view of the given entities as the next version"""
+        state: Dict[int, bytes] = {self.__get_sync_id(entity): encode_entity(get_public_view(entity)) for entity in entities}
+        for key in [key for key, (sync_id, _) in self.__sync_ids.items() if sync_id not in state]:
+            del self.__sync_ids[key]
+
+        self.version += 1
+        keyframe: bool = (self.__force_keyframe or self.version % self.keyframe_interval == 0
+                          or self.acked_version != self.version - 1) # a previous version is still unconfirmed, so it is unknown what the receiver holds
+        if keyframe:
+            update = SyncUpdate(self.version, 0, True, [], list(state.items()))
+        else:
+            update = SyncUpdate(self.version, self.acked_version, False,
+                                [sync_id for sync_id in self.__acked_state if sync_id not in state],
+                                [(sync_id, encoded_entity) for sync_id, encoded_entity in state.items() if self.__acked_state.get(sync_id) != encoded_entity])
+
+        self.__force_keyframe = False
+        self.__sent_state = state
+        return encode_update(update)
+
+    def on_ack(self, received_version: int, held_version: int) -> bool:
+        """Returns True if the receiver could not apply the last sent version, so a keyframe should be sent to it right away"""
+        if received_version != self.version: # an ack to an older version, the ack to the last one is still on its way
+            return False
+        if held_version == received_version:
+            self.acked_version = held_version
+            self.__acked_state = self.__sent_state
+            return False
+        self.force_keyframe()
+        return True
+
+class EntitySyncReceiver:
+    def __init__(self) -> None:
+        self.version: int = 0
+        self.received_version: int = 0 # differs from version if the last update could not be applied
+        self.__encoded_entities: Dict[int, bytes] = {}
+        self.entities: Dict[int, Entity] = {}
+
+    def apply_update(self, data: bytes) -> Tuple[List[Entity], List[Entity]] | None:
+        """
+        Applies an update to the held entities.
+
+        :return: The entities that were removed and the entities that were added (a changed entity is removed and added again),
+                 or None if the update is a delta to a version that is not held, in which case nothing is changed.
+        """
+        update = parse_update(data)
+        self.received_version = update.version
+        if not update.keyframe and update.base_version != self.version:
+            return None
+
+        changed: List[Tuple[int, bytes, Entity]] = [(sync_id, encoded_entity, decode_entity(encoded_entity)) # decode everything first, so that a malformed update changes nothing
+                                                     for sync_id, encoded_entity in update.upserts
+                                                     if self.__encoded_entities.get(sync_id) != encoded_entity] # unchanged entities, e.g. in a keyframe, are not decoded again
+        removed: List[Entity] = []
+        added: List[Entity] = []
+        removed_ids = (set(self.entities) - {sync_id for sync_id, _ in update.upserts}) if update.keyframe else update.removed
+        for sync_id in removed_ids:
+            entity = self.entities.pop(sync_id, None)
+            if entity is not None:
+                removed.append(entity)
+                del self.__encoded_entities[sync_id]
+
+        for sync_id, encoded_entity, entity in changed:
+            if sync_id in self.entities:
+                removed.append(self.entities[sync_id])
+            self.entities[sync_id] = entity
+            self.__encoded_entities[sync_id] = encoded_entity
+            added.append(entity)
+
+        self.version = update.version
+        return removed, added
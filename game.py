@@ -1,63 +1,31 @@
 from os import system, name as _os_name
-import random
 from shared_definitions import *
+from entity_sync import EntitySyncSender, EntitySyncReceiver, encode_ack, decode_ack
+from renderer import TerminalRenderer, CLEAR_SCREEN
+from terminal_input import KeyReader, escape_sequences, KEY_POLL_INTERVAL
+from scene import SceneIndex, SceneLayer, SCENE_KEY
+from game_state import PlayerState
+from handshake import get_capabilities, parse_connection_established, get_compression
 from types import SimpleNamespace
+import selectors
+from typing import Set
 import sys
 import math
 
-if _os_name == "nt":
-    import msvcrt
-    def getch() -> str:
-        return msvcrt.getch().decode("latin-1")
-else:
-    import tty
-    import termios
-    def getch() -> str:
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        try:
-            tty.setraw(fd)
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
-    
-class escape_sequences:
-    if _os_name == "nt":
-        ESCAPE_SEQUENCE_LENGTH = 2
-
-        ESCAPE = "\xe0"
-        ARROW_UP = "\xe0H"
-        ARROW_DOWN = "\xe0P"
-        ARROW_LEFT = "\xe0K"
-        ARROW_RIGHT = "\xe0M"
-        CTRL_C = "\x03"
-    else:
-        ESCAPE_SEQUENCE_LENGTH = 3
+keyboard: KeyReader = KeyReader() # the terminal is switched to raw mode for the whole session in main()
 
-        ESCAPE = "\x1b"
-        ARROW_UP = "\x1b[A"
-        ARROW_DOWN = "\x1b[B"
-        ARROW_LEFT = "\x1b[D"
-        ARROW_RIGHT = "\x1b[C"
-        CTRL_C = "\x03"
+BROWSING_KEYS: Set[str] = {escape_sequences.ARROW_UP, escape_sequences.ARROW_DOWN, escape_sequences.ARROW_LEFT, escape_sequences.ARROW_RIGHT, escape_sequences.CTRL_C} # the keys that work during the opponent's turn
 
 def clear_screen() -> None:
-    system('cls' if _os_name == 'nt' else 'clear')
+    sys.stdout.write(CLEAR_SCREEN)
+    sys.stdout.flush()
+    GameController.renderer.invalidate()
 
 def close_game_on_space() -> None:
-    while getch() != ' ': pass
+    while keyboard.get_key() != ' ': pass
     GameController.close_game = True
     sys.exit()
 
-PLAYER_SIDE_HEIGHT: int = 4
-# coordinates should always be in the form of (x, y)
-FIGHTING_CARD_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 9)
-PHARAOH_COORDINATES = Coordinates(MIN_X + 10, MAX_Y - 3)
-GUARD_COORDINATES_LIST: List[Coordinates] = [Coordinates(MIN_X + 7, MAX_Y - 3), Coordinates(MIN_X + 13, MAX_Y - 3)]
-MAIN_WARRIOR_LIST_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 5)
-MAIN_BANDAGE_LIST_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 3)
-MAIN_BUILDING_LIST_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 1)
 ACTION_MENU_START_COORDINATES = Coordinates(MIN_X, MAX_Y + 1)
 
 DEFAULT_SCOPE_KEY = lambda e: (e.coords.y, e.coords.x)
@@ -94,6 +62,9 @@ class ActionEntry(Entity):
         self.action = action
         self.entity_requirements = entity_requirements
 
+def move_to_opponent_side(entity: Entity) -> None:
+    entity.set_coords(Coordinates(entity.coords.x, MIN_Y + abs(entity.coords.y - MAX_Y))) # reverse y coordinate of the received entity, so it will be displayed on the other player's side
+
 def execute_action(action_entry: ActionEntry, *entity_lists: List[Entity]) -> None:
     if entity_lists:
         action_entry.action(*entity_lists)
@@ -105,16 +76,18 @@ class GameController:
     player_num: int = 0
     player_color: str = colors.NONE
     my_turn: bool = False
-    my_entities: SortedList[Entity] = SortedList(key = lambda e: (e.coords.y, e.coords.x) if e.coords else (-1, -1)) # apparently fuckass SortedList uses its key even when checking for membership, so providing a value without coords just fucking crashes the program. this is why the check for e.coords is needed
-    received_entities: SortedList[Entity] = SortedList(key = DEFAULT_SCOPE_KEY)
-    fighting_card_slot: CardList = CardList(card_type = WarriorCard, coords = FIGHTING_CARD_COORDINATES, empty_label = True, max_size = 1, selectable = False)
-    main_warrior_list: CardList = CardList(card_type = WarriorCard, coords = MAIN_WARRIOR_LIST_COORDINATES, help_string = "This is your warrior list")
-    main_bandage_list: CardList = CardList(card_type = BandageCard, coords = MAIN_BANDAGE_LIST_COORDINATES)
-    main_building_list: CardList = CardList(card_type = BuildingCard, coords = MAIN_BUILDING_LIST_COORDINATES)
-    guard_list: List[GuardCard] = [GuardCard(coords = GUARD_COORDINATES_LIST[0]), GuardCard(coords = GUARD_COORDINATES_LIST[1])]
-    footer: SortedList[Entity] = SortedList(key = DEFAULT_SCOPE_KEY)
+    scene: SceneIndex = SceneIndex() # everything on the screen, kept up to date by the layers below
+    my_entities: SceneLayer = SceneLayer(scene, key = SCENE_KEY) # the cursor, whose coords are None while it is hidden, can be looked up in it
+    received_entities: SceneLayer = SceneLayer(scene, key = DEFAULT_SCOPE_KEY)
+    entity_sync_sender: EntitySyncSender = EntitySyncSender()
+    entity_sync_receiver: EntitySyncReceiver = EntitySyncReceiver()
+    player: PlayerState = PlayerState() # the board and the rules of the moves, GameController only shows it and sends it
+    footer: SceneLayer = SceneLayer(scene, key = DEFAULT_SCOPE_KEY)
     frozen_footer: bool = True
     cursor: Cursor = None # cursor is set outside of class body, because it needs a callback to a class method get_shift_to_free_space
+    renderer: TerminalRenderer = TerminalRenderer()
+    defer_refresh: bool = False # set while a batch of keys and messages is handled, so that the screen is refreshed once after it
+    refresh_pending: bool = False
 
     selection_mode: bool = False
     selection_mode_action: ActionEntry = None
@@ -123,35 +96,32 @@ class GameController:
     selection_mode_current_scope_index: int = 0
     selection_mode_selected_entities: List[List[Entity]] = []
 
-    current_action_menu: SortedList[Entity] = SortedList(key = DEFAULT_SCOPE_KEY)
+    current_action_menu: SceneLayer = SceneLayer(scene, key = DEFAULT_SCOPE_KEY)
     current_action_menu_owner: Entity = None
     
     second_player_joined: bool = False
+    resume_token: bytes | None = None # issued by the server in the handshake, None if it can not resume the session
 
     controls: Dict[str, Callable] = {}
     action_entries: SimpleNamespace = SimpleNamespace(
         upgrade_value_one_card = ActionEntry("Upgrade the value of a certain card", 
                     coords = (ACTION_MENU_START_COORDINATES.x + 2, ACTION_MENU_START_COORDINATES.y + 1 + len(current_action_menu)),
                     action = lambda list: (
-                        list[0].upgrade_value(), # there will only be one item, as specified in entity_requirements
+                        GameController.player.upgrade_value(GameController.current_action_menu_owner, list[0]), # there will only be one item, as specified in entity_requirements
                         GameController.send_public_entities(), 
                         GameController.end_turn()
                         ),
                     entity_requirements = Requirements(
                         quantities = [1],
                         requirements = [
-                            lambda e: (
-                                hasattr(type(e), "SUPPORTS_VALUE_UPGRADES") and type(e).SUPPORTS_VALUE_UPGRADES == True
-                            )
+                            lambda e: GameController.player.can_upgrade_value_of(e)
                         ]
                     ),
                     help_string = "Select 1 card whose value can be upgraded."),
         put_out_to_battle = ActionEntry("Put this card out to battle", 
                     coords = (ACTION_MENU_START_COORDINATES.x + 2, ACTION_MENU_START_COORDINATES.y + 1 + len(current_action_menu)),
                     action = lambda: (
-                        GameController.current_action_menu_owner.cardlist.remove(GameController.current_action_menu_owner),
-                        setattr(GameController.current_action_menu_owner, "help_string", "This is your fighting card"),
-                        GameController.fighting_card_slot.append(GameController.current_action_menu_owner),
+                        GameController.player.put_out_to_battle(GameController.current_action_menu_owner),
                         GameController.send_public_entities(),
                         GameController.end_turn()
                         ),
@@ -162,13 +132,10 @@ class GameController:
         raise RuntimeError(f"class {cls} is not meant to be instantiated")
 
     @classproperty
-    def all_entities(cls) -> SortedList[Entity]:
-        result = SortedList(cls.my_entities + cls.received_entities + cls.current_action_menu + cls.footer, key = DEFAULT_SCOPE_KEY)
-        if not cls.cursor.hidden:
-            if cls.cursor not in result:
-                result.add(cls.cursor)
-        
-        return result
+    def all_entities(cls) -> Iterable[Entity]:
+        if cls.cursor.hidden or cls.cursor in cls.scene:
+            return cls.scene
+        return SortedList([*cls.scene, cls.cursor], key = SCENE_KEY) # the cursor is in a scope of the selection mode, which is not a part of the scene
 
     @classproperty
     def default_footer(cls) -> Entity:
@@ -260,10 +227,6 @@ class GameController:
         result += "\n" # flush the buffer while also moving the cursor to the next line(to avoid distracting players)
         return result
 
-    @classmethod
-    def display_game_field(cls, game_field_string: str) -> None:
-        print(game_field_string, end="")
-
     @classmethod
     def set_footer(cls, entity: Entity | List[Entity]) -> SortedList[Entity]:
         cls.footer.clear()
@@ -282,61 +245,83 @@ class GameController:
         )
 
         for shift_x, shift_y in shifts:
-            dummy_entity = Entity("", coords = Coordinates(entity.coords.x + shift_x, entity.coords.y + shift_y))
-            index_of_the_shift = cls.all_entities.bisect_right(dummy_entity)
-            closest_left: Entity = cls.all_entities[index_of_the_shift - 1] if index_of_the_shift > 0 else None
-            if closest_left.coords.x + len(closest_left.content) <= (entity.coords.x + shift_x):
+            if cls.scene.is_free(entity.coords.x + shift_x, entity.coords.y + shift_y):
                 return (shift_x, shift_y)
             
         return None
 
     @classmethod
     def refresh_screen(cls) -> None:
-        game_field_string = cls.get_game_field_string()
-        clear_screen()
-        cls.display_game_field(game_field_string)
+        if cls.defer_refresh:
+            cls.refresh_pending = True
+            return
+        cls.refresh_pending = False
+        cls.renderer.render(flatten_iterable(cls.all_entities))
 
     @classmethod
     def send_public_entities(cls) -> None:
-        ready_to_read, _, _ = select.select([s], [], [], 0) # if the server has something to say at this point - it's an error
-        if ready_to_read:
-            recvall(s) # read the error
-
-        public_entities: List[Entity] = []
-        for public_entity in [e for e in cls.my_entities if e.public]:
-            if isinstance(public_entity, CardList):
-                public_entities.append(public_entity.get_public_slice())
+        ready_to_read, _, _ = select.select([server], [], [], 0) # handle whatever the server has sent before, acks in particular
+        while ready_to_read or server.has_buffered_data():
+            message_type, payload = server.recv_message() # an error is raised from here
+            if message_type == SOCKET_ENTITIES_ACK:
+                cls.on_entities_ack(payload, resend = False) # the update sent below is a keyframe anyway if the receiver is out of sync
             else:
-                public_entities.append(public_entity)
-        sendall_with_end(s, SOCKET_SHARED_ENTITIES_UPDATE)
-        sendall_with_end(s, pickle.dumps(public_entities))
+                cls.on_server_message(message_type, payload)
+            ready_to_read, _, _ = select.select([server], [], [], 0)
+
+        server.send_message(SOCKET_SHARED_ENTITIES_UPDATE, cls.entity_sync_sender.encode_update([e for e in cls.my_entities if e.public]))
 
     @classmethod
-    def receive_public_entities(cls) -> bool:
-        encoded_data: bytes = recvall(s)
-        if encoded_data == SOCKET_SHARED_ENTITIES_UPDATE:
-            received_entities: List[Entity] = pickle.loads(recvall(s))
-            cls.received_entities.clear() # clear previously received entities
-            for entity in received_entities:
-                entity.set_coords(Coordinates(entity.coords.x, MIN_Y + abs(entity.coords.y - MAX_Y))) # reverse y coordinate of the received entity, so it will be displayed on the other player's side
-                cls.received_entities.add(entity)
-            return True
-        elif encoded_data == SOCKET_YOUR_TURN:
+    def on_entities_ack(cls, payload: bytes, resend: bool = True) -> None:
+        received_version, held_version = decode_ack(payload)
+        if cls.entity_sync_sender.on_ack(received_version, held_version) and resend:
+            cls.send_public_entities()
+
+    @classmethod
+    def on_server_message(cls, message_type: int, payload: bytes) -> None:
+        if message_type == SOCKET_ENTITIES_ACK:
+            cls.on_entities_ack(payload)
+        elif message_type == SOCKET_SHARED_ENTITIES_UPDATE:
+            cls.on_entities_update(payload)
+            cls.second_player_joined = True
+        elif message_type == SOCKET_YOUR_TURN:
             cls.my_turn = True
-            return False
+
+    @classmethod
+    def add_player_side_borders(cls) -> None:
+        cls.my_entities.add(Entity(content = PLAYER_SIDE_BORDER, 
+                                   coords = (MIN_X + 1, MAX_Y - (PLAYER_SIDE_HEIGHT + 2)), 
+                                   color = cls.player_color))
+        cls.my_entities.add(Entity(content = PLAYER_SIDE_BORDER, 
+                                   coords = (MIN_X + 1, MIN_Y + (PLAYER_SIDE_HEIGHT + 2)), 
+                                   color = PLAYER_COLORS[1 + (cls.player_num + 1 - 1) % (len(PLAYER_COLORS) - 1)]))
+                                   # the color is taken from PLAYER_COLORS by adding 1 to the player_num and wrapping around back to index 1 if player_num + 1 is out of bounds
+
+    @classmethod
+    def on_entities_update(cls, payload: bytes) -> None:
+        changes = cls.entity_sync_receiver.apply_update(payload)
+        if changes is not None: # otherwise the update was a delta to a version we don't hold, the ack below makes the opponent send a keyframe
+            removed, added = changes
+            for entity in removed:
+                cls.received_entities.remove(entity)
+            for entity in added:
+                move_to_opponent_side(entity)
+                cls.received_entities.add(entity)
+            cls.refresh_screen()
+        server.send_message(SOCKET_ENTITIES_ACK, encode_ack(cls.entity_sync_receiver.received_version, cls.entity_sync_receiver.version))
         
     @classmethod
     def end_turn(cls) -> None:
         cls.my_turn = False
-        sendall_with_end(s, SOCKET_YOUR_TURN)
+        server.send_message(SOCKET_YOUR_TURN)
     
     @classmethod
     def open_action_menu(cls, entity: Entity) -> bool: # True if the menu was opened, False otherwise
         menu: List[Entity] = []
 
-        if isinstance(entity, BandageCard) and entity.content == face_values.FACE_VALUE_BANDAGE:
+        if cls.player.can_upgrade_value_with(entity):
             menu.append(GameController.action_entries.upgrade_value_one_card)
-        if isinstance(entity, WarriorCard) and not isinstance(entity, GuardCard) and len(GameController.fighting_card_slot) == 0:
+        if cls.player.can_put_out_to_battle(entity):
             menu.append(GameController.action_entries.put_out_to_battle)
             
         if not menu:
@@ -374,68 +359,14 @@ class GameController:
     def update_footer_location(cls) -> None:
         current_footer_coords = cls.footer[0].coords
         new_footer_coords = cls.get_footer_start_coordinates()
-        for e in cls.footer:
-            e.set_coords(Coordinates(e.coords.x, e.coords.y + (new_footer_coords.y - current_footer_coords.y)))
+        for e in list(cls.footer):
+            cls.footer.move(e, Coordinates(e.coords.x, e.coords.y + (new_footer_coords.y - current_footer_coords.y)))
 
 GameController.cursor = Cursor(GameController.get_shift_to_free_space, scope = GameController.my_entities, on_select = lambda: (
     GameController.set_footer(GameController.default_footer) if not GameController.frozen_footer else "",
     GameController.refresh_screen()
     ))
 
-##### CARD DRAWING #####
-@overload
-def draw_a_card(card_type: type[Card], to_cardlist: CardList, public: bool, cruelty: int = 10) -> None:
-    """
-    Draw a card of the given card class.
-
-    :param card_type: The Card class to instantiate. Must define a COUNT attribute representing the number of possible unique cards of this type.
-    :type card_type: type[Card]
-    
-    :param to_cardlist: The list where the drawn card will be appended.
-    :type to_cardlist: CardList
-
-    :param public: Whether the drawn card should be marked as public.
-    :type public: bool
-
-    :param cruelty: The bigger the number - the rarer are the strong cards.
-    :type cruelty: int
-    """
-
-
-@overload
-def draw_a_card(card_pool: List[Card], to_cardlist: CardList, public: bool, cruelty: int = 10) -> None:
-    """
-    Draw a card from a provided list of cards.
-
-    :param card_pool: A list of Card objects to draw from.
-    :type card_pool: List[Card]
-
-    :param to_cardlist: The list where the drawn card will be appended.
-    :type to_cardlist: CardList
-
-    :param public: Whether the drawn card should be marked as public.
-    :type public: bool
-
-    :param cruelty: The bigger the number - the rarer are the strong cards.
-    :type cruelty: int
-    """
-
-def draw_a_card(source: type[Card] | List[Card], to_cardlist: CardList, public: bool, cruelty: int = 10) -> None:
-    r = random.random()
-    drawing_function = lambda count: min(int((r ** cruelty) * count), count - 1)
-
-    if isinstance(source, list):
-        count = len(source)
-        index = drawing_function(count)
-        drawn_card = source[index]
-    else:
-        count = source.COUNT
-        state_index = drawing_function(count)
-        drawn_card = source(state_index = state_index, public = public)
-
-    to_cardlist.append(drawn_card)
-#####
-
 def on_spacebar() -> None:
     if GameController.selection_mode:
         GameController.get_selection()
@@ -473,133 +404,190 @@ for y in range(MIN_Y + 1, MAX_Y):
     GameController.my_entities.update([Entity(content = LATERAL_FIELD_BORDER_CHARACTER, coords = (MIN_X, y)),
                                        Entity(content = LATERAL_FIELD_BORDER_CHARACTER, coords = (MAX_X, y))])
 
-GameController.set_footer(Entity("Press spacebar when you are ready.", colors.NONE, coords = GameController.get_footer_start_coordinates()))
-GameController.refresh_screen()
-while ' ' != getch(): pass
-clear_screen()
-print("Connecting to the server...")
+server: Connection = None # the connection to the server, it is established in main()
 
-s: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-try:
-    s.connect((HOST, PORT))
-    sendall_with_end(s, SOCKET_CONNECTION_ESTABLISHED)
-    data: bytes = recvall(s) # receive SOCKET_CONNECTION_ESTABLISHED or SOCKET_LOBBY_FULL
-    if data == SOCKET_LOBBY_FULL:
-        clear_screen()
-        print("The game has already started, please wait until it is finished. Press spacebar to exit.")
-        GameController.close_game = True
-        while ' ' != getch(): pass
-        sys.exit()
-    data = recvall(s) # receive player number
-
-    GameController.player_num = int.from_bytes(data)
-    GameController.player_color = PLAYER_COLORS[GameController.player_num]
-    GameController.set_footer(Entity(f"Waiting for the second player to join...", colors.NONE, coords = GameController.get_footer_start_coordinates()))
-
-    GameController.my_entities.add(Entity(content = PLAYER_SIDE_BORDER, 
-                                          coords = (MIN_X + 1, MAX_Y - (PLAYER_SIDE_HEIGHT + 2)), 
-                                          color = GameController.player_color))
-    GameController.my_entities.add(Entity(content = PLAYER_SIDE_BORDER, 
-                                          coords = (MIN_X + 1, MIN_Y + (PLAYER_SIDE_HEIGHT + 2)), 
-                                          color = PLAYER_COLORS[1 + (GameController.player_num + 1 - 1) % (len(PLAYER_COLORS) - 1)]))
-                                          # the color is taken from PLAYER_COLORS by adding 1 to the player_num and wrapping around back to index 1 if player_num + 1 is out of bounds
-    if GameController.player_num == 1:
-        GameController.my_turn = True
-    
-    GameController.my_entities.add(Entity(content = PHARAOH, coords = PHARAOH_COORDINATES, color = colors.WHITE, public=True))
+def resume_session() -> bool:
+    """Connects again after the connection to the server was lost, False if the session can not be resumed"""
+    global server
+    if GameController.resume_token is None:
+        return False
+    GameController.set_footer(Entity("The connection to the server was lost, reconnecting...", colors.NONE, coords = GameController.get_footer_start_coordinates()))
+    GameController.refresh_screen()
+    server.sock.close()
+    deadline = time.monotonic() + RESUME_GRACE
+    while time.monotonic() < deadline:
+        try:
+            s = socket.create_connection((HOST, PORT), timeout = HEARTBEAT_TIMEOUT) # the timeout covers the handshake too
+            server = Connection(s)
+            set_keepalive(s)
+            server.send_message(SOCKET_CONNECTION_ESTABLISHED, get_capabilities(GameController.resume_token))
+            message_type, payload = server.recv_message() # TerminationRequest is raised if the session has ended
+            if message_type == SOCKET_LOBBY_FULL:
+                return False
+            s.settimeout(None)
+            established = parse_connection_established(payload)
+            server.compression = get_compression(established.accepted)
+            GameController.my_turn = established.current_player_num == GameController.player_num
+            # the opponent's entities arrive right after the reply, ours may have been lost on the way, so a keyframe is sent
+            GameController.entity_sync_sender.force_keyframe()
+            GameController.send_public_entities()
+            return True
+        except OSError: # e.g. the network is still down
+            server.sock.close()
+            time.sleep(RESUME_RETRY_INTERVAL)
+        except TerminationRequest:
+            return False
+    return False
 
-    for guard_card in GameController.guard_list:
-        GameController.my_entities.add(guard_card)
+def on_key(key: str) -> None:
+    if key not in GameController.controls:
+        return
+    if not (GameController.my_turn and GameController.second_player_joined) and key not in BROWSING_KEYS:
+        return
+    GameController.controls[key]()
 
-    GameController.my_entities.add(GameController.main_warrior_list)
-    GameController.my_entities.add(GameController.main_bandage_list)
-    GameController.my_entities.add(GameController.main_building_list)
-    GameController.my_entities.add(GameController.fighting_card_slot)
+def main() -> None:
+    with keyboard: # raw mode is kept until the game is closed
+        run_game()
 
+def run_game() -> None:
+    global server
+    if _os_name == "nt":
+        system("") # enables ANSI escape sequences in the Windows console
+    GameController.set_footer(Entity("Press spacebar when you are ready.", colors.NONE, coords = GameController.get_footer_start_coordinates()))
     GameController.refresh_screen()
+    while ' ' != keyboard.get_key(): pass
+    clear_screen()
+    print("Connecting to the server...")
 
-    GameController.send_public_entities()
-    GameController.receive_public_entities()
-
-    GameController.second_player_joined = True
-
-    GameController.controls = {
-        escape_sequences.CTRL_C: lambda: (
-            (_ for _ in []).throw(KeyboardInterrupt) # a small hack to raise exceptions from lambda functions
-            ),
-        escape_sequences.ARROW_UP: GameController.cursor.select_previous,
-        escape_sequences.ARROW_LEFT: GameController.cursor.select_previous,
-        escape_sequences.ARROW_DOWN: GameController.cursor.select_next,
-        escape_sequences.ARROW_RIGHT: GameController.cursor.select_next,
-        ' ': on_spacebar,
-        'q': on_q,
-        '1': lambda: (
-            draw_a_card(WarriorCard, GameController.main_warrior_list, public = True), 
-            GameController.refresh_screen(), 
-            GameController.send_public_entities(),
-            GameController.end_turn()
-            ),
-        '2': lambda: (
-            draw_a_card(BandageCard, GameController.main_bandage_list, public = True),
-            GameController.refresh_screen(), 
-            GameController.send_public_entities(), 
-            GameController.end_turn()
-            )
-    }
-
-    GameController.main_bandage_list.append(BandageCard(state = CardState(card_type = BandageCard, level = colors.GREEN, face_value = face_values.FACE_VALUE_BANDAGE)))
-
-    while not GameController.close_game:
-        if GameController.my_turn:
-            if _os_name == "nt":
-                while msvcrt.kbhit():
-                    getch()
-
-            GameController.set_footer(Entity("It's your turn", colors.NONE, coords = GameController.get_footer_start_coordinates()))
-            GameController.cursor.show()
-            GameController.frozen_footer = False
-
-            while GameController.my_turn:
-                key = getch()
-                if key == escape_sequences.ESCAPE:
-                    for i in range(escape_sequences.ESCAPE_SEQUENCE_LENGTH - 1):
-                        key += getch()
-
-                if key not in GameController.controls:
-                    continue
-                else:
-                    GameController.controls[key]()
-        else:
-            while len(GameController.cursor.scope_stack) > 1: # move cursor back to top
-                GameController.cursor.scope_backward()
-            
-            if GameController.current_action_menu != []:
-                GameController.close_action_menu()
-
-            GameController.cursor.hide()
+    s: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server = Connection(s)
 
-            GameController.frozen_footer = True
-            GameController.set_footer(Entity("It's your opponent's turn", colors.NONE, coords = GameController.get_footer_start_coordinates()))
-            GameController.refresh_screen()
+    try:
+        s.connect((HOST, PORT))
+        set_keepalive(s)
+        server.send_message(SOCKET_CONNECTION_ESTABLISHED, get_capabilities())
+        message_type, payload = server.recv_message() # receive SOCKET_CONNECTION_ESTABLISHED with the player number and the accepted capabilities, or SOCKET_LOBBY_FULL
+        if message_type == SOCKET_LOBBY_FULL:
+            clear_screen()
+            print("The server is full, please try again later. Press spacebar to exit.")
+            GameController.close_game = True
+            while ' ' != keyboard.get_key(): pass
+            sys.exit()
+
+        established = parse_connection_established(payload)
+        GameController.player_num, GameController.resume_token = established.player_num, established.resume_token
+        server.compression = get_compression(established.accepted)
+        GameController.player_color = PLAYER_COLORS[GameController.player_num]
+        GameController.set_footer(Entity(f"Waiting for the second player to join...", colors.NONE, coords = GameController.get_footer_start_coordinates()))
+
+        GameController.add_player_side_borders()
+        GameController.my_turn = established.current_player_num == GameController.player_num
+    
+        GameController.my_entities.update(GameController.player.public_entities)
 
-            while GameController.receive_public_entities():
-                GameController.refresh_screen()
+        GameController.refresh_screen()
 
-except (KeyboardInterrupt): # KeyboardInterrupt
-    sys.exit()
+        GameController.send_public_entities()
+
+        GameController.controls = {
+            escape_sequences.CTRL_C: lambda: (
+                (_ for _ in []).throw(KeyboardInterrupt) # a small hack to raise exceptions from lambda functions
+                ),
+            escape_sequences.ARROW_UP: GameController.cursor.select_previous,
+            escape_sequences.ARROW_LEFT: GameController.cursor.select_previous,
+            escape_sequences.ARROW_DOWN: GameController.cursor.select_next,
+            escape_sequences.ARROW_RIGHT: GameController.cursor.select_next,
+            ' ': on_spacebar,
+            'q': on_q,
+            '1': lambda: (
+                GameController.player.draw_card(WarriorCard), 
+                GameController.refresh_screen(), 
+                GameController.send_public_entities(),
+                GameController.end_turn()
+                ),
+            '2': lambda: (
+                GameController.player.draw_card(BandageCard),
+                GameController.refresh_screen(), 
+                GameController.send_public_entities(), 
+                GameController.end_turn()
+                )
+        }
+
+        GameController.player.deal_starting_hand()
+
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        if keyboard.selectable:
+            selector.register(keyboard, selectors.EVENT_READ)
+
+        GameController.cursor.show() # the hand can be browsed from the start, acting is only possible on your turn
+        shown_turn: bool | None = None # whose turn the footer currently announces
+        while not GameController.close_game:
+            try:
+                if GameController.second_player_joined and shown_turn != GameController.my_turn:
+                    shown_turn = GameController.my_turn
+                    if GameController.my_turn:
+                        GameController.set_footer(Entity("It's your turn", colors.NONE, coords = GameController.get_footer_start_coordinates()))
+                        GameController.frozen_footer = False
+                    else:
+                        while len(GameController.cursor.scope_stack) > 1: # move cursor back to top
+                            GameController.cursor.scope_backward()
+                
+                        if GameController.current_action_menu != []:
+                            GameController.close_action_menu()
+
+                        GameController.frozen_footer = True
+                        GameController.set_footer(Entity("It's your opponent's turn", colors.NONE, coords = GameController.get_footer_start_coordinates()))
+                    GameController.refresh_screen()
+
+                idle_timeout = (HEARTBEAT_INTERVAL / 2 if HEARTBEAT_INTERVAL > 0 else None) if keyboard.selectable else KEY_POLL_INTERVAL # wake up in time for the heartbeats
+                selector.select(0 if server.has_buffered_data() else idle_timeout)
+                GameController.defer_refresh = True # everything that has arrived is handled before the screen is refreshed once
+                try:
+                    while server.has_buffered_data() or select.select([server], [], [], 0)[0]:
+                        GameController.on_server_message(*server.recv_message())
+                    for key in keyboard.read_keys():
+                        on_key(key)
+                finally:
+                    GameController.defer_refresh = False
+                if GameController.refresh_pending:
+                    GameController.refresh_screen()
+
+                now = time.monotonic()
+                if has_timed_out(server, now):
+                    raise ConnectionError("the server has stopped sending heartbeats")
+                if needs_heartbeat(server, now):
+                    server.send_message(SOCKET_HEARTBEAT)
+
+            except (BrokenPipeError, ConnectionError): # the connection was lost, the session may still be resumed
+                selector.unregister(server)
+                if not resume_session():
+                    raise
+                selector.register(server, selectors.EVENT_READ)
+                shown_turn = None
+
+    except (KeyboardInterrupt): # KeyboardInterrupt
+        try: # the game is left on purpose, so the server ends it right away instead of keeping the place of the player
+            server.send_message(SOCKET_TERMINATION_REQUEST)
+        except OSError:
+            pass
+        sys.exit()
 
-except (ConnectionRefusedError, TimeoutError, ConnectionResetError): # the error occurs while trying to establish the connection
-    clear_screen()
-    print("Server is offline, unable to connect. Press spacebar to exit.")
-    close_game_on_space()
+    except (ConnectionRefusedError, TimeoutError, ConnectionResetError): # the error occurs while trying to establish the connection
+        clear_screen()
+        print("Server is offline, unable to connect. Press spacebar to exit.")
+        close_game_on_space()
 
-except (BrokenPipeError, ConnectionError): # the error occurs while trying to send or read data from the server
-    clear_screen()
-    print("Server has disconnected. Press spacebar to exit.")
-    close_game_on_space()
+    except (BrokenPipeError, ConnectionError): # the error occurs while trying to send or read data from the server
+        clear_screen()
+        print("Server has disconnected. Press spacebar to exit.")
+        close_game_on_space()
     
-except TerminationRequest: # received a termination request from the server
-    clear_screen()
-    print("Your opponent has disconnected, unable to continue. Press spacebar to exit.")
-    close_game_on_space()
\ No newline at end of file
+    except TerminationRequest: # received a termination request from the server
+        clear_screen()
+        print("Your opponent has disconnected, unable to continue. Press spacebar to exit.")
+        close_game_on_space()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+The rules of the game as plain objects without any terminal or socket I/O, so that a process can hold any number of games:
+the client (game.py) and the bots keep their own board in a PlayerState, server-side checks and simulations can hold whole
+games in GameStates.
+
+A PlayerState is the board of one player together with the moves that can be made on it. A GameState is a game between two
+players, who make their moves in turns. Both are cheap to clone(), e.g. to try a move out without changing the original.
+"""
+
+from shared_definitions import *
+
+class IllegalMove(ValueError):
+    pass
+
+class PlayerState:
+    def __init__(self) -> None:
+        self.pharaoh: Entity = Entity(content = PHARAOH, coords = PHARAOH_COORDINATES, color = colors.WHITE, public = True)
+        self.guard_list: List[GuardCard] = [GuardCard(coords = GUARD_COORDINATES_LIST[0]), GuardCard(coords = GUARD_COORDINATES_LIST[1])]
+        self.fighting_card_slot: CardList = CardList(card_type = WarriorCard, coords = FIGHTING_CARD_COORDINATES, empty_label = True, max_size = 1, selectable = False)
+        self.main_warrior_list: CardList = CardList(card_type = WarriorCard, coords = MAIN_WARRIOR_LIST_COORDINATES, help_string = "This is your warrior list")
+        self.main_bandage_list: CardList = CardList(card_type = BandageCard, coords = MAIN_BANDAGE_LIST_COORDINATES)
+        self.main_building_list: CardList = CardList(card_type = BuildingCard, coords = MAIN_BUILDING_LIST_COORDINATES)
+
+    @property
+    def card_lists(self) -> List[CardList]:
+        return [self.main_warrior_list, self.main_bandage_list, self.main_building_list, self.fighting_card_slot]
+
+    @property
+    def public_entities(self) -> List[Entity]:
+        """Everything on the board, which is what the opponent gets to see of it"""
+        return [self.pharaoh, *self.guard_list, *self.card_lists]
+
+    def deal_starting_hand(self) -> None:
+        self.main_bandage_list.append(BandageCard(state = CardState(card_type = BandageCard, level = colors.GREEN, face_value = face_values.FACE_VALUE_BANDAGE)))
+
+    def owns(self, card: Card) -> bool:
+        return any(card.cardlist is card_list for card_list in self.card_lists) or any(card is guard for guard in self.guard_list)
+
+    def clone(self) -> 'PlayerState':
+        clone = PlayerState.__new__(PlayerState)
+        clone.pharaoh = Entity(content = self.pharaoh.content, coords = self.pharaoh.coords, color = self.pharaoh.color, public = self.pharaoh.public)
+        clone.guard_list = [guard.copy() for guard in self.guard_list]
+        clone.fighting_card_slot = self.fighting_card_slot.copy()
+        clone.main_warrior_list = self.main_warrior_list.copy()
+        clone.main_bandage_list = self.main_bandage_list.copy()
+        clone.main_building_list = self.main_building_list.copy()
+        return clone
+
+    ##### MOVES #####
+    # the can_* checks tell whether a move is allowed, the moves themselves raise IllegalMove if it is not
+
+    def can_upgrade_value_with(self, bandage: Entity) -> bool:
+        return isinstance(bandage, BandageCard) and bandage.content == face_values.FACE_VALUE_BANDAGE and bandage.cardlist is self.main_bandage_list
+
+    def can_upgrade_value_of(self, card: Entity) -> bool:
+        return isinstance(card, Card) and type(card).SUPPORTS_VALUE_UPGRADES and self.owns(card)
+
+    def can_put_out_to_battle(self, card: Entity) -> bool:
+        return isinstance(card, WarriorCard) and card.cardlist is self.main_warrior_list and len(self.fighting_card_slot) == 0
+
+    def draw_card(self, card_type: Type[Card], rng: random.Random | None = None, cruelty: int = 10) -> None:
+        card_lists: Dict[Type[Card], CardList] = {WarriorCard: self.main_warrior_list, BandageCard: self.main_bandage_list}
+        if card_type not in card_lists:
+            raise IllegalMove(f"{card_type.TYPE_NAME} cannot be drawn")
+        draw_a_card(card_type, card_lists[card_type], public = True, cruelty = cruelty, rng = rng)
+
+    def upgrade_value(self, bandage: BandageCard, card: Card) -> None:
+        """Upgrades the value of a card with a face value bandage, the bandage stays in the hand"""
+        if not self.can_upgrade_value_with(bandage):
+            raise IllegalMove(f"{bandage} cannot upgrade the value of a card")
+        if not self.can_upgrade_value_of(card):
+            raise IllegalMove(f"the value of {card} cannot be upgraded")
+        card.upgrade_value()
+
+    def put_out_to_battle(self, warrior: WarriorCard) -> None:
+        if not self.can_put_out_to_battle(warrior):
+            raise IllegalMove(f"{warrior} cannot be put out to battle")
+        self.main_warrior_list.remove(warrior)
+        warrior.help_string = "This is your fighting card"
+        self.fighting_card_slot.append(warrior)
+    #####
+
+class GameState:
+    """A game between the players 1 and 2, the moves are made by the player whose turn it is and every move ends the turn"""
+    def __init__(self, rng: random.Random | None = None, cruelty: int = 10) -> None:
+        self.rng = rng or random.Random()
+        self.cruelty = cruelty
+        self.players: Dict[int, PlayerState] = {1: PlayerState(), 2: PlayerState()}
+        self.current_player_num: int = 1
+        self.turn: int = 1
+        for player in self.players.values():
+            player.deal_starting_hand()
+
+    @property
+    def current_player(self) -> PlayerState:
+        return self.players[self.current_player_num]
+
+    @property
+    def opponent(self) -> PlayerState:
+        return self.players[3 - self.current_player_num]
+
+    def clone(self) -> 'GameState':
+        """An independent copy, whose random number generator continues from the same state"""
+        clone = GameState.__new__(GameState)
+        clone.rng = random.Random()
+        clone.rng.setstate(self.rng.getstate())
+        clone.cruelty = self.cruelty
+        clone.players = {player_num: player.clone() for player_num, player in self.players.items()}
+        clone.current_player_num = self.current_player_num
+        clone.turn = self.turn
+        return clone
+
+    def end_turn(self) -> None:
+        self.current_player_num = 3 - self.current_player_num
+        self.turn += 1
+
+    def draw_card(self, card_type: Type[Card]) -> None:
+        self.current_player.draw_card(card_type, rng = self.rng, cruelty = self.cruelty)
+        self.end_turn()
+
+    def upgrade_value(self, bandage: BandageCard, card: Card) -> None:
+        self.current_player.upgrade_value(bandage, card)
+        self.end_turn()
+
+    def put_out_to_battle(self, warrior: WarriorCard) -> None:
+        self.current_player.put_out_to_battle(warrior)
+        self.end_turn()
@@ -0,0 +1,139 @@
+"""
+The capability handshake of SOCKET_CONNECTION_ESTABLISHED.
+
+The client offers its capabilities in the payload of its SOCKET_CONNECTION_ESTABLISHED:
+    capability flags (1 byte) | id of its compression dictionary (4 bytes) | resume token (16 bytes, only when resuming)
+and the server replies with:
+    player number (1 byte) | accepted flags (1 byte) | resume token (16 bytes) | the player whose turn it is (1 byte) | resumed (1 byte)
+where everything after the accepted flags is only sent if CAPABILITY_RESUME was accepted. Clients that send an empty payload
+get the old reply of only the player number, so they never see anything they do not understand.
+
+A resume token is issued to every player that offers CAPABILITY_RESUME. A client that has lost its connection connects again
+and offers its token: within RESUME_GRACE seconds the server puts it back into its session (see server.py), later it answers
+with SOCKET_TERMINATION_REQUEST. The token starts with the session id, so the main process of a server with worker processes
+knows which worker holds the session.
+
+A spectator sends SOCKET_SPECTATE instead:
+    id of the session to watch (4 bytes, 0 for the busiest one) | capabilities as above, without a resume token
+and the server replies with SOCKET_SPECTATE:
+    session id (4 bytes) | accepted flags (1 byte) | the player whose turn it is (1 byte)
+followed by a keyframe of each player. Then the spectator gets the SOCKET_SHARED_ENTITIES_UPDATE and SOCKET_YOUR_TURN of
+both players, their payload prefixed with the number of the player the message is about (the one whose turn starts for
+SOCKET_YOUR_TURN). It is never sent SOCKET_ENTITIES_ACK and sends nothing but heartbeats, so a spectator that could not keep
+up is sent keyframes again instead of being asked for acks (see server.py). SOCKET_TERMINATION_REQUEST answers a request for
+a session that does not exist, and ends the stream when the match is over; SOCKET_LOBBY_FULL tells that the match has
+MAX_SPECTATORS spectators already.
+"""
+
+from shared_definitions import *
+from compression import COMPRESSION, PayloadCompression, get_dictionary_id
+import secrets
+
+CAPABILITY_COMPRESSION: int = 1 << 0
+CAPABILITY_RESUME: int = 1 << 1
+CAPABILITIES: struct.Struct = struct.Struct("!BI") # flags, dictionary id
+RESUME_TOKEN: struct.Struct = struct.Struct("!I12s") # session id, a random secret
+RESUME_STATE: struct.Struct = struct.Struct(f"!{RESUME_TOKEN.size}sBB") # resume token, current player number, resumed
+SPECTATE_REQUEST: struct.Struct = struct.Struct("!I") # session id, followed by the capabilities
+SPECTATE_REPLY: struct.Struct = struct.Struct("!IBB") # session id, accepted flags, current player number
+HANDSHAKE_PEEK_SIZE: int = SOCKET_FRAME_HEADER.size + CAPABILITIES.size + RESUME_TOKEN.size # enough of a client's first frame for peek_session_id()
+
+Capabilities = namedtuple("Capabilities", ["flags", "dictionary_id", "resume_token"]) # resume_token is None unless the client resumes
+ConnectionEstablished = namedtuple("ConnectionEstablished", ["player_num", "accepted", "resume_token", "current_player_num", "resumed"])
+
+def get_capabilities(resume_token: bytes | None = None) -> bytes:
+    """The payload of the client's SOCKET_CONNECTION_ESTABLISHED"""
+    flags = (CAPABILITY_COMPRESSION if COMPRESSION else 0) | (CAPABILITY_RESUME if RESUME_GRACE > 0 else 0)
+    return CAPABILITIES.pack(flags, get_dictionary_id() if COMPRESSION else 0) + (resume_token or b"")
+
+def parse_capabilities(payload: bytes) -> Capabilities | None:
+    """None if the client did not offer any (an old client, whose reply must not change)"""
+    if not payload:
+        return None
+    if len(payload) < CAPABILITIES.size:
+        return Capabilities(0, 0, None)
+    flags, dictionary_id = CAPABILITIES.unpack_from(payload)
+    resume_token = payload[CAPABILITIES.size:CAPABILITIES.size + RESUME_TOKEN.size]
+    return Capabilities(flags, dictionary_id, resume_token if len(resume_token) == RESUME_TOKEN.size and flags & CAPABILITY_RESUME else None)
+
+def accept_capabilities(capabilities: Capabilities | None) -> int | None:
+    """The flags the server agrees to, None for an old client"""
+    if capabilities is None:
+        return None
+    accepted = 0
+    if capabilities.flags & CAPABILITY_COMPRESSION and COMPRESSION and capabilities.dictionary_id == get_dictionary_id():
+        accepted |= CAPABILITY_COMPRESSION
+    if capabilities.flags & CAPABILITY_RESUME and RESUME_GRACE > 0:
+        accepted |= CAPABILITY_RESUME
+    return accepted
+
+def get_connection_established(player_num: int, accepted: int | None, resume_token: bytes = b"", current_player_num: int = 1, resumed: bool = False) -> bytes:
+    """The payload of the server's SOCKET_CONNECTION_ESTABLISHED"""
+    payload = player_num.to_bytes() + (bytes((accepted,)) if accepted is not None else b"")
+    if accepted is not None and accepted & CAPABILITY_RESUME:
+        payload += RESUME_STATE.pack(resume_token, current_player_num, resumed)
+    return payload
+
+def parse_connection_established(payload: bytes) -> ConnectionEstablished:
+    """An old server accepts nothing and can not resume"""
+    player_num, accepted = payload[0], payload[1] if len(payload) > 1 else 0
+    if accepted & CAPABILITY_RESUME and len(payload) >= 2 + RESUME_STATE.size:
+        resume_token, current_player_num, resumed = RESUME_STATE.unpack_from(payload, 2)
+        return ConnectionEstablished(player_num, accepted, resume_token, current_player_num, bool(resumed))
+    return ConnectionEstablished(player_num, accepted, None, 1, False)
+
+def get_compression(accepted: int | None) -> PayloadCompression | None:
+    return PayloadCompression() if accepted is not None and accepted & CAPABILITY_COMPRESSION else None
+
+##### RESUME TOKENS #####
+def new_resume_token(session_id: int) -> bytes:
+    return RESUME_TOKEN.pack(session_id, secrets.token_bytes(RESUME_TOKEN.size - 4))
+
+def get_resume_session_id(resume_token: bytes) -> int:
+    return RESUME_TOKEN.unpack(resume_token)[0]
+#####
+
+##### SPECTATORS #####
+def get_spectate_request(session_id: int = 0) -> bytes:
+    return SPECTATE_REQUEST.pack(session_id) + get_capabilities()
+
+def parse_spectate_request(payload: bytes) -> Tuple[int, Capabilities | None]:
+    if len(payload) < SPECTATE_REQUEST.size:
+        return 0, None
+    capabilities = parse_capabilities(payload[SPECTATE_REQUEST.size:])
+    if capabilities is not None: # spectators never resume
+        capabilities = Capabilities(capabilities.flags & ~CAPABILITY_RESUME, capabilities.dictionary_id, None)
+    return SPECTATE_REQUEST.unpack_from(payload)[0], capabilities
+
+def get_spectate_reply(session_id: int, accepted: int | None, current_player_num: int) -> bytes:
+    return SPECTATE_REPLY.pack(session_id, accepted or 0, current_player_num)
+
+def parse_spectate_reply(payload: bytes) -> Tuple[int, int, int]:
+    """The session id, the accepted flags and the player whose turn it is"""
+    return SPECTATE_REPLY.unpack_from(payload)
+
+def get_spectator_payload(player_num: int, payload: bytes) -> bytes:
+    return bytes((player_num,)) + payload
+
+def parse_spectator_payload(payload: bytes) -> Tuple[int, bytes]:
+    """The player the message is about and its payload"""
+    return payload[0], payload[1:]
+#####
+
+def peek_session_id(data: bytes) -> int | None:
+    """The session a client asks for in the first frame it has sent, used before the connection is read for real: the session of
+    its resume token, the one it wants to spectate (0 for any) or None for a client that joins a new game"""
+    if len(data) < SOCKET_FRAME_HEADER.size or data[0] != SOCKET_FRAME_MAGIC:
+        return None
+    try:
+        message_type, length = parse_frame_header(data)
+    except ConnectionError:
+        return None
+    payload = data[SOCKET_FRAME_HEADER.size:SOCKET_FRAME_HEADER.size + length]
+    if message_type == SOCKET_SPECTATE:
+        return parse_spectate_request(payload)[0]
+    if message_type == SOCKET_CONNECTION_ESTABLISHED:
+        capabilities = parse_capabilities(payload)
+        if capabilities is not None and capabilities.resume_token is not None:
+            return get_resume_session_id(capabilities.resume_token)
+    return None
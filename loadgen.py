@@ -0,0 +1,123 @@
+"""
+Load generator: runs many BotClients against a server and reports throughput, relay latency and errors.
+
+    python loadgen.py --players 500 --turns 20 --think-time 0.2 --connect-rate 200
+    python loadgen.py --players 20 --spectators 300
+
+Spectators join once all players have connected, each watches the busiest match at that moment.
+"""
+
+from shared_definitions import *
+from bot import BotClient, BotStats, run_bot
+from spectate import SpectatorClient, SpectatorStats, run_spectator
+from os import name as _os_name
+import argparse
+import json
+import time
+
+if _os_name != "nt":
+    import resource
+
+def raise_open_file_limit(needed: int) -> None:
+    if _os_name == "nt": # Windows has no such limit for sockets
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+    if new_soft < needed:
+        print(f"Warning: only {new_soft} files can be open at once, some bots may fail to connect.")
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+async def run_load(host: str, port: int, players: int, turns: int, think_time: float, connect_rate: float, seed: int | None,
+                   spectators: int = 0, spectator_stats: SpectatorStats | None = None) -> Tuple[BotStats, float]:
+    stats = BotStats()
+    seeds = random.Random(seed)
+    tasks: List[asyncio.Task] = []
+    started_at = time.perf_counter()
+    for i in range(players):
+        bot = BotClient(host, port, turns = turns, think_time = think_time, rng = random.Random(seeds.getrandbits(64)), stats = stats)
+        tasks.append(asyncio.create_task(run_bot(bot)))
+        if connect_rate > 0:
+            await asyncio.sleep(1 / connect_rate)
+    for i in range(spectators):
+        tasks.append(asyncio.create_task(run_spectator(SpectatorClient(host, port, stats = spectator_stats))))
+        if connect_rate > 0:
+            await asyncio.sleep(1 / connect_rate)
+    await asyncio.gather(*tasks)
+    return stats, time.perf_counter() - started_at
+
+def get_report(stats: BotStats, elapsed: float, players: int, spectators: int = 0, spectator_stats: SpectatorStats | None = None) -> Dict[str, Any]:
+    latencies = sorted(stats.relay_latencies)
+    report = {
+        "players": players,
+        "elapsed_s": round(elapsed, 3),
+        "games_started": stats.games_started // 2,
+        "games_finished": stats.games_finished // 2,
+        "turns": stats.turns,
+        "turns_per_s": round(stats.turns / elapsed, 1) if elapsed else 0.0,
+        "messages_per_s": round((stats.messages_sent + stats.messages_received) / elapsed, 1) if elapsed else 0.0,
+        "bytes_sent": stats.bytes_sent,
+        "bytes_received": stats.bytes_received,
+        "keyframes_requested": stats.keyframes_requested,
+        "resumes": stats.resumes,
+        "relay_latency_ms": {
+            "samples": len(latencies),
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0
+        },
+        "errors": stats.errors
+    }
+    if spectators:
+        report["spectators"] = {
+            "count": spectators,
+            "updates": spectator_stats.updates,
+            "missed_updates": spectator_stats.missed_updates,
+            "bytes_received": spectator_stats.bytes_received,
+            "errors": spectator_stats.errors
+        }
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    latency = report["relay_latency_ms"]
+    print(f"{report['players']} players, {report['games_finished']}/{report['games_started']} games finished in {report['elapsed_s']} s")
+    print(f"throughput: {report['turns_per_s']} turns/s, {report['messages_per_s']} messages/s, "
+          f"{report['bytes_sent']} B sent, {report['bytes_received']} B received")
+    print(f"relay latency (update -> ack): p50 {latency['p50']} ms, p99 {latency['p99']} ms, max {latency['max']} ms over {latency['samples']} updates")
+    print(f"keyframes requested: {report['keyframes_requested']}, sessions resumed: {report['resumes']}")
+    print("errors: " + (", ".join(f"{error}: {count}" for error, count in report["errors"].items()) or "none"))
+    if "spectators" in report:
+        spectators = report["spectators"]
+        print(f"{spectators['count']} spectators: {spectators['updates']} updates ({spectators['missed_updates']} missed), {spectators['bytes_received']} B received, "
+              "errors: " + (", ".join(f"{error}: {count}" for error, count in spectators["errors"].items()) or "none"))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Runs bot players against a server and reports throughput, relay latency and errors.")
+    parser.add_argument("--host", default = "127.0.0.1" if HOST == "0.0.0.0" else HOST)
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--players", type = int, default = 100, help = "number of bots, two of them play a game together")
+    parser.add_argument("--turns", type = int, default = 20, help = "turns every bot plays before it leaves")
+    parser.add_argument("--think-time", type = float, default = 0.5, help = "average seconds a bot thinks before it ends its turn")
+    parser.add_argument("--connect-rate", type = float, default = 100, help = "bots connected per second, 0 connects all at once")
+    parser.add_argument("--spectators", type = int, default = 0, help = "number of spectators, they join after the players")
+    parser.add_argument("--seed", type = int, default = None, help = "makes the moves of the bots reproducible")
+    parser.add_argument("--json", action = "store_true", help = "print the report as JSON")
+    args = parser.parse_args()
+
+    raise_open_file_limit(args.players + args.spectators + 64)
+    spectator_stats = SpectatorStats()
+    stats, elapsed = asyncio.run(run_load(args.host, args.port, args.players, args.turns, args.think_time, args.connect_rate, args.seed, args.spectators, spectator_stats))
+    report = get_report(stats, elapsed, args.players, args.spectators, spectator_stats)
+    if args.json:
+        print(json.dumps(report, indent = 2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Logging of the server. Records are only put into a queue by the code that logs them, a QueueListener thread formats and
+writes them to stdout and, with LOG_FILE, to a rotating file, so the relay path never waits for a terminal or a disk.
+
+The loggers are children of "pharaoh":
+    pharaoh.server: connections, sessions and stats at INFO, every received message and entity update at DEBUG
+    pharaoh.entities: the decoded entities of the updates at DEBUG, a dump is expensive, so only LOG_ENTITY_SAMPLE_RATE of the updates are dumped
+    pharaoh.recorder: errors of the match recorder
+
+With worker processes, the workers put their records into a multiprocessing queue and the main process writes them, so that
+there is a single writer of the log file. A full queue drops records instead of blocking, the drops are counted.
+"""
+
+from shared_definitions import *
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import logging
+import multiprocessing
+import queue
+import sys
+
+LOG_LEVEL: str = (getenv('LOG_LEVEL') or "INFO").upper()
+LOG_FILE: str = getenv('LOG_FILE') or "" # nothing is written to a file if it is not set
+LOG_FILE_MAX_BYTES: int = int(getenv('LOG_FILE_MAX_BYTES') or 10 * 1024 * 1024)
+LOG_FILE_BACKUPS: int = int(getenv('LOG_FILE_BACKUPS') or 5)
+LOG_ENTITY_SAMPLE_RATE: float = float(getenv('LOG_ENTITY_SAMPLE_RATE') or 1.0) # the share of the entity updates whose entities are dumped at DEBUG
+LOG_QUEUE_SIZE: int = 10000 # records waiting for the writer thread, more are dropped
+
+logger: logging.Logger = logging.getLogger("pharaoh")
+server_logger: logging.Logger = logging.getLogger("pharaoh.server")
+entity_logger: logging.Logger = logging.getLogger("pharaoh.entities")
+recorder_logger: logging.Logger = logging.getLogger("pharaoh.recorder")
+
+class LogFormatter(logging.Formatter):
+    """Prefixes the message with the player or the spectator it is about (the extra fields addr, session and player), colored on a terminal"""
+    def __init__(self, colored: bool) -> None:
+        super().__init__("%(prefix)s%(message)s%(suffix)s" if colored else "%(asctime)s %(levelname)s %(processName)s %(prefix)s%(message)s%(suffix)s")
+        self.colored = colored
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.prefix, record.suffix = "", ""
+        if hasattr(record, "player"):
+            session_prefix = f"[SESSION {record.session}] " if record.session is not None else ""
+            role = f"[PLAYER {record.player}]" if record.player is not None else "[SPECTATOR]"
+            record.prefix = f"{record.addr} {session_prefix}{role} "
+            if self.colored:
+                record.prefix = record.color + record.prefix + colors.ENDC
+        elif self.colored and record.levelno >= logging.WARNING:
+            record.prefix, record.suffix = colors.RED, colors.ENDC
+        return super().format(record)
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the logging code: a record that does not fit into the queue is dropped"""
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(self.queue, queue.Queue): # the record stays in this process, there is nothing to make picklable
+            return record
+        return super().prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def get_handlers() -> List[logging.Handler]:
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(LogFormatter(colored = True))
+    handlers: List[logging.Handler] = [console_handler]
+    if LOG_FILE:
+        file_handler = RotatingFileHandler(LOG_FILE, maxBytes = LOG_FILE_MAX_BYTES, backupCount = LOG_FILE_BACKUPS, encoding = "utf-8")
+        file_handler.setFormatter(LogFormatter(colored = False))
+        handlers.append(file_handler)
+    return handlers
+
+def set_queue_handler(log_queue: queue.Queue) -> None:
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+def start_logging(log_queue: queue.Queue | None = None) -> QueueListener:
+    """Starts the writer thread of the process that writes the log, log_queue is shared with the workers if there are any"""
+    log_queue = log_queue if log_queue is not None else queue.Queue(LOG_QUEUE_SIZE)
+    set_queue_handler(log_queue)
+    listener = QueueListener(log_queue, *get_handlers(), respect_handler_level = True)
+    listener.start()
+    return listener
+
+def start_worker_logging(log_queue: multiprocessing.Queue) -> None:
+    """Sends the records of a worker process to the main process"""
+    set_queue_handler(log_queue)
+
+def get_worker_log_queue() -> multiprocessing.Queue:
+    return multiprocessing.get_context("spawn").Queue(LOG_QUEUE_SIZE)
+
+def stop_logging(listener: QueueListener) -> None:
+    """Writes what is still queued"""
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+def get_dropped_records() -> int:
+    return sum(handler.dropped for handler in logger.handlers if isinstance(handler, DroppingQueueHandler))
+
+def should_dump_entities() -> bool:
+    """Whether the entities of an update are dumped, decided once per update so that a dump is never cut short"""
+    return entity_logger.isEnabledFor(logging.DEBUG) and (LOG_ENTITY_SAMPLE_RATE >= 1 or random.random() < LOG_ENTITY_SAMPLE_RATE)
@@ -0,0 +1,183 @@
+"""
+Counters and latency histograms of the server.
+
+Every process keeps its own Metrics and turns them into a JSON snapshot on request; the main process merges the snapshots
+of its workers with merge_snapshots(). Counters are kept as totals and per second for the last METRICS_WINDOW seconds, so
+rates can be computed from any number of merged snapshots. Histograms are HDR-style: values are recorded in microseconds
+into log-linear buckets, which keeps the relative error of every percentile below 2 ** -HISTOGRAM_SUB_BUCKET_BITS (6%)
+while a record is a couple of integer operations.
+
+get_report() turns a snapshot into what is shown by the stats endpoint and the periodic dumps of server.py.
+"""
+
+from shared_definitions import *
+import time
+
+METRICS_WINDOW: int = 60 # seconds of per second counters kept in a snapshot
+RATE_WINDOW: int = 10 # the rates of a report are averaged over this many of the last complete seconds
+HISTOGRAM_SUB_BUCKET_BITS: int = 4
+PERCENTILES: Tuple[float, ...] = (0.5, 0.9, 0.99, 0.999)
+
+class LatencyHistogram:
+    """Values below 2 ** (HISTOGRAM_SUB_BUCKET_BITS + 1) microseconds are exact, every power of two above is split into 2 ** HISTOGRAM_SUB_BUCKET_BITS buckets"""
+    __slots__ = ("counts", "count", "total", "max")
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = {} # bucket index -> count
+        self.count: int = 0
+        self.total: int = 0
+        self.max: int = 0
+
+    @staticmethod
+    def get_bucket_index(value: int) -> int:
+        exponent = value.bit_length() - (HISTOGRAM_SUB_BUCKET_BITS + 1)
+        if exponent <= 0:
+            return value
+        return (exponent << HISTOGRAM_SUB_BUCKET_BITS) + (value >> exponent) # value >> exponent has HISTOGRAM_SUB_BUCKET_BITS + 1 bits
+
+    @staticmethod
+    def get_bucket_range(index: int) -> Tuple[int, int]:
+        """The smallest and the largest value of a bucket"""
+        sub_buckets = 1 << HISTOGRAM_SUB_BUCKET_BITS
+        if index < 2 * sub_buckets:
+            return index, index
+        exponent = (index >> HISTOGRAM_SUB_BUCKET_BITS) - 1
+        lowest = ((index & (sub_buckets - 1)) + sub_buckets) << exponent
+        return lowest, lowest + (1 << exponent) - 1
+
+    def record(self, value_us: int) -> None:
+        index = self.get_bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value_us
+        if value_us > self.max:
+            self.max = value_us
+
+    def get_percentile(self, fraction: float) -> int:
+        """The middle of the bucket that holds the percentile, never more than the largest recorded value"""
+        if self.count == 0:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                lowest, highest = self.get_bucket_range(index)
+                return min((lowest + highest) // 2, self.max)
+        return self.max
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"counts": {str(index): count for index, count in self.counts.items()}, "count": self.count, "total": self.total, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LatencyHistogram':
+        histogram = cls()
+        histogram.counts = {int(index): count for index, count in data["counts"].items()}
+        histogram.count, histogram.total, histogram.max = data["count"], data["total"], data["max"]
+        return histogram
+
+    def get_summary(self) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {"count": self.count, "mean_us": round(self.total / self.count, 1) if self.count else 0.0}
+        for fraction in PERCENTILES:
+            summary[f"p{fraction * 100:g}_us"] = self.get_percentile(fraction)
+        summary["max_us"] = self.max
+        return summary
+
+class Metrics:
+    def __init__(self) -> None:
+        self.started_at: float = time.time()
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.__window: Dict[int, Dict[str, int]] = {} # Unix second -> the counters of that second
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+        second = int(time.time())
+        counters = self.__window.get(second)
+        if counters is None:
+            counters = self.__window[second] = {}
+            if len(self.__window) > METRICS_WINDOW:
+                self.__prune(second)
+        counters[name] = counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.record(int(seconds * 1e6))
+
+    def __prune(self, now: int) -> None:
+        for second in [second for second in self.__window if second <= now - METRICS_WINDOW]:
+            del self.__window[second]
+
+    def snapshot(self, **extra: Any) -> Dict[str, Any]:
+        """Everything as JSON-serializable data, extra values (e.g. the lobby stats) are added as they are"""
+        self.__prune(int(time.time()))
+        return {
+            "started_at": self.started_at,
+            "counters": dict(self.counters),
+            "window": {str(second): dict(counters) for second, counters in self.__window.items()},
+            "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            **extra
+        }
+
+def merge_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Counters and histograms are summed up, extra values that are numbers too, lists are concatenated"""
+    merged: Dict[str, Any] = {"started_at": min((snapshot["started_at"] for snapshot in snapshots), default = time.time()), "counters": {}, "window": {}, "histograms": {}}
+    histograms: Dict[str, LatencyHistogram] = {}
+    for snapshot in snapshots:
+        for name, value in snapshot["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+        for second, counters in snapshot["window"].items():
+            merged_counters = merged["window"].setdefault(second, {})
+            for name, value in counters.items():
+                merged_counters[name] = merged_counters.get(name, 0) + value
+        for name, data in snapshot["histograms"].items():
+            histogram = LatencyHistogram.from_dict(data)
+            if name in histograms:
+                histograms[name].merge(histogram)
+            else:
+                histograms[name] = histogram
+        for key, value in snapshot.items():
+            if key in merged and key in ("started_at", "counters", "window", "histograms"):
+                continue
+            if isinstance(value, list):
+                merged[key] = merged.get(key, []) + value
+            elif isinstance(value, (int, float)):
+                merged[key] = merged.get(key, 0) + value
+    merged["histograms"] = {name: histogram.to_dict() for name, histogram in histograms.items()}
+    return merged
+
+def get_rates(window: Dict[str, Dict[str, int]], seconds: int = RATE_WINDOW) -> Dict[str, float]:
+    """Per second averages over the last complete seconds, the current second is still being counted"""
+    now = int(time.time())
+    totals: Dict[str, int] = {}
+    for second, counters in window.items():
+        if now - seconds <= int(second) < now:
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+    return {name: round(value / seconds, 1) for name, value in sorted(totals.items())}
+
+def get_report(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    report: Dict[str, Any] = {key: value for key, value in snapshot.items() if key not in ("started_at", "counters", "window", "histograms")}
+    report["uptime_s"] = round(time.time() - snapshot["started_at"], 1)
+    report["totals"] = dict(sorted(snapshot["counters"].items()))
+    report[f"per_second_{RATE_WINDOW}s"] = get_rates(snapshot["window"])
+    report["latency"] = {name: LatencyHistogram.from_dict(data).get_summary() for name, data in sorted(snapshot["histograms"].items())}
+    return report
+
+def get_summary_line(report: Dict[str, Any]) -> str:
+    """The few numbers of a report that fit a periodic log line"""
+    rates = report[f"per_second_{RATE_WINDOW}s"]
+    messages_in = round(sum(value for name, value in rates.items() if name.startswith("messages_in.")), 1)
+    messages_out = round(sum(value for name, value in rates.items() if name.startswith("messages_out.")), 1)
+    relay = report["latency"].get("relay", {})
+    return (f"sessions {report.get('sessions', 0)}, players {report.get('players', 0)}, "
+            f"{messages_in}/s in, {messages_out}/s out, {rates.get('bytes_in', 0)} B/s in, {rates.get('bytes_out', 0)} B/s out, "
+            f"relay p50 {relay.get('p50_us', 0)} us, p99 {relay.get('p99_us', 0)} us")
@@ -0,0 +1,242 @@
+"""
+Recordings of matches: the server appends every relayed SOCKET_SHARED_ENTITIES_UPDATE and SOCKET_YOUR_TURN of a session
+to a file, replay.py reads them back.
+
+A recording is two append-only files:
+    <name>.rec: header | records
+        header: RECORDING_MAGIC | format version (1 byte) | session id (4 bytes) | start as a Unix time (double)
+        record: player number (1 byte) | message type (1 byte) | seconds since the start (double) | length (4 bytes) | payload
+    <name>.idx: one entry per turn, the n-th entry belongs to the n-th turn
+        entry: offset of the turn's first record (8 bytes) | offsets of the last keyframes of players 1 and 2 before it (8 bytes each, 0 if none) |
+               the player whose turn it is (1 byte)
+
+A turn starts with the game and after every SOCKET_YOUR_TURN. The keyframe offsets let a replay start from the last keyframe of
+each player instead of from the beginning, so any turn is reached by reading at most a keyframe interval of updates.
+
+The files are written by one background thread per process through buffered files, so the relay path only puts the message
+into a queue. The thread writes in batches and flushes the files of the recordings it has written to every RECORDER_FLUSH_INTERVAL.
+"""
+
+from shared_definitions import *
+from entity_sync import EntitySyncReceiver, is_keyframe
+from codec import CodecError
+from log import recorder_logger
+from typing import BinaryIO
+import mmap
+import os
+import queue
+import time
+
+RECORD_DIR: str = getenv('RECORD_DIR') or "" # matches are recorded into this directory, nothing is recorded if it is not set
+RECORDED_MESSAGE_TYPES: Tuple[int, ...] = (SOCKET_SHARED_ENTITIES_UPDATE, SOCKET_YOUR_TURN)
+
+RECORDING_MAGIC: bytes = b"PHRM"
+RECORDING_FORMAT_VERSION: int = 1
+RECORDING_HEADER: struct.Struct = struct.Struct("!4sBId")
+RECORD_HEADER: struct.Struct = struct.Struct("!BBdI")
+INDEX_ENTRY: struct.Struct = struct.Struct("!QQQB")
+NO_KEYFRAME: int = 0 # offset 0 is the header, so it can not be a record
+RECORDER_BUFFER_SIZE: int = 1 << 16
+RECORDER_FLUSH_INTERVAL: float = 0.5 # seconds a recorded message may stay in the buffers, so a recording is at most this much behind the match
+RECORDER_BATCH_DELAY: float = 0.01 # the writer collects messages for this long after waking up, which keeps it from taking the GIL for every single message
+
+class RecordingError(ValueError):
+    pass
+
+##### RECORDING #####
+class MatchRecording:
+    """The recording of one session. record() and close() are called from the event loop, everything else runs on the writer thread"""
+    def __init__(self, recorder: 'MatchRecorder', session_id: int) -> None:
+        self.recorder = recorder
+        self.session_id = session_id
+        self.started_at: float = time.time()
+        self.closed: bool = False
+        # the state of the files, only used by the writer thread
+        self.data_file: BinaryIO | None = None
+        self.index_file: BinaryIO | None = None
+        self.offset: int = 0
+        self.keyframe_offsets: Dict[int, int] = {1: NO_KEYFRAME, 2: NO_KEYFRAME}
+        self.failed: bool = False
+
+    @property
+    def path(self) -> str:
+        """The path without the extension"""
+        return os.path.join(self.recorder.directory, f"match-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}-{self.session_id}")
+
+    def record(self, player_num: int, message_type: int, payload: bytes) -> None:
+        if not self.closed:
+            self.recorder.submit((self, player_num, message_type, time.time() - self.started_at, payload))
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.recorder.submit((self, None, None, None, None))
+
+    def write(self, player_num: int, message_type: int, seconds: float, payload: bytes) -> None:
+        if self.data_file is None:
+            self.data_file = open(self.path + ".rec", "wb", buffering = RECORDER_BUFFER_SIZE)
+            self.index_file = open(self.path + ".idx", "wb", buffering = RECORDER_BUFFER_SIZE)
+            self.data_file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_FORMAT_VERSION, self.session_id, self.started_at))
+            self.offset = RECORDING_HEADER.size
+            self.write_index_entry(current_player_num = 1) # the first player starts the game
+
+        if message_type == SOCKET_SHARED_ENTITIES_UPDATE and is_keyframe(payload):
+            self.keyframe_offsets[player_num] = self.offset
+        self.data_file.write(RECORD_HEADER.pack(player_num, message_type, seconds, len(payload)))
+        self.data_file.write(payload)
+        self.offset += RECORD_HEADER.size + len(payload)
+        if message_type == SOCKET_YOUR_TURN:
+            self.write_index_entry(current_player_num = 3 - player_num)
+
+    def write_index_entry(self, current_player_num: int) -> None:
+        self.index_file.write(INDEX_ENTRY.pack(self.offset, self.keyframe_offsets[1], self.keyframe_offsets[2], current_player_num))
+
+    def flush(self) -> None:
+        if self.data_file is not None:
+            self.data_file.flush() # the data first, so that the index never points past what is in the file
+            self.index_file.flush()
+
+    def close_files(self) -> None:
+        for file in (self.data_file, self.index_file):
+            if file is not None:
+                file.close()
+        self.data_file = self.index_file = None
+
+class MatchRecorder:
+    """Writes the recordings of all sessions of a process on a background thread"""
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        self.__queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.__thread = threading.Thread(target = self.__run, name = "match-recorder", daemon = True)
+        self.__thread.start()
+
+    def start_recording(self, session_id: int) -> MatchRecording:
+        return MatchRecording(self, session_id)
+
+    def submit(self, item: Tuple) -> None:
+        self.__queue.put(item)
+
+    def close(self) -> None:
+        """Writes what is still queued and closes all files"""
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __run(self) -> None:
+        open_recordings: Dict[int, MatchRecording] = {} # id(recording) -> recording
+        unflushed: Dict[int, MatchRecording] = {} # the recordings written to since the last flush
+        flushed_at = time.monotonic()
+        while True:
+            try:
+                item = self.__queue.get(timeout = RECORDER_FLUSH_INTERVAL if unflushed else None)
+                time.sleep(RECORDER_BATCH_DELAY)
+            except queue.Empty:
+                item = False # nothing to write, but the buffers are due to be flushed
+            while item is not None and item is not False:
+                self.__write(item, open_recordings, unflushed)
+                try:
+                    item = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+            if item is None or time.monotonic() - flushed_at >= RECORDER_FLUSH_INTERVAL:
+                for recording in unflushed.values():
+                    self.__try(recording, recording.flush)
+                unflushed.clear()
+                flushed_at = time.monotonic()
+            if item is None: # close() was called
+                for recording in open_recordings.values():
+                    self.__try(recording, recording.close_files)
+                return
+
+    def __write(self, item: Tuple, open_recordings: Dict[int, MatchRecording], unflushed: Dict[int, MatchRecording]) -> None:
+        recording, player_num, message_type, seconds, payload = item
+        if player_num is None:
+            open_recordings.pop(id(recording), None)
+            unflushed.pop(id(recording), None)
+            self.__try(recording, recording.close_files) # closing writes out the buffers too
+            return
+        open_recordings[id(recording)] = recording
+        unflushed[id(recording)] = recording
+        self.__try(recording, lambda: recording.write(player_num, message_type, seconds, payload))
+
+    def __try(self, recording: MatchRecording, action: Callable[[], None]) -> None:
+        if recording.failed:
+            return
+        try:
+            action()
+        except OSError as e: # e.g. a full disk, the match goes on without being recorded
+            recording.failed = True
+            recorder_logger.error("Unable to record session %d: %s", recording.session_id, e)
+            try:
+                recording.close_files()
+            except OSError:
+                pass
+#####
+
+##### REPLAY #####
+class MatchReplay:
+    """Reads a recording through mmap, so a turn is found without reading the records before it"""
+    def __init__(self, path: str) -> None:
+        base = path[:-len(".rec")] if path.endswith(".rec") else path
+        with open(base + ".rec", "rb") as f:
+            self.__data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        with open(base + ".idx", "rb") as f:
+            index_size = os.fstat(f.fileno()).st_size
+            self.__index = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) if index_size else b""
+
+        if len(self.__data) < RECORDING_HEADER.size:
+            raise RecordingError("the recording is truncated")
+        magic, format_version, self.session_id, self.started_at = RECORDING_HEADER.unpack_from(self.__data, 0)
+        if magic != RECORDING_MAGIC:
+            raise RecordingError("not a match recording")
+        if format_version != RECORDING_FORMAT_VERSION:
+            raise RecordingError(f"unsupported recording format {format_version}")
+
+    def __enter__(self) -> 'MatchReplay':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for mapping in (self.__data, self.__index):
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+
+    @property
+    def turn_count(self) -> int:
+        return len(self.__index) // INDEX_ENTRY.size
+
+    def get_turn(self, turn: int) -> Tuple[int, int, int, int]:
+        """(offset of the turn's first record, offset of player 1's last keyframe, offset of player 2's last keyframe, current player)"""
+        if not 0 <= turn < self.turn_count:
+            raise IndexError(f"turn {turn} is not in the recording, it has {self.turn_count} turns")
+        return INDEX_ENTRY.unpack_from(self.__index, turn * INDEX_ENTRY.size)
+
+    def get_records(self, start: int, end: int | None = None) -> Iterable[Tuple[int, int, int, float, bytes]]:
+        """Yields (offset, player number, message type, seconds since the start, payload) of the records in [start, end)"""
+        data = self.__data
+        end = len(data) if end is None else end
+        offset = start
+        while offset + RECORD_HEADER.size <= end:
+            player_num, message_type, seconds, length = RECORD_HEADER.unpack_from(data, offset)
+            payload_start = offset + RECORD_HEADER.size
+            if payload_start + length > len(data): # the last record is still being written
+                return
+            yield offset, player_num, message_type, seconds, data[payload_start:payload_start + length]
+            offset = payload_start + length
+
+    def get_entities(self, turn: int) -> Dict[int, List[Entity]]:
+        """The public entities of both players at the start of a turn"""
+        turn_offset, *keyframe_offsets, _ = self.get_turn(turn)
+        receivers: Dict[int, EntitySyncReceiver] = {1: EntitySyncReceiver(), 2: EntitySyncReceiver()}
+        starts = [offset for offset in keyframe_offsets if offset != NO_KEYFRAME]
+        for offset, player_num, message_type, _, payload in self.get_records(min(starts, default = turn_offset), turn_offset):
+            if message_type != SOCKET_SHARED_ENTITIES_UPDATE or player_num not in receivers or offset < keyframe_offsets[player_num - 1]:
+                continue
+            try:
+                receivers[player_num].apply_update(payload)
+            except CodecError: # e.g. a legacy snapshot, it can not be shown
+                pass
+        return {player_num: list(receiver.entities.values()) for player_num, receiver in receivers.items()}
+#####
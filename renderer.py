@@ -0,0 +1,116 @@
+"""
+A terminal renderer that draws the entities into a framebuffer of (glyph, color) cells and writes only the cells
+that differ from the previous frame, using ANSI cursor positioning. Every frame is written with a single write call.
+"""
+
+from shared_definitions import *
+import sys
+from typing import TextIO
+
+Cell = Tuple[str, str | None] # glyph, color
+BLANK_CELL: Cell = (" ", colors.NONE)
+
+CLEAR_SCREEN: str = "\033[2J\033[H"
+CLEAR_TO_END_OF_LINE: str = "\033[K"
+CURSOR_MOVE_COST: int = 8 # roughly the length of a cursor movement, unchanged gaps shorter than this are written over instead of jumped over
+
+def move_cursor(row: int, column: int) -> str:
+    return f"\033[{row + 1};{column + 1}H"
+
+def get_entity_cells(entity: Entity) -> List[Cell]:
+    if entity.color == colors.RAINBOW:
+        return [(glyph, MAIN_COLORS[i % len(MAIN_COLORS)]) for i, glyph in enumerate(entity.content)]
+    return [(glyph, entity.color) for glyph in entity.content]
+
+class Framebuffer:
+    def __init__(self) -> None:
+        self.rows: List[List[Cell]] = []
+
+    def put(self, x: int, y: int, cells: List[Cell]) -> None:
+        while len(self.rows) <= y:
+            self.rows.append([])
+        row = self.rows[y]
+        if len(row) < x + len(cells):
+            row.extend([BLANK_CELL] * (x + len(cells) - len(row)))
+        row[x:x + len(cells)] = cells
+
+    def draw(self, entity: Entity) -> None:
+        if entity.coords is None:
+            return
+        x, y = entity.coords
+        line: List[Cell] = []
+        for cell in get_entity_cells(entity):
+            if cell[0] == "\n": # the rest of a multiline entity starts at the beginning of the next line
+                self.put(x, y, line)
+                line = []
+                x = 0
+                y += 1
+            else:
+                line.append(cell)
+        self.put(x, y, line)
+
+class TerminalRenderer:
+    def __init__(self, output: TextIO | None = None) -> None:
+        self.output = output
+        self.last_frame_size: int = 0 # characters written by the last render(), 0 if nothing changed
+        self.__front: List[List[Cell]] | None = None # what is on the screen, None if unknown
+
+    def invalidate(self) -> None:
+        """Makes the next frame redraw the whole screen, this is needed after anything else was printed"""
+        self.__front = None
+
+    def render(self, entities: Iterable[Entity]) -> None:
+        """Draws the entities in the given order, so that a later entity is drawn over an earlier one"""
+        back = Framebuffer()
+        for entity in entities:
+            back.draw(entity)
+        frame = self.get_frame(back.rows)
+        self.last_frame_size = len(frame)
+        if frame:
+            output = self.output or sys.stdout
+            output.write(frame)
+            output.flush()
+        self.__front = back.rows
+
+    def get_frame(self, back: List[List[Cell]]) -> str:
+        parts: List[str] = []
+        front = self.__front
+        if front is None:
+            parts.append(CLEAR_SCREEN)
+            front = []
+
+        current_color: str | None = colors.NONE
+        def write_cells(cells: Iterable[Cell]) -> None:
+            nonlocal current_color
+            for glyph, color in cells:
+                if color != current_color:
+                    parts.append(colors.ENDC if color is colors.NONE else color)
+                    current_color = color
+                parts.append(glyph)
+
+        for y in range(max(len(front), len(back))):
+            old_row = front[y] if y < len(front) else []
+            new_row = back[y] if y < len(back) else []
+            changed = [x for x in range(len(new_row)) if (old_row[x] if x < len(old_row) else BLANK_CELL) != new_row[x]]
+
+            run_start = 0
+            for i, x in enumerate(changed):
+                if i == 0 or x - changed[i - 1] > CURSOR_MOVE_COST:
+                    run_start = x
+                if i == len(changed) - 1 or changed[i + 1] - x > CURSOR_MOVE_COST:
+                    parts.append(move_cursor(y, run_start))
+                    write_cells(new_row[run_start:x + 1])
+
+            if any(cell != BLANK_CELL for cell in old_row[len(new_row):]):
+                parts.append(move_cursor(y, len(new_row)))
+                if current_color is not colors.NONE: # the line is cleared with the current attributes
+                    parts.append(colors.ENDC)
+                    current_color = colors.NONE
+                parts.append(CLEAR_TO_END_OF_LINE)
+
+        if not parts:
+            return ""
+        if current_color is not colors.NONE:
+            parts.append(colors.ENDC)
+        parts.append(move_cursor(len(back), 0)) # park the cursor below the frame, where the old renderer left it
+        return "".join(parts)
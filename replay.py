@@ -0,0 +1,79 @@
+"""
+Shows a recorded match (see recorder.py) the way the client of a player saw it, e.g. to look into what happened in a game:
+
+    python replay.py recordings/match-20261018-201500-7.rec --list
+    python replay.py recordings/match-20261018-201500-7.rec --turn 12 --player 2
+    python replay.py recordings/match-20261018-201500-7.rec --turn 10 --to 20
+
+Every turn is looked up in the index of the recording, so showing a late turn takes as long as showing an early one.
+"""
+
+from shared_definitions import *
+from recorder import MatchReplay, RecordingError
+from game import GameController, move_to_opponent_side
+import argparse
+import sys
+import time
+
+def get_turn_time(replay: MatchReplay, turn: int) -> float | None:
+    """Seconds from the start of the match until the first message of the turn, None if nothing was sent in it"""
+    turn_offset = replay.get_turn(turn)[0]
+    first_record = next(iter(replay.get_records(turn_offset)), None)
+    return first_record[3] if first_record is not None else None
+
+def get_turn_string(replay: MatchReplay, turn: int, player_num: int) -> str:
+    """The game field at the start of a turn as the given player saw it, drawn by the client's own get_game_field_string"""
+    current_player_num = replay.get_turn(turn)[3]
+    entities = replay.get_entities(turn)
+    GameController.received_entities.clear()
+    for entity in entities[player_num]:
+        GameController.received_entities.add(entity)
+    for entity in entities[3 - player_num]:
+        move_to_opponent_side(entity)
+        GameController.received_entities.add(entity)
+
+    turn_time = get_turn_time(replay, turn)
+    whose_turn = "your" if current_player_num == player_num else "your opponent's"
+    footer = f"Turn {turn}/{replay.turn_count - 1}: it's {whose_turn} turn" + (f", {turn_time:.1f} s into the match" if turn_time is not None else "")
+    GameController.set_footer(Entity(footer, colors.NONE, coords = GameController.get_footer_start_coordinates()))
+    return GameController.get_game_field_string()
+
+def print_turn_list(replay: MatchReplay) -> None:
+    print(f"session {replay.session_id}, started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(replay.started_at))}, {replay.turn_count} turns")
+    for turn in range(replay.turn_count):
+        turn_offset, _, _, current_player_num = replay.get_turn(turn)
+        turn_time = get_turn_time(replay, turn)
+        print(f"turn {turn}: player {current_player_num}, " + (f"{turn_time:.3f} s, " if turn_time is not None else "") + f"at byte {turn_offset}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Shows a recorded match turn by turn.")
+    parser.add_argument("recording", help = "the .rec file of the match, its .idx file must be next to it")
+    parser.add_argument("--list", action = "store_true", help = "list the turns instead of showing them")
+    parser.add_argument("--turn", type = int, default = 0, help = "the turn to show, negative counts from the end")
+    parser.add_argument("--to", type = int, default = None, help = "show every turn from --turn up to this one")
+    parser.add_argument("--player", type = int, choices = (1, 2), default = 1, help = "whose side of the field is at the bottom")
+    args = parser.parse_args()
+
+    try:
+        replay = MatchReplay(args.recording)
+    except (OSError, RecordingError) as e:
+        sys.exit(f"Unable to read {args.recording}: {e}")
+    with replay:
+        if args.list:
+            print_turn_list(replay)
+            return
+        if replay.turn_count == 0:
+            sys.exit("The recording has no turns yet")
+        first_turn = args.turn % replay.turn_count if args.turn < 0 else args.turn
+        last_turn = first_turn if args.to is None else args.to
+        GameController.player_num = args.player
+        GameController.player_color = PLAYER_COLORS[args.player]
+        GameController.add_player_side_borders()
+        for turn in range(first_turn, last_turn + 1):
+            try:
+                sys.stdout.write(get_turn_string(replay, turn, args.player))
+            except IndexError as e:
+                sys.exit(str(e))
+
+if __name__ == "__main__":
+    main()
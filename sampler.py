@@ -0,0 +1,85 @@
+"""
+Weighted sampling of cards. A card is drawn as min(int(r ** cruelty * count), count - 1) for a uniform r in [0, 1), which makes
+the cards at the end of a pool (the strong ones at the end of a type's STATES) the rarer the bigger the cruelty is.
+
+A Sampler precomputes the values of r at which the drawn index changes, i.e. the CDF of that distribution, so a draw is one
+binary search and draw_many() is vectorized with NumPy when it is installed. The thresholds are exact: a Sampler draws the same
+index as the formula for the same r, so it also draws the same cards from the same seed.
+
+Every game should draw from its own stream (see make_rng), so that games are reproducible independently of each other:
+
+    rng = make_rng(seed, stream = game_number)
+    state_indices = get_sampler(WarriorCard.COUNT).draw_many(100, rng)
+"""
+
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Any, List
+import math
+import random
+
+try:
+    import numpy
+except ImportError: # NumPy is optional, draw_many() falls back to bisect
+    numpy = None
+
+def get_index(r: float, count: int, cruelty: float) -> int:
+    """The original drawing formula, the thresholds of a Sampler are computed from it"""
+    return min(int((r ** cruelty) * count), count - 1)
+
+class Sampler:
+    __slots__ = ("count", "cruelty", "thresholds", "numpy_thresholds")
+    def __init__(self, count: int, cruelty: float = 10) -> None:
+        if count < 1:
+            raise ValueError("there is nothing to draw from")
+        if cruelty <= 0:
+            raise ValueError(f"cruelty must be positive, got {cruelty}")
+        self.count = count
+        self.cruelty = cruelty
+        self.thresholds: List[float] = [self.__get_threshold(index) for index in range(1, count)] # r >= thresholds[i - 1] draws at least i
+        self.numpy_thresholds = numpy.array(self.thresholds, dtype = numpy.float64) if numpy is not None else None
+
+    def __get_threshold(self, index: int) -> float:
+        """The smallest r that draws index or a bigger one"""
+        r = (index / self.count) ** (1 / self.cruelty) # exact in real numbers, the loops fix the rounding of both this and the formula
+        while r > 0.0 and get_index(math.nextafter(r, 0.0), self.count, self.cruelty) >= index:
+            r = math.nextafter(r, 0.0)
+        while get_index(r, self.count, self.cruelty) < index:
+            r = math.nextafter(r, 1.0)
+        return r
+
+    def draw(self, rng: random.Random | None = None) -> int:
+        return bisect_right(self.thresholds, (rng or random).random())
+
+    def draw_many(self, number: int, rng: Any = None) -> array:
+        """
+        Draws number indices at once as an array('H'), the way PackedCardList stores them.
+        rng is a random.Random (the module-level one if not given) or a numpy.random.Generator. A random.Random draws the same
+        indices with and without NumPy, a Generator keeps the whole batch vectorized.
+        """
+        if numpy is None:
+            random_values = (rng or random).random
+            return array('H', [bisect_right(self.thresholds, random_values()) for _ in range(number)])
+        if isinstance(rng, numpy.random.Generator):
+            values = rng.random(number)
+        else:
+            random_values = (rng or random).random
+            values = numpy.fromiter((random_values() for _ in range(number)), dtype = numpy.float64, count = number)
+        indices = numpy.searchsorted(self.numpy_thresholds, values, side = "right").astype(numpy.uint16)
+        return array('H', indices.tobytes())
+
+@lru_cache(maxsize = None)
+def get_sampler(count: int, cruelty: float = 10) -> Sampler:
+    """Samplers are immutable, so there is one per pool size and cruelty"""
+    return Sampler(count, cruelty)
+
+def make_rng(seed: int | str | None, stream: int = 0) -> random.Random:
+    """An independent stream of a seed, e.g. one per game of a simulation. None seeds it from the OS"""
+    return random.Random(None if seed is None else f"{seed}/{stream}")
+
+def make_numpy_rng(seed: int | None, stream: int = 0) -> Any:
+    """The same as make_rng, but a numpy.random.Generator, which draw_many() does not have to leave NumPy for"""
+    if numpy is None:
+        raise ImportError("NumPy is not installed, use make_rng() instead")
+    return numpy.random.default_rng(None if seed is None else [stream, seed])
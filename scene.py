@@ -0,0 +1,97 @@
+"""
+An index of everything on the screen, ordered by (y, x). It is kept up to date by the SceneLayers that make up the screen
+as entities are added to them, removed from them or moved, instead of being rebuilt every time it is read.
+"""
+
+from shared_definitions import *
+from sortedcontainers import SortedKeyList
+
+SCENE_KEY: Callable[[Entity], Tuple[int, int]] = lambda e: (e.coords.y, e.coords.x) if e.coords else (-1, -1) # SortedList uses its key even when checking for membership, so entities without coords must have one too
+
+class SceneIndex:
+    def __init__(self) -> None:
+        self.__entities: SortedKeyList = SortedKeyList(key = SCENE_KEY)
+
+    def __iter__(self):
+        return iter(self.__entities)
+
+    def __len__(self) -> int:
+        return len(self.__entities)
+
+    def __contains__(self, entity: Entity) -> bool:
+        return entity in self.__entities
+
+    def add(self, entity: Entity) -> None:
+        self.__entities.add(entity)
+
+    def remove(self, entity: Entity) -> None:
+        self.__entities.remove(entity)
+
+    def get_closest_left(self, x: int, y: int) -> Entity | None:
+        """Returns the entity on row y that starts at x or closest before it, in O(log n)"""
+        index = self.__entities.bisect_key_right((y, x))
+        if index == 0:
+            return None
+        entity = self.__entities[index - 1]
+        return entity if entity.coords.y == y else None
+
+    def is_free(self, x: int, y: int) -> bool:
+        closest_left = self.get_closest_left(x, y)
+        return closest_left is None or closest_left.coords.x + len(closest_left.content) <= x
+
+class SceneLayer(SortedKeyList):
+    """A SortedList of entities that mirrors its contents into a SceneIndex. An entity must be moved with move() while it is in the layer"""
+    def __init__(self, scene: SceneIndex, iterable: Iterable[Entity] | None = None, key: Callable[[Entity], Any] = SCENE_KEY) -> None:
+        self.scene = scene
+        self.version: int = 0 # incremented whenever what a cursor can select in the layer may have changed, the cursor itself is neither
+        super().__init__(key = key)
+        if iterable is not None:
+            self.update(iterable)
+
+    def __on_change(self, entity: Entity) -> None:
+        if entity.selectable or isinstance(entity, Iterable):
+            self.version += 1
+
+    def add(self, entity: Entity) -> None:
+        super().add(entity)
+        self.scene.add(entity)
+        self.__on_change(entity)
+
+    def update(self, iterable: Iterable[Entity]) -> None:
+        for entity in iterable: # SortedKeyList.update may or may not go through add(), so it is not used
+            self.add(entity)
+
+    def remove(self, entity: Entity) -> None:
+        super().remove(entity)
+        self.scene.remove(entity)
+        self.__on_change(entity)
+
+    def discard(self, entity: Entity) -> None:
+        if entity in self:
+            self.remove(entity)
+
+    def pop(self, index: int = -1) -> Entity:
+        entity = super().pop(index)
+        self.scene.remove(entity)
+        self.__on_change(entity)
+        return entity
+
+    def clear(self) -> None:
+        for entity in self:
+            self.scene.remove(entity)
+        super().clear()
+        self.version += 1
+
+    def __delitem__(self, index: int | slice) -> None:
+        for entity in (self[index] if isinstance(index, slice) else [self[index]]):
+            self.scene.remove(entity)
+        super().__delitem__(index)
+        self.version += 1
+
+    def __add__(self, other: Iterable[Entity]) -> SortedKeyList:
+        return SortedKeyList(list(self) + list(other), key = self.key) # a plain SortedList, the result is not a part of the scene
+
+    def move(self, entity: Entity, new_coords: Coordinates) -> None:
+        self.remove(entity)
+        entity.set_coords(new_coords)
+        self.add(entity)
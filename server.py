@@ -1,101 +1,1053 @@
 from shared_definitions import *
-
-connections: Dict[Tuple[socket.socket, Any], int] = {}
+from codec import decode_entity, CodecError
+from entity_sync import SyncUpdate, parse_update, encode_update, apply_update_to_state, is_keyframe, KEYFRAME_INTERVAL
+from recorder import MatchRecorder, MatchRecording, RECORD_DIR, RECORDED_MESSAGE_TYPES
+from metrics import Metrics, merge_snapshots, get_report, get_summary_line
+from compression import PayloadCompression, get_primed_compressor
+from handshake import Capabilities, CAPABILITY_RESUME, HANDSHAKE_PEEK_SIZE, parse_capabilities, accept_capabilities, get_connection_established, get_compression, new_resume_token, peek_session_id, parse_spectate_request, get_spectate_reply, get_spectator_payload
+from log import server_logger, entity_logger, start_logging, start_worker_logging, stop_logging, get_worker_log_queue, get_dropped_records, should_dump_entities
+from collections import deque
+from os import name as _os_name
+from typing import Set, Awaitable
+import os
+import json
+import logging
+import multiprocessing
+import signal
+import time
 
 PLAYER_COLORS = [colors.BLUE, colors.YELLOW]
+MAX_SESSIONS: int = int(getenv('MAX_SESSIONS') or 1000) # clients beyond this limit get SOCKET_LOBBY_FULL (per worker process)
+WORKERS: int = int(getenv('WORKERS') or 1) # with more than 1 worker, the main process only accepts connections and hands them over to worker processes
+STATS_INTERVAL: float = float(getenv('STATS_INTERVAL') or 60) # seconds between the stats reports of the main process, 0 turns them off
+METRICS_HOST: str = getenv('METRICS_HOST') or "127.0.0.1"
+METRICS_PORT: int = int(getenv('METRICS_PORT') or 0) # the stats endpoint is only served if this is set
+HOT_SESSIONS: int = 5 # the busiest sessions listed in the stats
+CONTROL_TIMEOUT: float = 5.0
+CONTROL_STATS_DELAY: float = 0.05 # the changes of a worker's lobby within this many seconds are pushed to the main process at once
+MAX_CACHED_UPDATES: int = 2 * KEYFRAME_INTERVAL # per player, a sender sends a keyframe at least every KEYFRAME_INTERVAL updates
+MAX_SPECTATORS: int = int(getenv('MAX_SPECTATORS') or 500) # per session, further spectators get SOCKET_LOBBY_FULL
+SPECTATOR_MAX_BUFFER: int = 256 * 1024 # bytes waiting to be sent to a spectator, beyond which it is sent nothing until it has caught up
+SPECTATOR_RESYNC_BUFFER: int = 16 * 1024 # a lagging spectator is sent keyframes again once its buffer is below this
+SPECTATED_MESSAGE_TYPES: Tuple[int, ...] = (SOCKET_SHARED_ENTITIES_UPDATE, SOCKET_YOUR_TURN)
+
+# messages of the control channel between the main process and the workers
+CONTROL_NEW_CONNECTION: int = 1 # main -> worker, the accepted socket is attached as a file descriptor
+CONTROL_STATS: int = 2 # main -> worker: a request, worker -> main: the stats of its lobby as JSON
+CONTROL_SHUTDOWN: int = 3 # main -> worker
+CONTROL_METRICS: int = 4 # main -> worker: a request, worker -> main: a snapshot of its metrics as JSON
+
+METRIC_NAMES: Dict[int, str] = {message_type: name.lower().replace(" ", "_") for message_type, name in SOCKET_MESSAGE_NAMES.items()}
+
+metrics: Metrics = Metrics() # of this process, every worker has its own
+
+def count_message(direction: str, message_type: int, size: int, count: int = 1) -> None:
+    """direction is "in" or "out", size is the one on the wire, i.e. after compression, count is the number of connections it went to"""
+    metrics.count(f"messages_{direction}.{METRIC_NAMES.get(message_type, str(message_type))}", count)
+    metrics.count(f"bytes_{direction}", size * count)
+
+def get_log_extra(player_color: str, player_addr: Any, player_num: int | None, session_id: int | None = None) -> Dict[str, Any]:
+    """The fields that log.LogFormatter prefixes the messages about a player with, player_num is None for a spectator"""
+    return {"color": player_color, "addr": player_addr, "player": player_num, "session": session_id}
+
+class Player:
+    def __init__(self, connection: StreamConnection, addr: Any, player_num: int, session_id: int) -> None:
+        self.connection = connection
+        self.addr = addr
+        self.player_num = player_num
+        self.session_id = session_id
+        self.color: str = PLAYER_COLORS[player_num - 1]
+        self.ready: bool = False # True once the handshake is done, messages for the player are held back until then
+        self.log_extra: Dict[str, Any] = get_log_extra(self.color, addr, player_num, session_id)
+        self.resume_token: bytes | None = None # issued in the handshake if the client can resume
+        self.away: bool = False # True while the connection is lost and the player may still resume
+        self.resume_task: asyncio.Task | None = None # ends the session if the player does not resume in time
+
+    def reconnect(self, connection: StreamConnection, addr: Any) -> None:
+        self.connection = connection
+        self.addr = addr
+        self.away = False
+        self.ready = False
+        self.log_extra = get_log_extra(self.color, addr, self.player_num, self.session_id)
+
+    # the arguments are only formatted if the level is enabled, so that the relay path does not build strings nobody reads
+    def info(self, msg: str, *args: Any) -> None:
+        server_logger.info(msg, *args, extra = self.log_extra)
+
+    def debug(self, msg: str, *args: Any) -> None:
+        server_logger.debug(msg, *args, extra = self.log_extra)
+
+class Spectator:
+    def __init__(self, connection: StreamConnection, addr: Any, session_id: int) -> None:
+        self.connection = connection
+        self.addr = addr
+        self.transport: asyncio.WriteTransport = connection.writer.transport
+        self.compressed: bool = connection.compression is not None # spectators are sent one of two versions of every frame
+        self.lagging: bool = False # True while it is sent nothing, because it has not received what it was sent before
+        self.log_extra: Dict[str, Any] = get_log_extra(colors.GRAY, addr, None, session_id)
+
+    def info(self, msg: str, *args: Any) -> None:
+        server_logger.info(msg, *args, extra = self.log_extra)
+
+def encode_spectator_frame(message_type: int, player_num: int, payload: bytes, compressed: bool) -> bytes:
+    payload = get_spectator_payload(player_num, payload)
+    if compressed:
+        message_type, payload = PayloadCompression().compress(message_type, payload)
+    return encode_frame(message_type, payload)
+
+class Session:
+    def __init__(self, session_id: int, recording: MatchRecording | None = None, legacy: bool = False) -> None:
+        self.session_id = session_id
+        self.legacy = legacy # its players send their entities pickled in the legacy format, which a framed client can not decode
+        self.players: Dict[int, Player] = {}
+        self.undelivered: Dict[int, List[Tuple[int, WirePayload]]] = {1: [], 2: []} # messages for players that are not ready yet
+        self.terminated: bool = False
+        self.recording = recording
+        self.started_at: float = time.monotonic()
+        self.messages: int = 0 # received from both players
+        self.bytes: int = 0
+        # what a resuming player is sent instead of the messages it has missed: the public entities of its opponent (rebuilt from
+        # the last keyframe of each player and the deltas after it) and whose turn it is
+        self.cached_updates: Dict[int, deque[WirePayload]] = {1: deque(maxlen = MAX_CACHED_UPDATES), 2: deque(maxlen = MAX_CACHED_UPDATES)}
+        self.current_player_num: int = 1
+        self.spectators: Set[Spectator] = set()
+        # what a new or lagging spectator is sent first (both players' keyframes and whose turn it is) by whether it is
+        # compressed, built once for all spectators that need it until the next update
+        self.catch_up_frames: Dict[bool, bytes] = {}
+
+    def get_free_player_num(self) -> int | None:
+        return next((player_num for player_num in (1, 2) if player_num not in self.players), None)
 
-def print_player_info(player_color: str, player_addr: Any, player_num: int, info):
-    print(player_color + f"{player_addr} [PLAYER {player_num}] " + colors.ENDC + info)
+    def add_player(self, connection: StreamConnection, addr: Any) -> Player:
+        player_num = self.get_free_player_num()
+        player = Player(connection, addr, player_num, self.session_id)
+        self.players[player_num] = player
+        return player
 
-def print_player_msg(player_color: str, player_addr: Any, player_num: int, msg):
-    print(player_color + f"{player_addr} [PLAYER {player_num}]: " + colors.ENDC + msg)
+    def get_opponent(self, player: Player) -> Player | None:
+        return self.players.get(3 - player.player_num)
 
-def reject_client(conn: socket.socket, addr: Any) -> None:
-    print_player_info(colors.RED, addr, len(PLAYER_COLORS) + 1, "connected. Lobby is full, rejecting...")
-    with conn:
+    async def set_ready(self, player: Player) -> None:
+        player.ready = True
+        undelivered = self.undelivered[player.player_num]
+        for message_type, payload in undelivered:
+            count_message("out", message_type, player.connection.write_message(message_type, payload))
+        undelivered.clear()
+        await player.connection.writer.drain()
+
+    async def relay(self, sender: Player, message_type: int, payload: WirePayload) -> None:
+        """The payload is only decompressed if the spectators, the recording or the receiver need it"""
+        if message_type == SOCKET_SHARED_ENTITIES_UPDATE:
+            self.cached_updates[sender.player_num].append(payload) # a keyframe is looked for only when a snapshot is asked for
+        elif message_type == SOCKET_YOUR_TURN:
+            self.current_player_num = 3 - sender.player_num
+        if message_type in SPECTATED_MESSAGE_TYPES:
+            self.catch_up_frames.clear()
+            if self.spectators:
+                self.broadcast(sender.player_num if message_type == SOCKET_SHARED_ENTITIES_UPDATE else self.current_player_num, message_type, payload.plain)
+        if self.recording is not None and message_type in RECORDED_MESSAGE_TYPES:
+            self.recording.record(sender.player_num, message_type, payload.plain) # only queued, the file is written on another thread
+        receiver_num: int = 3 - sender.player_num
+        receiver = self.players.get(receiver_num)
+        if receiver is not None and receiver.ready:
+            count_message("out", message_type, await receiver.connection.send_message(message_type, payload))
+        else: # the opponent gets it as soon as it joins, the sender does not have to wait for that
+            self.undelivered[receiver_num].append((message_type, payload))
+
+    def get_snapshot(self, player_num: int) -> bytes | None:
+        """A keyframe of the player's public entities as of its last update, None if they can not be rebuilt"""
         try:
-            sendall_with_end(conn, SOCKET_LOBBY_FULL)
-            data: bytes = b""
-            while data:
-                data = conn.recv(1024) # wait until the client disconnects
-        finally:
-            print_player_info(colors.RED, addr, len(PLAYER_COLORS) + 1, "disconnected")
-            
-    return
-        
-def handle_client(conn: socket.socket, addr: Any) -> None:
-    player_num: int = connections[(conn, addr)]
-    player_color = PLAYER_COLORS[player_num - 1]
-
-    print_player_info(player_color, addr, player_num, "connected")
-    with conn:
+            updates = [payload.plain for payload in self.cached_updates[player_num]]
+        except ConnectionError: # a payload that can not be decompressed, its receiver has been sent it as it is
+            return None
+        keyframe_index = next((index for index in range(len(updates) - 1, -1, -1) if is_keyframe(updates[index])), None)
+        if keyframe_index is None: # e.g. a legacy client never sends a keyframe
+            return None
+        state: Dict[int, bytes] = {}
         try:
-            other_player = None
-            while True:
-                encoded_data: bytes = recvall(conn)
-                decoded_data: str = encoded_data.decode()
-                print_player_msg(player_color, addr, player_num, decoded_data)
-                if encoded_data == SOCKET_CONNECTION_ESTABLISHED:
-                    sendall_with_end(conn, SOCKET_CONNECTION_ESTABLISHED)
-                    sendall_with_end(conn, player_num.to_bytes())
-                    connections[(conn, addr)] = "ready"
-
-                elif encoded_data == SOCKET_SHARED_ENTITIES_UPDATE:
-                    public_entities: List[Entity] = pickle.loads(recvall(conn))
-                    for entity in public_entities:
-                        print_player_info(player_color, addr, player_num, f"Received {'iterable ' if isinstance(entity, Iterable) else ''}entity [{entity}] at {entity.coords}")
-
-                        if isinstance(entity, Iterable) and len(entity) > 0:
-                            print_player_info(player_color, addr, player_num, f"Iterable entity [{entity}] contains:")
-                            for e in entity:
-                                print_player_info(player_color, addr, player_num, f"[{e}] at {e.coords}")
-
-                    entities_sent: bool = False
-                    while not entities_sent: # this could be an endless loop if the second player hasn't yet joined, so if this player disconnects, we need to handle that
-                        if len(connections) > 1:
-                            other_conn_addr = next((conn_addr for conn_addr in list(connections.keys()) if conn_addr != (conn, addr)), None)
-                            if other_conn_addr and connections[other_conn_addr] == "ready":
-                                other_player: socket.socket = other_conn_addr[0]
-                                sendall_with_end(other_player, SOCKET_SHARED_ENTITIES_UPDATE)
-                                sendall_with_end(other_player, pickle.dumps(public_entities))
-                                entities_sent = True
-                        else:
-                            incoming_data, _, _ = select.select([conn], [], [], 1.0) # timeout for recv is set to 1 second
-                            if incoming_data: # probably a disconnection, because the client should not have anything to say at this point
-                                recvall(conn)
-                            else:
-                                continue
-
-                elif encoded_data == SOCKET_YOUR_TURN:
-                    sendall_with_end(other_player, SOCKET_YOUR_TURN)
-        except ConnectionError:
-            if len(connections) == 0: # the error is initiated by another connection, which has already cleared up the list of connections
-                conn.close()
-                print_player_info(player_color, addr, player_num, "terminated")
-            else: # the error is initiated by this connection
-                conn.close()
-                print_player_info(player_color, addr, player_num, "disconnected")
-                if other_player:
-                    print("Unable to continue the game session. Terminating remaining connections...")
-                    sendall_with_end(other_player, SOCKET_TERMINATION_REQUEST)
-                    other_player.shutdown(socket.SHUT_RDWR)
-                connections.clear()
+            for payload in updates[keyframe_index:]: # every delta is based on the version before it, see EntitySyncSender
+                update = parse_update(payload)
+                apply_update_to_state(state, update)
+        except CodecError:
+            return None
+        # the version is the sender's, so the ack of the resumed player brings the sender back in sync
+        return encode_update(SyncUpdate(update.version, 0, True, [], list(state.items())))
+
+    ##### SPECTATORS #####
+    def add_spectator(self, connection: StreamConnection, addr: Any, accepted: int | None) -> Spectator:
+        count_message("out", SOCKET_SPECTATE, connection.write_message(SOCKET_SPECTATE, get_spectate_reply(self.session_id, accepted, self.current_player_num)))
+        connection.compression = get_compression(accepted)
+        spectator = Spectator(connection, addr, self.session_id)
+        self.catch_up(spectator)
+        self.spectators.add(spectator)
+        return spectator
+
+    def get_catch_up_frames(self, compressed: bool) -> bytes:
+        frames = self.catch_up_frames.get(compressed)
+        if frames is None:
+            snapshots = [(player_num, self.get_snapshot(player_num)) for player_num in (1, 2)]
+            frames = self.catch_up_frames[compressed] = b"".join(
+                [encode_spectator_frame(SOCKET_SHARED_ENTITIES_UPDATE, player_num, snapshot, compressed) for player_num, snapshot in snapshots if snapshot is not None] +
+                [encode_spectator_frame(SOCKET_YOUR_TURN, self.current_player_num, b"", compressed)])
+        return frames
+
+    def catch_up(self, spectator: Spectator) -> None:
+        frames = self.get_catch_up_frames(spectator.compressed)
+        spectator.connection.write_frame(frames)
+        metrics.count("bytes_out", len(frames))
+
+    def broadcast(self, player_num: int, message_type: int, payload: bytes) -> None:
+        """Frames the message once and writes the same bytes to every spectator (a transport keeps a reference to them instead of a
+        copy, unless the socket takes only a part), without waiting for any of them: a spectator whose buffer is full is skipped
+        and caught up with keyframes once it has drained"""
+        frames: Dict[bool, bytes] = {}
+        sent: int = 0
+        sent_bytes: int = 0
+        for spectator in self.spectators:
+            transport = spectator.transport
+            if transport.is_closing():
+                continue
+            buffered = transport.get_write_buffer_size()
+            if spectator.lagging:
+                if buffered <= SPECTATOR_RESYNC_BUFFER: # the keyframes already include this message
+                    spectator.lagging = False
+                    self.catch_up(spectator)
+                    metrics.count("spectator_resyncs")
+                continue
+            if buffered > SPECTATOR_MAX_BUFFER:
+                spectator.lagging = True
+                metrics.count("spectators_lagging")
+                continue
+            frame = frames.get(spectator.compressed)
+            if frame is None:
+                frame = frames[spectator.compressed] = encode_spectator_frame(message_type, player_num, payload, spectator.compressed)
+            spectator.connection.write_frame(frame)
+            sent += 1
+            sent_bytes += len(frame)
+        if sent:
+            metrics.count(f"messages_out.spectated_{METRIC_NAMES[message_type]}", sent)
+            metrics.count("bytes_out", sent_bytes)
+
+    def end_spectating(self) -> None:
+        """Tells the spectators that the match is over, what they have not received yet is still sent"""
+        for spectator in self.spectators:
+            if not spectator.transport.is_closing():
+                count_message("out", SOCKET_TERMINATION_REQUEST, spectator.connection.write_message(SOCKET_TERMINATION_REQUEST))
+                spectator.connection.writer.close()
+    #####
+
+    def get_stats(self) -> Dict[str, Any]:
+        age = max(time.monotonic() - self.started_at, 1.0) # a session of a few milliseconds would look busier than it is
+        return {
+            "session": self.session_id,
+            "players": len(self.players),
+            "away": sum(1 for player in self.players.values() if player.away),
+            "spectators": len(self.spectators),
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "messages_per_s": round(self.messages / age, 1),
+            "bytes_per_s": round(self.bytes / age, 1),
+            "age_s": round(time.monotonic() - self.started_at, 1)
+        }
+
+    def stop_recording(self) -> None:
+        if self.recording is not None:
+            self.recording.close()
+
+    async def terminate(self, initiator: Player) -> None:
+        self.terminated = True
+        self.stop_recording()
+        self.end_spectating()
+        opponent = self.get_opponent(initiator)
+        if opponent is not None and not opponent.away:
+            server_logger.info("Unable to continue the game session %d. Terminating remaining connections...", self.session_id)
+            try:
+                count_message("out", SOCKET_TERMINATION_REQUEST, await opponent.connection.send_message(SOCKET_TERMINATION_REQUEST))
+            except ConnectionError:
+                pass
+            await opponent.connection.close()
+
+    async def shutdown(self) -> None:
+        self.terminated = True
+        self.stop_recording()
+        self.end_spectating()
+        for player in self.players.values():
+            if player.away:
+                continue
+            try:
+                count_message("out", SOCKET_TERMINATION_REQUEST, await player.connection.send_message(SOCKET_TERMINATION_REQUEST))
+            except ConnectionError:
+                pass
+            await player.connection.close()
+
+class Lobby:
+    """Pairs incoming clients into independent sessions"""
+    def __init__(self, max_sessions: int = MAX_SESSIONS, first_session_id: int = 1, session_id_step: int = 1, recorder: MatchRecorder | None = None) -> None:
+        self.max_sessions = max_sessions
+        self.recorder = recorder
+        self.sessions: Dict[int, Session] = {}
+        self.waiting: deque[Session] = deque() # sessions whose first player waits for an opponent
+        self.accepted: int = 0 # the number of clients that tried to join
+        self.handled: int = 0 # the number of connections that have reached handle_client, whether they joined or not
+        self.resume_tokens: Dict[bytes, Tuple[Session, Player]] = {}
+        self.on_change: Callable[[], None] | None = None
+        self.__next_session_id: int = first_session_id
+        self.__session_id_step: int = session_id_step # keeps session ids unique across worker processes
+
+    def join(self, connection: StreamConnection, addr: Any) -> Tuple[Session, Player] | None:
+        """Returns the session and the player that the client became, or None if the server is full"""
+        self.accepted += 1
+        legacy = bool(connection.legacy)
+        while self.waiting and self.waiting[0].terminated:
+            self.waiting.popleft()
+        # the entity updates are relayed as they are, so a legacy client is only paired with another legacy client
+        session = next((session for session in self.waiting if session.legacy == legacy and not session.terminated), None)
+        if session is not None:
+            self.waiting.remove(session)
+        elif len(self.sessions) < self.max_sessions:
+            session = Session(self.__next_session_id, self.recorder.start_recording(self.__next_session_id) if self.recorder else None, legacy)
+            self.__next_session_id += self.__session_id_step
+            self.sessions[session.session_id] = session
+            self.waiting.append(session)
+            metrics.count("sessions_started")
+        else:
+            self.__changed()
+            return None
+        player = session.add_player(connection, addr)
+        self.__changed()
+        return session, player
+
+    def on_connection(self) -> None:
+        """Counts a connection before its handshake is read, the main process compares this with the connections it has handed over"""
+        self.handled += 1
+
+    def on_connection_lost(self) -> None:
+        """A connection that has ended before joining, the main process is told so that it corrects its estimate of this lobby"""
+        self.__changed()
+
+    def remove(self, session: Session) -> None:
+        if self.sessions.pop(session.session_id, None) is not None:
+            metrics.count("sessions_ended")
+        if session in self.waiting:
+            self.waiting.remove(session)
+        self.__forget_players(session)
+        self.__changed()
+
+    ##### RESUME #####
+    def issue_resume_token(self, session: Session, player: Player) -> bytes:
+        """A player keeps its token when it resumes"""
+        if player.resume_token is None:
+            player.resume_token = new_resume_token(session.session_id)
+            self.resume_tokens[player.resume_token] = (session, player)
+        return player.resume_token
+
+    def can_hold(self, session: Session, player: Player) -> bool:
+        """A player without an opponent yet loses nothing by joining again, so only its game is worth holding"""
+        return RESUME_GRACE > 0 and player.resume_token is not None and session.get_opponent(player) is not None
+
+    def hold(self, session: Session, player: Player) -> None:
+        """Keeps the place of a player whose connection is lost, the session ends if it does not resume within RESUME_GRACE"""
+        player.away = True
+        player.ready = False
+        player.resume_task = asyncio.create_task(self.__wait_for_resume(session, player))
+        self.__changed()
+
+    def resume(self, resume_token: bytes, connection: StreamConnection, addr: Any) -> Tuple[Session, Player] | None:
+        """Puts a client back into its session, None if the token is unknown or its session has ended"""
+        session, player = self.resume_tokens.get(resume_token, (None, None))
+        if session is None or session.terminated:
+            return None
+        if player.resume_task is not None:
+            player.resume_task.cancel()
+            player.resume_task = None
+        if not player.away: # the old connection has not been found dead yet, e.g. the client noticed first
+            player.connection.writer.transport.abort()
+        player.reconnect(connection, addr)
+        self.__changed()
+        return session, player
+
+    async def __wait_for_resume(self, session: Session, player: Player) -> None:
+        await asyncio.sleep(RESUME_GRACE)
+        player.resume_task = None # remove() must not cancel this task
+        player.info("has not resumed within %g s", RESUME_GRACE)
+        metrics.count("resumes_expired")
+        self.remove(session)
+        await session.terminate(initiator = player)
+
+    def __forget_players(self, session: Session) -> None:
+        for player in session.players.values():
+            self.resume_tokens.pop(player.resume_token, None)
+            if player.resume_task is not None:
+                player.resume_task.cancel()
+                player.resume_task = None
+    #####
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "accepted": self.accepted,
+            "handled": self.handled,
+            "sessions": len(self.sessions),
+            "waiting": len(self.waiting),
+            "waiting_legacy": sum(1 for session in self.waiting if session.legacy),
+            "players": sum(len(session.players) for session in self.sessions.values()),
+            "away": sum(1 for session in self.sessions.values() for player in session.players.values() if player.away),
+            "spectators": sum(len(session.spectators) for session in self.sessions.values())
+        }
+
+    def get_spectated_session(self, session_id: int) -> Session | None:
+        """0 stands for the busiest session that has both players, the pickled entities of legacy sessions can not be watched"""
+        if session_id:
+            session = self.sessions.get(session_id)
+        else:
+            session = max((session for session in self.sessions.values() if len(session.players) == 2 and not session.legacy), key = lambda session: session.get_stats()["messages_per_s"], default = None)
+        return session if session is not None and not session.terminated and not session.legacy else None
+
+    def get_hot_sessions(self, count: int = HOT_SESSIONS) -> List[Dict[str, Any]]:
+        """The sessions with the most messages per second over their lifetime"""
+        return sorted((session.get_stats() for session in self.sessions.values()), key = lambda stats: stats["messages_per_s"], reverse = True)[:count]
+
+    async def shutdown(self) -> None:
+        for session in list(self.sessions.values()):
+            self.__forget_players(session)
+            await session.shutdown()
+        self.sessions.clear()
+        self.waiting.clear()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def __changed(self) -> None:
+        if self.on_change:
+            self.on_change()
+
+def get_recorder() -> MatchRecorder | None:
+    return MatchRecorder(RECORD_DIR) if RECORD_DIR else None
+
+lobby: Lobby = None # created in serve() or serve_worker(), so that the recorder thread is started in the process that serves
+
+def log_entities_update(player: Player, wire_payload: WirePayload) -> None:
+    """The update is only decompressed and parsed at DEBUG and only decoded for the sampled entity dumps, otherwise this
+    returns right away"""
+    dump_entities = should_dump_entities()
+    if not dump_entities and not server_logger.isEnabledFor(logging.DEBUG):
+        return
+    payload = wire_payload.plain
+    try:
+        decode_started_at = time.perf_counter()
+        update = parse_update(payload)
+        public_entities: List[Entity] = [decode_entity(encoded_entity) for _, encoded_entity in update.upserts] if dump_entities else []
+        if dump_entities:
+            metrics.observe("decode", time.perf_counter() - decode_started_at)
+        player.debug("Sent %s v%d with %d changed and %d removed entities", "keyframe" if update.keyframe else "delta", update.version, len(update.upserts), len(update.removed))
+    except CodecError as e: # e.g. a pickled snapshot from a legacy client, it is relayed as is to its legacy opponent, but never unpickled here
+        player.debug("Sent %d bytes that could not be decoded (%s)", len(payload), e)
+        public_entities = []
+    for entity in public_entities:
+        entity_logger.debug("Received %sentity [%s] at %s", "iterable " if isinstance(entity, Iterable) else "", entity, entity.coords, extra = player.log_extra)
+
+        if isinstance(entity, Iterable) and len(entity) > 0:
+            entity_logger.debug("Iterable entity [%s] contains:", entity, extra = player.log_extra)
+            for e in entity:
+                entity_logger.debug("[%s] at %s", e, e.coords, extra = player.log_extra)
+
+async def reject_client(connection: StreamConnection, addr: Any, message_type: int, reason: str) -> None:
+    """Answers the handshake with message_type (SOCKET_LOBBY_FULL or SOCKET_TERMINATION_REQUEST) and waits for the client to leave"""
+    log_extra = get_log_extra(colors.RED, addr, len(PLAYER_COLORS) + 1)
+    server_logger.info("connected. %s", reason, extra = log_extra)
+    try:
+        async with asyncio.timeout(HEARTBEAT_TIMEOUT): # a client that does not leave is not waited for any longer
+            count_message("out", message_type, await connection.send_message(message_type))
+            while await connection.reader.read(1024): # wait until the client disconnects
+                pass
+    except (ConnectionError, TimeoutError):
+        pass
+    finally:
+        await connection.close()
+        server_logger.info("disconnected", extra = log_extra)
+
+async def complete_handshake(session: Session, player: Player, capabilities: Capabilities | None, resumed: bool) -> None:
+    """Replies to SOCKET_CONNECTION_ESTABLISHED, a resumed player is sent the entities of its opponent right after the reply"""
+    connection = player.connection
+    accepted = accept_capabilities(capabilities) # None for clients that do not know the capability handshake
+    resume_token = lobby.issue_resume_token(session, player) if accepted is not None and accepted & CAPABILITY_RESUME else b""
+    reply = get_connection_established(player.player_num, accepted, resume_token, session.current_player_num, resumed)
+    count_message("out", SOCKET_CONNECTION_ESTABLISHED, connection.write_message(SOCKET_CONNECTION_ESTABLISHED, reply))
+    connection.compression = get_compression(accepted)
+    if resumed: # nothing is awaited since the reply, so no message can slip in between the snapshot and the messages after it
+        session.undelivered[player.player_num].clear() # the snapshot and the turn in the reply replace what the player has missed
+        opponent = session.get_opponent(player)
+        snapshot = session.get_snapshot(opponent.player_num) if opponent is not None else None
+        if snapshot is not None:
+            count_message("out", SOCKET_SHARED_ENTITIES_UPDATE, connection.write_message(SOCKET_SHARED_ENTITIES_UPDATE, snapshot))
+    await session.set_ready(player)
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    lobby.on_connection()
+    connection = StreamConnection(reader, writer)
+    addr: Any = writer.get_extra_info("peername")
+    try:
+        set_keepalive(writer.get_extra_info("socket"))
+    except OSError: # e.g. the client is already gone
+        pass
+    try:
+        async with asyncio.timeout(HEARTBEAT_TIMEOUT if HEARTBEAT_INTERVAL > 0 else None):
+            message_type, payload = await connection.recv_wire_message() # the handshake decides whether the client joins, resumes or spectates
+    except (ConnectionError, TerminationRequest, TimeoutError):
+        await connection.close()
+        lobby.on_connection_lost()
+        return
+    except asyncio.CancelledError: # the process shuts down before the client has sent its handshake
+        connection.writer.close()
+        raise
+    count_message("in", message_type, connection.last_message_size)
+    if message_type == SOCKET_SPECTATE:
+        await handle_spectator(connection, addr, payload.plain)
+        return
+    capabilities = parse_capabilities(payload.plain) if message_type == SOCKET_CONNECTION_ESTABLISHED else None
+    resumed = capabilities is not None and capabilities.resume_token is not None
+    if resumed:
+        joined = lobby.resume(capabilities.resume_token, connection, addr)
+        if joined is None:
+            metrics.count("resumes_failed")
+            await reject_client(connection, addr, SOCKET_TERMINATION_REQUEST, "Its session has ended, rejecting...")
+            lobby.on_connection_lost()
+            return
+        metrics.count("sessions_resumed")
+    else:
+        joined = lobby.join(connection, addr)
+        if joined is None:
+            metrics.count("connections_rejected")
+            await reject_client(connection, addr, SOCKET_LOBBY_FULL, "Lobby is full, rejecting...")
             return
+    metrics.count("connections_opened")
+
+    player_session, player = joined
+    player.info("resumed" if resumed else "connected")
+    received_at = time.perf_counter()
+    left = False # True if the client has ended the game on purpose
+    try:
+        while True:
+            player_session.messages += 1
+            player_session.bytes += connection.last_message_size
+            player.debug("%s", SOCKET_MESSAGE_NAMES.get(message_type) or f"UNKNOWN MESSAGE {message_type}")
+            if message_type == SOCKET_CONNECTION_ESTABLISHED:
+                await complete_handshake(player_session, player, capabilities, resumed)
+
+            elif message_type == SOCKET_SHARED_ENTITIES_UPDATE:
+                log_entities_update(player, payload)
+                await player_session.relay(player, message_type, payload)
+                metrics.observe("relay", time.perf_counter() - received_at) # includes the logging, which is a part of the relay path
 
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((HOST, PORT))
-    s.listen()
-    print(f"Listening on {HOST}:{PORT}")
+            elif message_type in (SOCKET_YOUR_TURN, SOCKET_ENTITIES_ACK):
+                await player_session.relay(player, message_type, payload)
 
+            message_type, payload = await connection.recv_wire_message()
+            received_at = time.perf_counter()
+            count_message("in", message_type, connection.last_message_size)
+    except TerminationRequest:
+        left = True
+    except ConnectionError:
+        pass
+    finally:
+        if player.connection is not connection: # the player has resumed on another connection before this one was found dead
+            player.info("replaced by a resumed connection")
+        elif player_session.terminated: # the session was terminated by the other connection
+            player.info("terminated")
+        elif not left and lobby.can_hold(player_session, player):
+            player.info("disconnected, its place is kept for %g s", RESUME_GRACE)
+            lobby.hold(player_session, player)
+        else: # the error is initiated by this connection
+            player.info("left" if left else "disconnected")
+            lobby.remove(player_session) # only this session is torn down, the others are not affected
+            await player_session.terminate(initiator = player)
+        await connection.close()
+        metrics.count("connections_closed")
+
+async def handle_spectator(connection: StreamConnection, addr: Any, payload: bytes) -> None:
+    session_id, capabilities = parse_spectate_request(payload)
+    session = lobby.get_spectated_session(session_id)
+    if session is None:
+        metrics.count("spectators_rejected")
+        await reject_client(connection, addr, SOCKET_TERMINATION_REQUEST, "There is no such match to spectate, rejecting...")
+        return
+    if len(session.spectators) >= MAX_SPECTATORS:
+        metrics.count("spectators_rejected")
+        await reject_client(connection, addr, SOCKET_LOBBY_FULL, f"Session {session.session_id} has too many spectators, rejecting...")
+        return
+    spectator = session.add_spectator(connection, addr, accept_capabilities(capabilities))
+    metrics.count("spectators_joined")
+    spectator.info("started spectating")
+    try:
+        while True: # only heartbeats are expected, the connection is read to see it close
+            message_type, _ = await connection.recv_message()
+            count_message("in", message_type, connection.last_message_size)
+    except (ConnectionError, TerminationRequest):
+        pass
+    finally:
+        session.spectators.discard(spectator)
+        spectator.info("stopped spectating")
+        await connection.close()
+
+async def keep_players_alive() -> None:
+    """Every HEARTBEAT_INTERVAL / 2, sends heartbeats to the players that have been sent nothing for HEARTBEAT_INTERVAL and drops
+    the players whose heartbeats have stopped, so a dead peer is detected within HEARTBEAT_TIMEOUT + HEARTBEAT_INTERVAL / 2"""
+    if HEARTBEAT_INTERVAL <= 0:
+        return
     while True:
-        conn: socket.socket
-        addr: Any
-        conn, addr = s.accept()
-        if len(connections) < 2:
-            connections[(conn, addr)] = len(connections) + 1 # set player number
-            client_thread: threading.Thread = threading.Thread(target=handle_client, args=(conn, addr))
-            client_thread.start()
+        await asyncio.sleep(HEARTBEAT_INTERVAL / 2)
+        now = time.monotonic()
+        for session in list(lobby.sessions.values()):
+            for player in list(session.players.values()):
+                if player.away:
+                    continue
+                connection = player.connection
+                if has_timed_out(connection, now):
+                    player.info("timed out")
+                    metrics.count("heartbeat_timeouts")
+                    connection.writer.transport.abort() # handle_client sees the connection lost and tears the session down
+                elif player.ready and needs_heartbeat(connection, now):
+                    count_message("out", SOCKET_HEARTBEAT, connection.write_message(SOCKET_HEARTBEAT))
+            for spectator in list(session.spectators):
+                connection = spectator.connection
+                if has_timed_out(connection, now):
+                    spectator.info("timed out")
+                    metrics.count("heartbeat_timeouts")
+                    spectator.transport.abort()
+                elif not spectator.lagging and needs_heartbeat(connection, now):
+                    count_message("out", SOCKET_HEARTBEAT, connection.write_message(SOCKET_HEARTBEAT))
+
+def add_shutdown_handler(stop: Callable[[], None]) -> None:
+    if _os_name != "nt": # asyncio does not support signal handlers on Windows, KeyboardInterrupt is raised there instead
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGINT, stop)
+        loop.add_signal_handler(signal.SIGTERM, stop)
+
+##### STATS #####
+# get_stats_report is a coroutine function that returns the current report, the one of the main process asks the workers for theirs
+
+def get_local_snapshot() -> Dict[str, Any]:
+    """The metrics of this process together with the stats of its lobby"""
+    return metrics.snapshot(**lobby.get_stats(), hot_sessions = lobby.get_hot_sessions(), dropped_log_records = get_dropped_records())
+
+def get_stats_report(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    report = get_report(snapshot)
+    if "hot_sessions" in report: # the lists of all workers after merging
+        report["hot_sessions"] = sorted(report["hot_sessions"], key = lambda stats: stats["messages_per_s"], reverse = True)[:HOT_SESSIONS]
+    return report
+
+async def get_local_stats_report() -> Dict[str, Any]:
+    return get_stats_report(get_local_snapshot())
+
+async def print_stats(get_stats_report: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    report = await get_stats_report()
+    hot_sessions = ", ".join(f"{stats['session']} ({stats['messages_per_s']}/s)" for stats in report.get("hot_sessions", []) if stats["messages"])
+    server_logger.info("Stats: %s%s", get_summary_line(report), f", hot sessions: {hot_sessions}" if hot_sessions else "")
+
+async def report_stats(get_stats_report: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    if STATS_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        await print_stats(get_stats_report)
+
+def add_stats_handler(get_stats_report: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    """SIGUSR1 prints the stats right away"""
+    if _os_name == "nt":
+        return
+    loop = asyncio.get_running_loop()
+    pending: Set[asyncio.Task] = set()
+    def on_signal() -> None:
+        task = asyncio.create_task(print_stats(get_stats_report))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    loop.add_signal_handler(signal.SIGUSR1, on_signal)
+
+async def handle_stats_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, get_stats_report: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    """A minimal HTTP/1.1 responder: GET /stats returns the report as JSON"""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), CONTROL_TIMEOUT)
+        while await asyncio.wait_for(reader.readline(), CONTROL_TIMEOUT) not in (b"\r\n", b"\n", b""): # the headers are not needed
+            pass
+        method, path, *_ = request_line.split() + [b"", b""]
+        if method == b"GET" and path.split(b"?")[0] in (b"/", b"/stats"):
+            status, body = "200 OK", json.dumps(await get_stats_report(), indent = 2).encode()
         else:
-            rejection_thread: threading.Thread = threading.Thread(target=reject_client, args=(conn, addr))
-            rejection_thread.start()
\ No newline at end of file
+            status, body = "404 Not Found", json.dumps({"error": "only GET /stats is served"}).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.TimeoutError, ValueError): # ValueError: a line beyond the stream limit
+        pass
+    finally:
+        writer.close()
+
+async def start_stats_server(get_stats_report: Callable[[], Awaitable[Dict[str, Any]]]) -> asyncio.Server | None:
+    if not METRICS_PORT:
+        return None
+    server = await asyncio.start_server(lambda reader, writer: handle_stats_request(reader, writer, get_stats_report), METRICS_HOST, METRICS_PORT)
+    server_logger.info("Serving stats on http://%s:%d/stats", METRICS_HOST, METRICS_PORT)
+    return server
+#####
+
+async def serve() -> None:
+    global lobby
+    log_listener = start_logging()
+    lobby = Lobby(recorder = get_recorder())
+    get_primed_compressor() # builds the compression dictionary before the first client has to wait for it
+    server = await asyncio.start_server(handle_client, HOST, PORT, limit = SOCKET_STREAM_LIMIT)
+    server_logger.info("Listening on %s:%d", HOST, PORT)
+    stats_server = await start_stats_server(get_local_stats_report)
+    stopped = asyncio.Event()
+    add_shutdown_handler(stopped.set)
+    add_stats_handler(get_local_stats_report)
+    tasks = [asyncio.create_task(report_stats(get_local_stats_report)), asyncio.create_task(keep_players_alive())]
+    async with server:
+        await stopped.wait()
+    server_logger.info("Shutting down...")
+    for task in tasks:
+        task.cancel()
+    if stats_server is not None:
+        stats_server.close()
+    await lobby.shutdown()
+    stop_logging(log_listener)
+
+##### WORKER PROCESSES #####
+class ControlChannel:
+    """Frames exchanged between the main process and a worker over a Unix socket, accepted sockets are passed along as file descriptors"""
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.sock.setblocking(False) # a busy peer must not stall the event loop of this process
+        self.__buffer: bytearray = bytearray()
+        self.__fds: deque[int] = deque() # file descriptors that have arrived, but whose messages have not been parsed yet
+        self.__outgoing: deque[Tuple[bytes, int | None]] = deque() # frames that the socket has not taken yet, with the descriptor of their first byte
+        self.__writing: bool = False # True while the event loop waits for the socket to become writable
+
+    def send(self, message_type: int, payload: bytes = b"", fd: int | None = None) -> None:
+        """Queues a frame and writes as much as the socket takes, the rest is written by the event loop later; the file
+        descriptor is duplicated, so the caller may close its own right away"""
+        self.__outgoing.append((encode_frame(message_type, payload), os.dup(fd) if fd is not None else None))
+        if not self.__writing:
+            self.__flush()
+
+    def __flush(self) -> None:
+        while self.__outgoing:
+            data, fd = self.__outgoing[0]
+            try:
+                sent: int = socket.send_fds(self.sock, [data], [fd]) if fd is not None else self.sock.send(data)
+            except BlockingIOError:
+                break
+            if fd is not None: # the descriptor went along with the first byte
+                os.close(fd)
+            if sent < len(data):
+                self.__outgoing[0] = (data[sent:], None)
+            else:
+                self.__outgoing.popleft()
+        writing = bool(self.__outgoing)
+        if writing != self.__writing:
+            loop = asyncio.get_running_loop()
+            if writing:
+                loop.add_writer(self.sock.fileno(), self.__on_writable)
+            else:
+                loop.remove_writer(self.sock.fileno())
+            self.__writing = writing
+
+    def __on_writable(self) -> None:
+        try:
+            self.__flush()
+        except OSError: # the peer is gone, which the reader of the channel finds out
+            asyncio.get_running_loop().remove_writer(self.sock.fileno())
+            self.__writing = False
+            self.__drop_outgoing()
+
+    def __drop_outgoing(self) -> None:
+        for _, fd in self.__outgoing:
+            if fd is not None:
+                os.close(fd)
+        self.__outgoing.clear()
+
+    def receive(self) -> List[Tuple[int, bytes, int | None]]:
+        """Reads whatever is available and returns the complete messages as (message type, payload, file descriptor)"""
+        try:
+            data, fds, _, _ = socket.recv_fds(self.sock, SOCKET_RECEIVE_BUFFER_SIZE, 64)
+        except BlockingIOError:
+            return []
+        if not data:
+            raise ConnectionError
+        self.__buffer += data
+        self.__fds.extend(fds)
+
+        messages: List[Tuple[int, bytes, int | None]] = []
+        header_size: int = SOCKET_FRAME_HEADER.size
+        while len(self.__buffer) >= header_size:
+            message_type, length = parse_frame_header(self.__buffer)
+            if len(self.__buffer) < header_size + length:
+                break
+            payload: bytes = bytes(self.__buffer[header_size:header_size + length])
+            del self.__buffer[:header_size + length]
+            fd: int | None = self.__fds.popleft() if message_type == CONTROL_NEW_CONNECTION else None
+            messages.append((message_type, payload, fd))
+        return messages
+
+    def close(self) -> None:
+        if self.__writing:
+            asyncio.get_running_loop().remove_writer(self.sock.fileno())
+            self.__writing = False
+        self.__drop_outgoing()
+        for fd in self.__fds:
+            os.close(fd)
+        self.sock.close()
+
+async def handle_handed_over_client(client_socket: socket.socket) -> None:
+    try:
+        reader, writer = await asyncio.open_connection(sock = client_socket, limit = SOCKET_STREAM_LIMIT)
+    except OSError:
+        client_socket.close()
+        lobby.on_connection()
+        lobby.on_connection_lost()
+        return
+    await handle_client(reader, writer)
+
+async def serve_worker(worker_id: int, workers: int, control_socket: socket.socket) -> None:
+    global lobby
+    lobby = Lobby(first_session_id = worker_id + 1, session_id_step = workers, recorder = get_recorder())
+    get_primed_compressor() # builds the compression dictionary before the first client has to wait for it
+    channel = ControlChannel(control_socket)
+    send_stats = lambda: channel.send(CONTROL_STATS, json.dumps(lobby.get_stats()).encode())
+    loop = asyncio.get_running_loop()
+    stats_push: asyncio.TimerHandle | None = None
+
+    def push_stats() -> None:
+        nonlocal stats_push
+        stats_push = None
+        send_stats()
+
+    def schedule_stats_push() -> None:
+        """The stats are sent once for all the changes of the lobby within CONTROL_STATS_DELAY"""
+        nonlocal stats_push
+        if stats_push is None:
+            stats_push = loop.call_later(CONTROL_STATS_DELAY, push_stats)
+
+    lobby.on_change = schedule_stats_push
+    stopped = asyncio.Event()
+    client_tasks: Set[asyncio.Task] = set()
+
+    def on_control_message() -> None:
+        try:
+            messages = channel.receive()
+        except (ConnectionError, OSError): # the main process is gone
+            messages = [(CONTROL_SHUTDOWN, b"", None)]
+        for message_type, _, fd in messages:
+            if message_type == CONTROL_NEW_CONNECTION:
+                task = asyncio.create_task(handle_handed_over_client(socket.socket(fileno = fd)))
+                client_tasks.add(task)
+                task.add_done_callback(client_tasks.discard)
+            elif message_type == CONTROL_STATS:
+                send_stats()
+            elif message_type == CONTROL_METRICS:
+                channel.send(CONTROL_METRICS, json.dumps(get_local_snapshot()).encode())
+            elif message_type == CONTROL_SHUTDOWN:
+                stopped.set()
+
+    loop.add_reader(control_socket.fileno(), on_control_message)
+    send_stats()
+    heartbeat_task = asyncio.create_task(keep_players_alive())
+    await stopped.wait()
+    heartbeat_task.cancel()
+    loop.remove_reader(control_socket.fileno())
+    lobby.on_change = None
+    if stats_push is not None:
+        stats_push.cancel()
+    await lobby.shutdown()
+    channel.close()
+
+def run_worker(worker_id: int, workers: int, control_socket: socket.socket, log_queue: multiprocessing.Queue) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the main process decides when workers shut down
+    start_worker_logging(log_queue)
+    asyncio.run(serve_worker(worker_id, workers, control_socket))
+
+class Worker:
+    def __init__(self, worker_id: int, process: multiprocessing.Process, channel: ControlChannel) -> None:
+        self.worker_id = worker_id
+        self.process = process
+        self.channel = channel
+        self.handed_over: int = 0 # the number of connections handed over to the worker
+        self.stats: Dict[str, int] = {"accepted": 0, "handled": 0, "sessions": 0, "waiting": 0, "waiting_legacy": 0, "players": 0, "away": 0, "spectators": 0}
+        self.metrics: Dict[str, Any] | None = None # the last snapshot of its metrics
+        self.metrics_waiter: asyncio.Future | None = None # set while a snapshot is requested
+
+    def on_metrics(self, snapshot: Dict[str, Any]) -> None:
+        self.metrics = snapshot
+        if self.metrics_waiter is not None and not self.metrics_waiter.done():
+            self.metrics_waiter.set_result(None)
+
+    def request_metrics(self) -> asyncio.Future:
+        if self.metrics_waiter is None or self.metrics_waiter.done(): # a request that is still being answered is shared
+            self.metrics_waiter = asyncio.get_running_loop().create_future()
+            self.channel.send(CONTROL_METRICS)
+        return self.metrics_waiter
+
+    def on_stats(self, stats: Dict[str, int]) -> None:
+        # stats sent before the worker has seen every handed over connection are outdated, the local estimate is kept instead
+        if stats["handled"] >= self.handed_over:
+            self.stats = stats
+
+    def get_waiting(self, legacy: bool) -> int:
+        """The players that wait for an opponent of the given format, see Lobby.join"""
+        return self.stats["waiting_legacy"] if legacy else self.stats["waiting"] - self.stats["waiting_legacy"]
+
+    def assign(self, client_socket: socket.socket, legacy: bool = False) -> None:
+        change = -1 if self.get_waiting(legacy) > 0 else 1 # the client will be paired with the waiting player or wait itself
+        self.stats["waiting"] += change
+        if legacy:
+            self.stats["waiting_legacy"] += change
+        if change > 0:
+            self.stats["sessions"] += 1
+        self.stats["players"] += 1
+        self.hand_over(client_socket)
+
+    def hand_over(self, client_socket: socket.socket) -> None:
+        """Without the bookkeeping of assign(), for clients that resume or spectate a session of the worker"""
+        self.channel.send(CONTROL_NEW_CONNECTION, fd = client_socket.fileno())
+        self.handed_over += 1
+
+def choose_worker(workers: List[Worker], legacy: bool = False) -> Worker:
+    """Both players of a match must end up in the same worker, so a worker with a waiting player of the same format always goes first"""
+    waiting_worker = next((worker for worker in workers if worker.get_waiting(legacy) > 0 and worker.process.is_alive()), None)
+    if waiting_worker is not None:
+        return waiting_worker
+    return min((worker for worker in workers if worker.process.is_alive()), key = lambda worker: worker.stats["players"])
+
+def get_session_worker(workers: List[Worker], session_id: int) -> Worker | None:
+    """The worker that holds a session (see the session ids of Lobby), the one with the most players for 0"""
+    if session_id == 0:
+        return max((worker for worker in workers if worker.process.is_alive()), key = lambda worker: worker.stats["players"], default = None)
+    worker = workers[(session_id - 1) % len(workers)]
+    return worker if worker.process.is_alive() else None
+
+async def peek_handshake(client_socket: socket.socket) -> bytes:
+    """The start of what the client has sent, left in the socket for the worker to read; empty if it sends nothing in time"""
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    loop.add_reader(client_socket.fileno(), lambda: readable.done() or readable.set_result(None))
+    try:
+        await asyncio.wait_for(readable, CONTROL_TIMEOUT)
+        # the handshake is sent at once right after connecting, so it arrives in one segment
+        return client_socket.recv(HANDSHAKE_PEEK_SIZE, socket.MSG_PEEK)
+    except (TimeoutError, OSError):
+        return b""
+    finally:
+        loop.remove_reader(client_socket.fileno())
+
+def get_aggregate_stats(workers: List[Worker]) -> Dict[str, int]:
+    aggregate: Dict[str, int] = {"workers": sum(1 for worker in workers if worker.process.is_alive())}
+    for worker in workers:
+        for key, value in worker.stats.items():
+            aggregate[key] = aggregate.get(key, 0) + value
+    return aggregate
+
+async def get_aggregate_stats_report(workers: List[Worker]) -> Dict[str, Any]:
+    """Merges fresh snapshots of the workers, a worker that does not answer in time is represented by its last one"""
+    waiters: List[asyncio.Future] = []
+    for worker in workers:
+        if worker.process.is_alive():
+            try:
+                waiters.append(worker.request_metrics())
+            except OSError:
+                pass
+    if waiters:
+        await asyncio.wait(waiters, timeout = CONTROL_TIMEOUT)
+    workers_alive = sum(1 for worker in workers if worker.process.is_alive())
+    snapshots = [metrics.snapshot(workers = workers_alive, dropped_log_records = get_dropped_records())] + [worker.metrics for worker in workers if worker.metrics is not None]
+    return get_stats_report(merge_snapshots(snapshots))
+
+async def serve_with_workers(worker_count: int) -> None:
+    if not hasattr(socket, "send_fds"):
+        raise RuntimeError("worker processes require a platform that can pass sockets between processes (Unix)")
+
+    log_queue = get_worker_log_queue()
+    log_listener = start_logging(log_queue) # the main process writes the records of all workers
+    workers: List[Worker] = []
+    for worker_id in range(worker_count):
+        parent_socket, child_socket = socket.socketpair()
+        process = multiprocessing.get_context("spawn").Process(target = run_worker, args = (worker_id, worker_count, child_socket, log_queue), name = f"pharaoh-worker-{worker_id}")
+        process.start()
+        child_socket.close()
+        workers.append(Worker(worker_id, process, ControlChannel(parent_socket)))
+
+    loop = asyncio.get_running_loop()
+
+    def on_worker_message(worker: Worker) -> None:
+        try:
+            messages = worker.channel.receive()
+        except (ConnectionError, OSError):
+            loop.remove_reader(worker.channel.sock.fileno())
+            server_logger.error("Worker %d has exited", worker.worker_id)
+            return
+        for message_type, payload, _ in messages:
+            if message_type == CONTROL_STATS:
+                worker.on_stats(json.loads(payload))
+            elif message_type == CONTROL_METRICS:
+                worker.on_metrics(json.loads(payload))
+
+    for worker in workers:
+        loop.add_reader(worker.channel.sock.fileno(), on_worker_message, worker)
+
+    listening_socket = socket.create_server((HOST, PORT))
+    listening_socket.setblocking(False)
+    server_logger.info("Listening on %s:%d with %d worker processes", HOST, PORT, worker_count)
+
+    async def hand_over(client_socket: socket.socket) -> None:
+        with client_socket: # the worker has its own copy of the socket
+            handshake = await peek_handshake(client_socket)
+            session_id = peek_session_id(handshake)
+            legacy = handshake[:1] not in (b"", bytes((SOCKET_FRAME_MAGIC,))) # see StreamConnection.legacy
+            try:
+                if session_id is not None: # a resuming client or a spectator, a session of a worker that is gone is rejected by any worker
+                    (get_session_worker(workers, session_id) or choose_worker(workers)).hand_over(client_socket)
+                else:
+                    choose_worker(workers, legacy).assign(client_socket, legacy)
+                metrics.count("connections_handed_over")
+            except (ValueError, OSError) as e: # no worker is alive or it does not respond
+                metrics.count("handover_failures")
+                server_logger.error("Unable to hand over a connection: %s", e)
+
+    handovers: Set[asyncio.Task] = set()
+    async def accept_clients() -> None:
+        while True:
+            client_socket, _ = await loop.sock_accept(listening_socket)
+            task = asyncio.create_task(hand_over(client_socket)) # the handshake is awaited, but the next client is accepted meanwhile
+            handovers.add(task)
+            task.add_done_callback(handovers.discard)
+
+    get_stats_report = lambda: get_aggregate_stats_report(workers)
+    stats_server = await start_stats_server(get_stats_report)
+    stopped = asyncio.Event()
+    add_shutdown_handler(stopped.set)
+    add_stats_handler(get_stats_report)
+    tasks = [asyncio.create_task(accept_clients()), asyncio.create_task(report_stats(get_stats_report))]
+    await stopped.wait()
+
+    server_logger.info("Shutting down...")
+    for task in tasks:
+        task.cancel()
+    if stats_server is not None:
+        stats_server.close()
+    listening_socket.close()
+    for worker in workers:
+        loop.remove_reader(worker.channel.sock.fileno())
+        try:
+            worker.channel.send(CONTROL_SHUTDOWN)
+        except OSError:
+            pass
+    for worker in workers:
+        await asyncio.to_thread(worker.process.join, CONTROL_TIMEOUT)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.channel.close()
+    server_logger.info("Stats: %s", get_aggregate_stats(workers))
+    stop_logging(log_listener)
+#####
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve_with_workers(WORKERS) if WORKERS > 1 else serve())
+    except KeyboardInterrupt:
+        pass
@@ -1,14 +1,19 @@
-import pickle
+import asyncio
+import random
 import socket
 import threading
 import select
+import struct
 import re
+import time
+from array import array
 from typing import Dict, Tuple, List, Type, Any, Callable, overload
 from _collections_abc import Iterable
 from collections import namedtuple
 from os import getenv
 import dotenv
 from sortedcontainers import SortedList
+from sampler import get_sampler
 
 dotenv.load_dotenv()
 HOST: str = getenv('HOST') or "0.0.0.0"
@@ -73,18 +78,27 @@ SUPER_BUILDING_FACE_VALUES: List[str] = [SUPER_BUILDING_PREFIX + face_values.BAR
 
 Coordinates = namedtuple("Coordinates", ["x", "y"])
 
+PLAYER_SIDE_HEIGHT: int = 4
+# coordinates should always be in the form of (x, y)
+FIGHTING_CARD_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 9)
+PHARAOH_COORDINATES = Coordinates(MIN_X + 10, MAX_Y - 3)
+GUARD_COORDINATES_LIST: List[Coordinates] = [Coordinates(MIN_X + 7, MAX_Y - 3), Coordinates(MIN_X + 13, MAX_Y - 3)]
+MAIN_WARRIOR_LIST_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 5)
+MAIN_BANDAGE_LIST_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 3)
+MAIN_BUILDING_LIST_COORDINATES = Coordinates(MIN_X + 23, MAX_Y - 1)
+
 def flatten_iterable(iterable: Iterable):
     result = []
     for elem in iterable:
         result.append(elem)
         if isinstance(elem, Iterable):
-            if isinstance(elem, CardList):
-                elem.update_card_coordinates(0, len(elem))
             result.extend(flatten_iterable(elem))
     return result
 
+COLOR_CODE_PATTERN: re.Pattern = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+
 def remove_color_codes(s: str) -> str:
-    return re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]').sub('', s)
+    return COLOR_CODE_PATTERN.sub('', s)
 
 def index_by_identity(iterable: Iterable, obj: Any) -> int | None:
     for i, item in enumerate(iterable):
@@ -99,6 +113,7 @@ class classproperty:
         return self.fget(owner)
 
 class Entity:
+    __slots__ = ("content", "color", "selectable", "coords", "public", "help_string") # there may be a lot of entities, cards in particular
     def __init__(self, content: str, color: str = colors.GRAY, coords: Coordinates = None, selectable: bool = False, public: bool = False, help_string: str = "") -> None:
         if not hasattr(self, 'content'):
             self.content: str = content
@@ -133,19 +148,52 @@ class Cursor(Entity):
         self.get_shift_to_free_space = shift_to_free_space_getter
         self.on_select = on_select
         self.hidden: bool = True
+        self.__views: Dict[int, Tuple[Iterable[Entity], List[Iterable], Tuple[int, ...], List[Entity], Dict[int, int]]] = {} # id(scope) -> (scope, iterables in it, their versions, selectable entities, id(entity) -> position), only for versioned scopes
         super().__init__(content=CURSOR_UP, color=colors.WHITE, public=False)
 
     @property
     def selectable_scope(self) -> List[Entity]:
-        return [entity for entity in flatten_iterable(self.__scope) if entity.selectable]
+        return self.__get_view()[0]
     
     @property
     def index_in_scope(self) -> int | None:
-        return index_by_identity(iterable = self.selectable_scope, obj = self.selected)
+        return self.__get_view()[1].get(id(self.selected))
+
+    def __get_view(self) -> Tuple[List[Entity], Dict[int, int]]:
+        """
+        The selectable entities of the scope in order and their positions. The view is rebuilt only after the scope or
+        a CardList in it has changed, which is told by their version counters (see SceneLayer and CardList); the view of
+        a scope that contains an iterable without one, e.g. a plain SortedList, is not cached, but rebuilt every time.
+        """
+        scope = self.__scope
+        cached = self.__views.get(id(scope))
+        if cached is not None and cached[0] is scope and cached[2] == self.__get_versions(cached[1]):
+            return cached[3], cached[4]
+
+        entities = flatten_iterable(scope)
+        iterables: List[Iterable] = [scope] + [entity for entity in entities if isinstance(entity, Iterable)]
+        view: List[Entity] = [entity for entity in entities if entity.selectable]
+        positions: Dict[int, int] = {id(entity): i for i, entity in enumerate(view)}
+        versions = self.__get_versions(iterables)
+        if versions is not None:
+            self.__views[id(scope)] = (scope, iterables, versions, view, positions)
+        return view, positions
+
+    @staticmethod
+    def __get_versions(iterables: List[Iterable]) -> Tuple[int, ...] | None:
+        """None if any of the iterables can change without telling it"""
+        versions: List[int] = []
+        for iterable in iterables:
+            version = getattr(iterable, "version", None)
+            if version is None:
+                return None
+            versions.append(version)
+        return tuple(versions)
     
     def __set_scope(self, new_scope: SortedList[Entity]) -> None:
         self.hide()
         self.__scope = new_scope
+        self.__views = {key: cached for key, cached in self.__views.items() if cached[0] is new_scope or any(cached[0] is scope for scope in self.scope_stack)}
         self.show()
 
     def scope_backward(self) -> None:
@@ -189,14 +237,21 @@ class Cursor(Entity):
             self.on_select()
     
     def select_next(self) -> None:
-        if (self.index_in_scope != len(self.selectable_scope) - 1):
-            self.select(self.index_in_scope + 1)
+        index = self.index_in_scope
+        if index is None: # the selected entity has left the scope
+            self.select(0)
+        elif index != len(self.selectable_scope) - 1:
+            self.select(index + 1)
     
     def select_previous(self) -> None:
-        if (self.index_in_scope != 0):
-            self.select(self.index_in_scope - 1)
+        index = self.index_in_scope
+        if index is None:
+            self.select(0)
+        elif index != 0:
+            self.select(index - 1)
 
 class CardState():
+    __slots__ = ("level", "face_value", "specific_fields", "pos_in_level")
     # overloads are needed in order to leave the possibility to intialise without the pos_in_level, in that case it will be computed automatically
     @overload
     def __init__(self, card_type: Type, level: str, face_value: str, specific_fields: Dict[str, Any] | None = None) -> None: ...
@@ -209,7 +264,7 @@ class CardState():
         self.specific_fields = specific_fields # syntax: {'name': str, 'value': Any}
 
         if card_type is not None:
-            self.pos_in_level = next(i for i, state in enumerate(card_type.STATES) if state.face_value == self.face_value)
+            self.pos_in_level = card_type.POS_IN_LEVEL[self.face_value]
         elif pos_in_level is not None:
             self.pos_in_level = pos_in_level
         else:
@@ -221,9 +276,10 @@ class CardState():
         return self.level == other.level and self.pos_in_level == other.pos_in_level
 
     def __hash__(self) -> int:
-        return hash(self.level, self.pos_in_level)
+        return hash((self.level, self.pos_in_level))
 
 class Card(Entity):
+    __slots__ = ("state_index", "cardlist") # the state itself is shared through STATES, a card only stores where it is, so every subclass must declare empty __slots__ too
     STATES: List[CardState] = [] # MANDATORY OVERRIDE
     TYPE_NAME: str = "Cards"
     SUPPORTS_VALUE_UPGRADES: bool = True
@@ -233,6 +289,24 @@ class Card(Entity):
         cls.COUNT = len(cls.STATES)
         cls.LAST_STATE_INDEX = cls.COUNT - 1
 
+        # lookup tables, so that a state is found in O(1) instead of by searching STATES
+        cls.STATE_INDEX: Dict[CardState, int] = {state: i for i, state in enumerate(cls.STATES)}
+        cls.STATE_INDEX_BY_FACE_VALUE: Dict[Tuple[str, str], int] = {(state.level, state.face_value): i for i, state in enumerate(cls.STATES)}
+        cls.POS_IN_LEVEL: Dict[str, int] = {}
+        for state in cls.STATES:
+            cls.POS_IN_LEVEL.setdefault(state.face_value, state.pos_in_level)
+
+        # LEVEL_UPGRADES[i] is the index of the next state after STATES[i] with the same pos_in_level and a different level, None if there is none
+        cls.LEVEL_UPGRADES: List[int | None] = [None] * cls.COUNT
+        next_index_by_pos: Dict[int, int] = {}
+        for i in range(cls.LAST_STATE_INDEX, -1, -1):
+            state = cls.STATES[i]
+            next_index = next_index_by_pos.get(state.pos_in_level)
+            while next_index is not None and cls.STATES[next_index].level == state.level:
+                next_index = cls.LEVEL_UPGRADES[next_index]
+            cls.LEVEL_UPGRADES[i] = next_index
+            next_index_by_pos[state.pos_in_level] = i
+
     @overload
     def __init__(self, state_index: int, coords: Coordinates = None, selectable: bool = True, public: bool = False, help_string: str = "") -> None: ...
     @overload
@@ -251,68 +325,95 @@ class Card(Entity):
         
         if state is not None:
             try:
-                self.state_index = type(self).STATES.index(state)
-                self.state = state
-            except ValueError:
+                self.state_index = type(self).STATE_INDEX[state]
+            except KeyError:
                 raise ValueError(f"card_type {type(self)} does not have a state with pos_in_level = {state.pos_in_level} for {Entity(content=state.face_value, color=state.level)}")
         elif state_index is not None:
             self.state_index = state_index
-            self.state = type(self).STATES[self.state_index]
         else:
             raise ValueError("state or state_index must be provided")
         
         self.cardlist = None
 
-        super().__init__(
-            content = self.content, 
-            coords = coords,
-            color = self.color,
-            selectable = selectable,
-            public = public,
-            help_string = help_string
-        )
+        # the same as Entity.__init__, except for the content and the color, which come from the state
+        self.coords = Coordinates(coords[0], coords[1]) if coords else None
+        self.selectable = selectable
+        self.public = public
+        self.help_string = help_string
     
+    @property
+    def state(self) -> CardState:
+        return type(self).STATES[self.state_index]
+
     @property
     def color(self) -> str:
-        return self.state.level
+        return type(self).STATES[self.state_index].level
     
     @property
     def content(self) -> str:
-        return self.state.face_value
+        return type(self).STATES[self.state_index].face_value
 
     def __eq__(self, other: 'Card') -> bool:
         return type(self) == type(other) and self.state == other.state
 
     def __hash__(self) -> int:
         return hash((type(self), self.state_index))
-    
+
+    @classmethod
+    def from_state_index(cls, state_index: int, coords: Coordinates = None, selectable: bool = True, public: bool = False, help_string: str = "") -> 'Card':
+        """Creates a card of this type bypassing the constructors of subclasses, which may not accept a state index (e.g. BuildingCard)"""
+        card = cls.__new__(cls)
+        Card.__init__(card, state_index = state_index, coords = coords, selectable = selectable, public = public, help_string = help_string)
+        return card
+
+    def copy(self) -> 'Card':
+        """A card of the same type, state and flags, which is not a part of any CardList"""
+        card = type(self).__new__(type(self))
+        card.state_index = self.state_index
+        card.cardlist = None
+        card.coords = self.coords # Coordinates are immutable, so they can be shared
+        card.selectable = self.selectable
+        card.public = self.public
+        card.help_string = self.help_string
+        return card
+
     def upgrade_level(self, by: int = 1) -> None:
-        index_iterator = self.state_index
-
-        while index_iterator < type(self).LAST_STATE_INDEX and by > 0:
-            index_iterator += 1
-            new_state = type(self).STATES[index_iterator]
-            if new_state.level != self.state.level and new_state.pos_in_level == self.state.pos_in_level:
-                self.state_index = index_iterator
-                self.state = new_state
-                by -= 1
+        old_state_index = self.state_index
+        level_upgrades = type(self).LEVEL_UPGRADES
+
+        while by > 0:
+            next_index = level_upgrades[self.state_index]
+            if next_index is None:
+                break
+            self.state_index = next_index
+            by -= 1
         
-        if type(self).SUPPORTS_VALUE_UPGRADES and index_iterator == type(self).LAST_STATE_INDEX and by > 0:
-            self.state_index = index_iterator
-            self.state = type(self).STATES[index_iterator]
+        if by > 0 and type(self).SUPPORTS_VALUE_UPGRADES: # there is no higher level for this face value, so the card becomes the best one instead
+            self.state_index = type(self).LAST_STATE_INDEX
+
+        if self.state_index != old_state_index:
+            self.on_state_changed()
 
     def upgrade_value(self, by: int = 1) -> None:
+        old_state_index = self.state_index
         self.state_index = min(self.state_index + by, type(self).LAST_STATE_INDEX)
-        self.state = type(self).STATES[self.state_index]
+        if self.state_index != old_state_index:
+            self.on_state_changed()
+
+    def on_state_changed(self) -> None:
+        if self.cardlist is not None: # the content may have changed its width, so the cards after this one have to move
+            self.cardlist.on_card_changed(self)
 
 #TODO: #2
 
 class BandageCard(Card):
+    __slots__ = ()
     STATES: List[CardState] = [CardState(level = level, face_value = face_value, pos_in_level = BANDAGE_FACE_VALUES.index(face_value)) for level in MAIN_COLORS for face_value in BANDAGE_FACE_VALUES]
     TYPE_NAME: str = "Bandages"
     SUPPORTS_VALUE_UPGRADES = False
 
 class BuildingCard(Card):
+    __slots__ = ()
     STATES: List[CardState] = ([CardState(level = level, face_value = face_value, pos_in_level = BUILDING_FACE_VALUES.index(face_value)) for level in MAIN_COLORS for face_value in BUILDING_FACE_VALUES] + 
                                [CardState(level = level, face_value = face_value, pos_in_level = SUPER_BUILDING_FACE_VALUES.index(face_value)) for level in SUPER_COLORS for face_value in SUPER_BUILDING_FACE_VALUES])
     SUPPORTS_VALUE_UPGRADES = False
@@ -321,22 +422,25 @@ class BuildingCard(Card):
     def __init__(self, building_type: str, level: str = colors.GREEN, coords: Coordinates = None, public: bool = True, help_string: str = "") -> None:
         #TODO: fix docstring
         try:
-            state = next(state for state in type(self).STATES if state.level == level and state.face_value == building_type)
-        except StopIteration:
+            state_index = type(self).STATE_INDEX_BY_FACE_VALUE[(level, building_type)]
+        except KeyError:
             raise ValueError(f"{building_type} cannot be of level {level}")
         
-        super().__init__(state = state, coords = coords, public = public, help_string = help_string)
+        super().__init__(state_index = state_index, coords = coords, public = public, help_string = help_string)
 
 class WarriorCard(Card):
+    __slots__ = ()
     STATES: List[CardState] = [CardState(level = level, face_value = face_value, pos_in_level = WARRIOR_FACE_VALUES.index(face_value)) for level in MAIN_COLORS for face_value in WARRIOR_FACE_VALUES]
     TYPE_NAME: str = "Warriors"
 
 class GuardCard(WarriorCard):
+    __slots__ = ()
     TYPE_NAME: str = "Guards"
     def __init__(self, coords: Coordinates = None, state_index: int = 0, public: bool = True, help_string: str = "") -> None:
         super().__init__(state_index = state_index, coords = coords, public = public, help_string = help_string)
 
 class CardList(Entity):
+    __slots__ = ("card_type", "max_size", "empty_label", "version", "__cards", "__widths", "__offsets")
     def __init__(self, coords: Coordinates, card_type: Type[Card], cards: List[Card] | None = None, max_size: int = None, empty_label: bool = False, selectable: bool = True, public: bool = True, help_string: str = "") -> None:
         self.card_type: Type[Card] = card_type
         self.max_size = max_size
@@ -345,6 +449,10 @@ class CardList(Entity):
             raise OverflowError(f"{self} exceeds maximum size of {self.max_size}")
         else:
             self.__cards: List[Card] = cards if cards is not None else []
+        self.version: int = 0 # incremented whenever cards are added, removed or replaced
+        self.__widths: List[int] = [] # the display width of every card
+        self.__offsets: List[int] = [] # the x of every card relative to the first one, a prefix sum of the widths and the separating whitespaces
+        self.__update_offsets(begin = 0)
         super().__init__(content = self.content, coords = coords, color = colors.NONE, selectable = selectable, public = public, help_string = help_string)
     
     def __repr__(self) -> str:
@@ -365,10 +473,25 @@ class CardList(Entity):
         public_cards: List[Card] = [card for card in self.__cards if card.public]
         return CardList(coords = self.coords, card_type = self.card_type, cards = public_cards, empty_label = self.empty_label, selectable = self.selectable, public = True)
 
+    def copy(self) -> 'CardList':
+        """A list of copies of the cards, laid out the same way"""
+        card_list = CardList(coords = self.coords, card_type = self.card_type, max_size = self.max_size, empty_label = self.empty_label, selectable = self.selectable, public = self.public, help_string = self.help_string)
+        card_list.__cards = [card.copy() for card in self.__cards] # the copies keep the coordinates, so the layout is copied instead of being recomputed
+        for card in card_list.__cards:
+            card.cardlist = card_list
+        card_list.__widths = self.__widths.copy()
+        card_list.__offsets = self.__offsets.copy()
+        return card_list
+
     def remove(self, card: Card) -> None:
-        index = self.__cards.index(card)
+        index = index_by_identity(iterable = self.__cards, obj = card) # equal cards are not interchangeable, they are at different places
+        if index is None:
+            raise ValueError(f"{card} is not in {self}")
         card.cardlist = None
-        self.__cards.remove(card)
+        del self.__cards[index]
+        del self.__widths[index]
+        del self.__offsets[index]
+        self.version += 1
         self.update_card_coordinates(begin = index, end = len(self))
     
     def append(self, card: Card) -> None:
@@ -376,12 +499,36 @@ class CardList(Entity):
             raise OverflowError(f"{self} exceeds maximum size of {self.max_size}")
         else:
             self.__cards.append(card)
+            self.__widths.append(0)
+            self.__offsets.append(0)
             card.cardlist = self
+            self.version += 1
             self.update_card_coordinates(index = len(self.__cards) - 1)
     
     def __setitem__(self, index: int, card: Card) -> None:
-        card.coords = self.__cards[index].coords
+        self.__cards[index].cardlist = None
         self.__cards[index] = card
+        card.cardlist = self
+        self.version += 1
+        self.update_card_coordinates(begin = index, end = len(self))
+
+    def on_card_changed(self, card: Card) -> None:
+        index = index_by_identity(iterable = self.__cards, obj = card)
+        if index is not None:
+            self.update_card_coordinates(begin = index, end = len(self))
+
+    def __update_offsets(self, begin: int) -> None:
+        """Recomputes the widths from begin and the offsets that depend on them, in O(len(self) - begin)"""
+        offset = 0 if begin == 0 else self.__offsets[begin - 1] + self.__widths[begin - 1] + 1 # cards are separated by whitespaces
+        for i in range(begin, len(self.__cards)):
+            width = len(self.__cards[i].content)
+            if i < len(self.__widths):
+                self.__widths[i] = width
+                self.__offsets[i] = offset
+            else:
+                self.__widths.append(width)
+                self.__offsets.append(offset)
+            offset += width + 1
 
     @overload
     def update_card_coordinates(self, begin: int, end: int) -> None: ...
@@ -413,9 +560,10 @@ class CardList(Entity):
         """
         s = begin if begin is not None else index
         e = end if end is not None else (index + 1)
+        self.__update_offsets(begin = s)
+        start_x = self.coords.x + len(self.label_string)
         for i in range(s, e):
-            length_of_previous_cards = len(self.stringify_cards(0, i))
-            self.__cards[i].coords = Coordinates(self.coords.x + len(self.label_string) + length_of_previous_cards + i, self.coords.y) # i is added, because the cards are separated by whitespaces
+            self.__cards[i].coords = Coordinates(start_x + self.__offsets[i], self.coords.y)
 
     def set_coords(self, new_coords) -> None:
         if self.coords != new_coords:
@@ -439,27 +587,457 @@ class CardList(Entity):
             return False
         return any((c == card) for c in self.__cards)
 
-SOCKET_END_MSG: bytes = b"<END>"
-SOCKET_CONNECTION_ESTABLISHED: bytes = b"CONNECTION ESTABLISHED"
-SOCKET_LOBBY_FULL: bytes = b"LOBBY FULL"
-SOCKET_SHARED_ENTITIES_UPDATE: bytes = b"SHARED ENTITIES UPDATE"
-SOCKET_YOUR_TURN: bytes = b"YOUR TURN"
-SOCKET_TERMINATION_REQUEST = b"TERMINATE"
+class PackedCardList:
+    """
+    A list of cards of one type stored as an array of state indices, two bytes per card. It is meant for headless code
+    that holds a lot of cards, e.g. simulations, the cards are only created when they are read.
+    """
+    __slots__ = ("card_type", "state_indices")
+    def __init__(self, card_type: Type[Card], state_indices: Iterable[int] = ()) -> None:
+        self.card_type: Type[Card] = card_type
+        self.state_indices: array = array('H', state_indices)
+
+    @classmethod
+    def from_card_list(cls, card_list: CardList) -> 'PackedCardList':
+        return cls(card_list.card_type, (card.state_index for card in card_list))
+
+    def to_card_list(self, coords: Coordinates, **card_list_kwargs) -> CardList:
+        card_list = CardList(coords = coords, card_type = self.card_type, **card_list_kwargs)
+        for card in self:
+            card_list.append(card)
+        return card_list
+
+    def append(self, card: Card | int) -> None:
+        self.state_indices.append(card if isinstance(card, int) else card.state_index)
+
+    def extend(self, state_indices: Iterable[int]) -> None:
+        self.state_indices.extend(state_indices)
+
+    def remove(self, card: Card | int) -> None:
+        self.state_indices.remove(card if isinstance(card, int) else card.state_index)
+
+    def __getitem__(self, index: int) -> Card:
+        return self.card_type.from_state_index(self.state_indices[index], public = True)
+
+    def __len__(self) -> int:
+        return len(self.state_indices)
+
+    def __iter__(self):
+        return (self.card_type.from_state_index(state_index, public = True) for state_index in self.state_indices)
+
+    def __contains__(self, card: Card) -> bool:
+        return isinstance(card, self.card_type) and card.state_index in self.state_indices
+
+##### CARD DRAWING #####
+@overload
+def draw_a_card(card_type: type[Card], to_cardlist: CardList | PackedCardList, public: bool, cruelty: int = 10, rng: random.Random | None = None) -> None:
+    """
+    Draw a card of the given card class.
+
+    :param card_type: The Card class to instantiate. Must define a COUNT attribute representing the number of possible unique cards of this type.
+    :type card_type: type[Card]
+    
+    :param to_cardlist: The list where the drawn card will be appended.
+    :type to_cardlist: CardList | PackedCardList
+
+    :param public: Whether the drawn card should be marked as public.
+    :type public: bool
+
+    :param cruelty: The bigger the number - the rarer are the strong cards.
+    :type cruelty: int
+
+    :param rng: The random number generator to draw with, the module-level one if not given.
+    :type rng: random.Random | None
+    """
+
+
+@overload
+def draw_a_card(card_pool: List[Card], to_cardlist: CardList | PackedCardList, public: bool, cruelty: int = 10, rng: random.Random | None = None) -> None:
+    """
+    Draw a card from a provided list of cards.
+
+    :param card_pool: A list of Card objects to draw from.
+    :type card_pool: List[Card]
+
+    :param to_cardlist: The list where the drawn card will be appended.
+    :type to_cardlist: CardList | PackedCardList
+
+    :param public: Whether the drawn card should be marked as public.
+    :type public: bool
+
+    :param cruelty: The bigger the number - the rarer are the strong cards.
+    :type cruelty: int
+
+    :param rng: The random number generator to draw with, the module-level one if not given.
+    :type rng: random.Random | None
+    """
+
+def draw_a_card(source: type[Card] | List[Card], to_cardlist: CardList | PackedCardList, public: bool, cruelty: int = 10, rng: random.Random | None = None) -> None:
+    if isinstance(source, list):
+        drawn_card = source[get_sampler(len(source), cruelty).draw(rng)]
+    elif isinstance(to_cardlist, PackedCardList): # only the state index is stored, so no card has to be created
+        drawn_card = get_sampler(source.COUNT, cruelty).draw(rng)
+    else:
+        drawn_card = source.from_state_index(get_sampler(source.COUNT, cruelty).draw(rng), public = public)
+
+    to_cardlist.append(drawn_card)
+
+def draw_cards(source: type[Card] | List[Card], to_cardlist: CardList | PackedCardList, number: int, public: bool, cruelty: int = 10, rng: Any = None) -> None:
+    """
+    The same as calling draw_a_card number times, but the whole batch is drawn at once (see sampler.Sampler.draw_many).
+    Cards of a type drawn into a PackedCardList are never created, their state indices are stored directly.
+    """
+    if isinstance(source, list):
+        for index in get_sampler(len(source), cruelty).draw_many(number, rng):
+            to_cardlist.append(source[index])
+        return
+
+    state_indices = get_sampler(source.COUNT, cruelty).draw_many(number, rng)
+    if isinstance(to_cardlist, PackedCardList):
+        to_cardlist.extend(state_indices)
+    else:
+        for state_index in state_indices:
+            to_cardlist.append(source.from_state_index(state_index, public = public))
+#####
+
+SOCKET_FRAME_MAGIC: int = 0xFA # first byte of every frame, it can never start a legacy message, so it is also used to tell the two formats apart
+SOCKET_FRAME_HEADER: struct.Struct = struct.Struct("!BBI") # magic, message type, payload length
+SOCKET_MAX_PAYLOAD_SIZE: int = 16 * 1024 * 1024
+SOCKET_RECEIVE_BUFFER_SIZE: int = 64 * 1024
+SOCKET_STREAM_LIMIT: int = 256 * 1024 # the most an asyncio stream buffers while looking for the end of a legacy message
+
+# message types
+SOCKET_CONNECTION_ESTABLISHED: int = 1
+SOCKET_LOBBY_FULL: int = 2
+SOCKET_SHARED_ENTITIES_UPDATE: int = 3
+SOCKET_YOUR_TURN: int = 4
+SOCKET_TERMINATION_REQUEST: int = 5
+SOCKET_ENTITIES_ACK: int = 6 # the receiver of SOCKET_SHARED_ENTITIES_UPDATE confirms which version of the entities it holds
+SOCKET_HEARTBEAT: int = 7 # sent by either side when it has sent nothing else for HEARTBEAT_INTERVAL, the receiver ignores it
+SOCKET_SPECTATE: int = 8 # sent instead of SOCKET_CONNECTION_ESTABLISHED by a client that watches a match, see handshake.py
+SOCKET_COMPRESSED_FLAG: int = 0x80 # set in the message type of a frame whose payload is compressed, see compression.py
+
+SOCKET_MESSAGE_NAMES: Dict[int, str] = {
+    SOCKET_CONNECTION_ESTABLISHED: "CONNECTION ESTABLISHED",
+    SOCKET_LOBBY_FULL: "LOBBY FULL",
+    SOCKET_SHARED_ENTITIES_UPDATE: "SHARED ENTITIES UPDATE",
+    SOCKET_YOUR_TURN: "YOUR TURN",
+    SOCKET_TERMINATION_REQUEST: "TERMINATE",
+    SOCKET_ENTITIES_ACK: "ENTITIES ACK",
+    SOCKET_HEARTBEAT: "HEARTBEAT",
+    SOCKET_SPECTATE: "SPECTATE"
+}
+
+# a peer that has sent a heartbeat is known to send them, so if it stays silent for HEARTBEAT_TIMEOUT, it is considered dead;
+# peers that never send heartbeats (older clients) are only detected by TCP keepalive
+HEARTBEAT_INTERVAL: float = float(getenv('HEARTBEAT_INTERVAL') or 5) # 0 turns heartbeats off
+HEARTBEAT_TIMEOUT: float = float(getenv('HEARTBEAT_TIMEOUT') or 15)
+TCP_KEEPALIVE_IDLE: int = int(getenv('TCP_KEEPALIVE_IDLE') or 30) # seconds of silence before the OS starts probing the peer
+TCP_KEEPALIVE_INTERVAL: int = int(getenv('TCP_KEEPALIVE_INTERVAL') or 5)
+TCP_KEEPALIVE_PROBES: int = 3 # unanswered probes after which the OS closes the connection
+
+# a player whose connection is lost keeps its place in the session for RESUME_GRACE seconds, see handshake.py
+RESUME_GRACE: float = float(getenv('RESUME_GRACE') or 30) # 0 turns resuming off
+RESUME_RETRY_INTERVAL: float = 1.0 # seconds between the attempts of a client to connect again
+
+# the old "<END>"-terminated format, still accepted from clients that have not been updated yet
+LEGACY_SOCKET_END_MSG: bytes = b"<END>"
+LEGACY_SOCKET_MESSAGES: Dict[bytes, int] = {
+    b"CONNECTION ESTABLISHED": SOCKET_CONNECTION_ESTABLISHED,
+    b"LOBBY FULL": SOCKET_LOBBY_FULL,
+    b"SHARED ENTITIES UPDATE": SOCKET_SHARED_ENTITIES_UPDATE,
+    b"YOUR TURN": SOCKET_YOUR_TURN,
+    b"TERMINATE": SOCKET_TERMINATION_REQUEST
+}
+LEGACY_SOCKET_TOKENS: Dict[int, bytes] = {message_type: token for token, message_type in LEGACY_SOCKET_MESSAGES.items()}
 
 class TerminationRequest(Exception):
     pass
 
-def recvall(conn: socket.socket) -> bytes:
-    data: bytes = b''
-    while SOCKET_END_MSG not in data:
-        more: bytes = conn.recv(1)
-        if not more:
+def encode_frame(message_type: int, payload: bytes = b"") -> bytes:
+    if len(payload) > SOCKET_MAX_PAYLOAD_SIZE:
+        raise ValueError(f"payload of {len(payload)} bytes exceeds maximum size of {SOCKET_MAX_PAYLOAD_SIZE}")
+    return SOCKET_FRAME_HEADER.pack(SOCKET_FRAME_MAGIC, message_type, len(payload)) + payload
+
+def encode_legacy_message(message_type: int, payload: bytes = b"") -> bytes:
+    # in the legacy format the payload (e.g. the player number or the entities) is sent as a separate message right after the token
+    data: bytes = LEGACY_SOCKET_TOKENS[message_type] + LEGACY_SOCKET_END_MSG
+    if payload:
+        data += payload + LEGACY_SOCKET_END_MSG
+    return data
+
+def encode_message(message_type: int, payload: bytes, legacy: bool | None) -> bytes | None:
+    if legacy:
+        if message_type not in LEGACY_SOCKET_TOKENS: # a legacy peer would not understand it anyway
+            return None
+        return encode_legacy_message(message_type, payload)
+    return encode_frame(message_type, payload)
+
+def parse_frame_header(header: bytes | memoryview, offset: int = 0) -> Tuple[int, int]:
+    magic, message_type, length = SOCKET_FRAME_HEADER.unpack_from(header, offset)
+    if magic != SOCKET_FRAME_MAGIC:
+        raise ConnectionError(f"corrupted frame header (magic byte {magic:#x})")
+    if length > SOCKET_MAX_PAYLOAD_SIZE:
+        raise ConnectionError(f"frame of {length} bytes exceeds maximum size of {SOCKET_MAX_PAYLOAD_SIZE}")
+    return message_type, length
+
+def set_keepalive(sock: socket.socket) -> None:
+    """Makes the OS detect a dead peer after TCP_KEEPALIVE_IDLE + TCP_KEEPALIVE_PROBES * TCP_KEEPALIVE_INTERVAL seconds of silence"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    idle_option = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None)) # TCP_KEEPALIVE on macOS
+    for option, value in ((idle_option, TCP_KEEPALIVE_IDLE), (getattr(socket, "TCP_KEEPINTVL", None), TCP_KEEPALIVE_INTERVAL), (getattr(socket, "TCP_KEEPCNT", None), TCP_KEEPALIVE_PROBES)):
+        if option is not None: # otherwise the platform only supports the system-wide settings
+            sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+def needs_heartbeat(connection: 'Connection | StreamConnection', now: float) -> bool:
+    return HEARTBEAT_INTERVAL > 0 and now - connection.last_sent_at >= HEARTBEAT_INTERVAL
+
+def has_timed_out(connection: 'Connection | StreamConnection', now: float) -> bool:
+    return HEARTBEAT_INTERVAL > 0 and connection.peer_sends_heartbeats and now - connection.last_received_at > HEARTBEAT_TIMEOUT
+
+def decompress_message(compression: Any, message_type: int, payload: bytes) -> Tuple[int, bytes]:
+    if not message_type & SOCKET_COMPRESSED_FLAG:
+        return message_type, payload
+    if compression is None:
+        raise ConnectionError("compressed message on a connection without compression")
+    return compression.decompress(message_type, payload)
+
+class WirePayload:
+    """A received payload as it came over the wire, it is only decompressed once its plain bytes are needed: a relay that
+    forwards it to a peer with the same compression sends the received bytes as they are"""
+    __slots__ = ("wire", "compression", "__plain")
+
+    def __init__(self, wire: bytes, compression: Any = None) -> None:
+        self.wire = wire
+        self.compression = compression # None if the payload is not compressed
+        self.__plain: bytes | None = wire if compression is None else None
+
+    @property
+    def compressed(self) -> bool:
+        return self.compression is not None
+
+    @property
+    def plain(self) -> bytes:
+        """Raises ConnectionError if the payload can not be decompressed"""
+        if self.__plain is None:
+            _, self.__plain = self.compression.decompress(SOCKET_COMPRESSED_FLAG, self.wire)
+        return self.__plain
+
+def parse_legacy_token(token: bytes) -> int:
+    try:
+        return LEGACY_SOCKET_MESSAGES[token]
+    except KeyError:
+        raise ConnectionError(f"unknown legacy message {token[:32]!r}")
+
+class Connection:
+    """
+    A socket wrapper that sends and receives whole messages as (message type, payload) pairs.
+
+    Incoming bytes are read with `recv_into` into a buffer that is allocated once per connection
+    and only grows if a single message does not fit into it. The format of the peer (framed or legacy)
+    is detected from the first byte it sends, and all replies to it are sent in the same format.
+    """
+    def __init__(self, sock: socket.socket, buffer_size: int = SOCKET_RECEIVE_BUFFER_SIZE) -> None:
+        self.sock = sock
+        self.legacy: bool | None = None # None until the peer has sent something
+        self.compression: Any = None # a compression.PayloadCompression once the handshake has enabled it
+        self.last_message_size: int = 0 # the size of the last received message on the wire
+        self.last_sent_at: float = time.monotonic()
+        self.last_received_at: float = time.monotonic()
+        self.peer_sends_heartbeats: bool = False
+        self.__buffer: bytearray = bytearray(buffer_size)
+        self.__view: memoryview = memoryview(self.__buffer)
+        self.__start: int = 0 # the beginning of unparsed data in the buffer
+        self.__end: int = 0 # the end of received data in the buffer
+        self.__scanned: int = 0 # position up to which the legacy end marker has already been searched for
+
+    def __enter__(self) -> 'Connection':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def close(self) -> None:
+        self.__view.release()
+        self.sock.close()
+
+    def has_buffered_data(self) -> bool:
+        return self.__end > self.__start
+
+    def send_message(self, message_type: int, payload: bytes = b"") -> int:
+        """Returns the number of bytes sent"""
+        if self.compression is not None:
+            message_type, payload = self.compression.compress(message_type, payload)
+        data = encode_message(message_type, payload, self.legacy)
+        if data is None:
+            return 0
+        self.sock.sendall(data)
+        self.last_sent_at = time.monotonic()
+        return len(data)
+
+    def recv_message(self) -> Tuple[int, bytes]:
+        if self.legacy is None:
+            self.__fill(1)
+            self.legacy = self.__buffer[self.__start] != SOCKET_FRAME_MAGIC
+
+        message_type, payload = self.__recv_legacy_message() if self.legacy else self.__recv_frame()
+        self.last_received_at = time.monotonic()
+        if message_type == SOCKET_HEARTBEAT:
+            self.peer_sends_heartbeats = True
+        elif message_type == SOCKET_TERMINATION_REQUEST:
+            raise TerminationRequest
+        return message_type, payload
+
+    def __recv_frame(self) -> Tuple[int, bytes]:
+        header_size = SOCKET_FRAME_HEADER.size
+        self.__fill(header_size)
+        message_type, length = parse_frame_header(self.__view, self.__start)
+
+        self.__fill(header_size + length)
+        payload_start = self.__start + header_size
+        payload: bytes = self.__view[payload_start:payload_start + length].tobytes()
+        self.__consume(header_size + length)
+        self.last_message_size = header_size + length
+        return decompress_message(self.compression, message_type, payload)
+
+    def __recv_legacy_message(self) -> Tuple[int, bytes]:
+        message_type: int = parse_legacy_token(self.__recv_legacy_chunk())
+        payload: bytes = self.__recv_legacy_chunk() if message_type == SOCKET_SHARED_ENTITIES_UPDATE else b""
+        self.last_message_size = len(LEGACY_SOCKET_TOKENS[message_type]) + len(LEGACY_SOCKET_END_MSG) + (len(payload) + len(LEGACY_SOCKET_END_MSG) if payload else 0)
+        return message_type, payload
+
+    def __recv_legacy_chunk(self) -> bytes:
+        marker_length = len(LEGACY_SOCKET_END_MSG)
+        while True:
+            position = self.__buffer.find(LEGACY_SOCKET_END_MSG, max(self.__start, self.__scanned - marker_length + 1), self.__end)
+            if position != -1:
+                break
+            if self.__end - self.__start > SOCKET_MAX_PAYLOAD_SIZE:
+                raise ConnectionError(f"legacy message exceeds maximum size of {SOCKET_MAX_PAYLOAD_SIZE}")
+            self.__scanned = self.__end
+            self.__fill(self.__end - self.__start + 1)
+
+        chunk: bytes = self.__view[self.__start:position].tobytes()
+        self.__consume(position + marker_length - self.__start)
+        return chunk
+
+    def __consume(self, size: int) -> None:
+        self.__start += size
+        if self.__start == self.__end: # everything has been parsed, so the buffer can be reused from the beginning
+            self.__start = self.__end = 0
+        self.__scanned = self.__start
+
+    def __fill(self, size: int) -> None:
+        """Receives data until at least `size` unparsed bytes are in the buffer."""
+        while self.__end - self.__start < size:
+            if self.__start + size > len(self.__buffer):
+                self.__make_room(size)
+            received: int = self.sock.recv_into(self.__view[self.__end:])
+            if not received:
+                raise ConnectionError
+            self.__end += received
+
+    def __make_room(self, size: int) -> None:
+        unparsed: int = self.__end - self.__start
+        scanned: int = self.__scanned - self.__start
+        if size <= len(self.__buffer): # moving the unparsed data to the beginning is enough
+            self.__buffer[:unparsed] = self.__buffer[self.__start:self.__end]
+        else:
+            new_buffer = bytearray(max(size, 2 * len(self.__buffer)))
+            new_buffer[:unparsed] = self.__view[self.__start:self.__end]
+            self.__view.release()
+            self.__buffer = new_buffer
+            self.__view = memoryview(self.__buffer)
+        self.__start, self.__end, self.__scanned = 0, unparsed, scanned
+
+class StreamConnection:
+    """The asyncio counterpart of Connection, it reads from a StreamReader and writes to a StreamWriter"""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.legacy: bool | None = None # None until the peer has sent something
+        self.compression: Any = None # a compression.PayloadCompression once the handshake has enabled it
+        self.last_message_size: int = 0 # the size of the last received message on the wire
+        self.last_sent_at: float = time.monotonic()
+        self.last_received_at: float = time.monotonic()
+        self.peer_sends_heartbeats: bool = False
+
+    def write_message(self, message_type: int, payload: bytes | WirePayload = b"") -> int:
+        """Puts the message into the write buffer without waiting for it to be flushed, returns its size on the wire"""
+        if isinstance(payload, WirePayload):
+            if payload.compressed and self.compression is not None: # both sides use the same dictionary, see compression.py
+                message_type, payload = message_type | SOCKET_COMPRESSED_FLAG, payload.wire
+            else:
+                payload = payload.plain
+        if self.compression is not None and not message_type & SOCKET_COMPRESSED_FLAG:
+            message_type, payload = self.compression.compress(message_type, payload)
+        data = encode_message(message_type, payload, self.legacy)
+        if data is None:
+            return 0
+        self.writer.write(data)
+        self.last_sent_at = time.monotonic()
+        return len(data)
+
+    def write_frame(self, data: bytes) -> None:
+        """Puts an already encoded frame into the write buffer as it is, e.g. one that is shared by many connections"""
+        self.writer.write(data)
+        self.last_sent_at = time.monotonic()
+
+    async def send_message(self, message_type: int, payload: bytes | WirePayload = b"") -> int:
+        size = self.write_message(message_type, payload)
+        await self.writer.drain()
+        return size
+
+    async def recv_message(self) -> Tuple[int, bytes]:
+        message_type, payload = await self.recv_wire_message()
+        return message_type, payload.plain
+
+    async def recv_wire_message(self) -> Tuple[int, WirePayload]:
+        """Like recv_message(), but the payload is not decompressed until its plain bytes are asked for"""
+        try:
+            prefix: bytes = b""
+            if self.legacy is None:
+                prefix = await self.reader.readexactly(1)
+                self.legacy = prefix[0] != SOCKET_FRAME_MAGIC
+            message_type, payload = await (self.__recv_legacy_message(prefix) if self.legacy else self.__recv_frame(prefix))
+        except asyncio.IncompleteReadError:
             raise ConnectionError
-        data += more
-    stripped_data = data[:-5]
-    if stripped_data == SOCKET_TERMINATION_REQUEST:
-        raise TerminationRequest
-    return stripped_data
-
-def sendall_with_end(s: socket.socket, message: bytes) -> None:
-    s.sendall(message + SOCKET_END_MSG)
\ No newline at end of file
+        except asyncio.LimitOverrunError:
+            raise ConnectionError("legacy message exceeds the stream limit")
+        self.last_received_at = time.monotonic()
+        if message_type == SOCKET_HEARTBEAT:
+            self.peer_sends_heartbeats = True
+        elif message_type == SOCKET_TERMINATION_REQUEST:
+            raise TerminationRequest
+        return message_type, payload
+
+    async def __recv_frame(self, prefix: bytes) -> Tuple[int, WirePayload]:
+        header: bytes = prefix + await self.reader.readexactly(SOCKET_FRAME_HEADER.size - len(prefix))
+        message_type, length = parse_frame_header(header)
+        payload: bytes = await self.reader.readexactly(length) if length else b""
+        self.last_message_size = SOCKET_FRAME_HEADER.size + length
+        if not message_type & SOCKET_COMPRESSED_FLAG:
+            return message_type, WirePayload(payload)
+        if self.compression is None:
+            raise ConnectionError("compressed message on a connection without compression")
+        return message_type & ~SOCKET_COMPRESSED_FLAG, WirePayload(payload, self.compression)
+
+    async def __recv_legacy_message(self, prefix: bytes) -> Tuple[int, WirePayload]:
+        message_type: int = parse_legacy_token(prefix + await self.__recv_legacy_chunk())
+        payload: bytes = await self.__recv_legacy_chunk() if message_type == SOCKET_SHARED_ENTITIES_UPDATE else b""
+        self.last_message_size = len(LEGACY_SOCKET_TOKENS[message_type]) + len(LEGACY_SOCKET_END_MSG) + (len(payload) + len(LEGACY_SOCKET_END_MSG) if payload else 0)
+        return message_type, WirePayload(payload)
+
+    async def __recv_legacy_chunk(self) -> bytes:
+        chunk: bytes = await self.reader.readuntil(LEGACY_SOCKET_END_MSG)
+        return chunk[:-len(LEGACY_SOCKET_END_MSG)]
+
+    async def close(self) -> None:
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
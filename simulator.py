@@ -0,0 +1,224 @@
+"""
+A headless Monte Carlo simulation of the card economy, for tuning cruelty and the upgrade rules with numbers instead of by feel.
+
+A sequence is one player's hand over a number of turns. Every turn the player either applies a bandage from the hand or draws
+a warrior or a bandage with draw_a_card. A face value bandage calls upgrade_value() on a random warrior, a level bandage calls
+upgrade_level() on a random warrior or, with building_share, on one of the two starting buildings, and a combined bandage does
+both. The hands are kept in PackedCardLists, the upgrades go through the real Card methods.
+
+Sequences are split into chunks that are simulated by a multiprocessing pool and summed up. Every sequence draws from its own
+stream (sampler.make_rng(seed, sequence number)), so the results of a seed do not depend on the number of processes:
+
+    python simulator.py --sequences 1000000 --turns 50 --cruelty 5 10 15
+"""
+
+from shared_definitions import *
+from sampler import make_rng
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+SimulationConfig = namedtuple("SimulationConfig", ["turns", "cruelty", "upgrade_rate", "warrior_share", "building_share"])
+# upgrade_rate: the chance of applying a bandage in a turn when there is one, warrior_share: the chance that a draw is a warrior
+# rather than a bandage, building_share: the chance that a level upgrade goes to a building rather than a warrior
+
+COLOR_NAMES: Dict[str, str] = {colors.GREEN: "green", colors.BLUE: "blue", colors.YELLOW: "yellow", colors.RED: "red", colors.RAINBOW: "rainbow"}
+MAX_LEVEL: str = MAIN_COLORS[-1]
+
+class SimulationResult:
+    """Totals of a number of sequences, the results of chunks are merged into one"""
+    def __init__(self, turns: int) -> None:
+        self.sequences: int = 0
+        self.warriors_drawn: int = 0
+        self.bandages_drawn: int = 0
+        self.upgrades: int = 0
+        self.wasted_bandages: int = 0 # bandages that did not change anything, e.g. a value upgrade of the best warrior
+        self.warrior_states: List[int] = [0] * WarriorCard.COUNT # warriors in the hands at the end, by state index
+        self.building_states: List[int] = [0] * BuildingCard.COUNT
+        # histograms of the turn at which something first happened in a sequence, index 0 counts the sequences where it never did
+        self.max_level_turns: List[int] = [0] * (turns + 1) # a warrior of the highest main level
+        self.max_state_turns: List[int] = [0] * (turns + 1) # the best warrior
+        self.super_building_turns: List[int] = [0] * (turns + 1) # a building of a super level
+
+    def merge(self, other: 'SimulationResult') -> None:
+        for name, value in vars(other).items():
+            if isinstance(value, list):
+                own = getattr(self, name)
+                for i, count in enumerate(value):
+                    own[i] += count
+            else:
+                setattr(self, name, getattr(self, name) + value)
+
+def simulate_sequence(config: SimulationConfig, rng: random.Random, result: SimulationResult) -> None:
+    warriors = PackedCardList(WarriorCard)
+    bandages = PackedCardList(BandageCard)
+    buildings = PackedCardList(BuildingCard, [BuildingCard(face_values.HOSPITAL).state_index, BuildingCard(face_values.BARRACKS).state_index])
+    warrior_indices, bandage_indices, building_indices = warriors.state_indices, bandages.state_indices, buildings.state_indices # the hot loop uses the arrays directly
+    warrior = WarriorCard.from_state_index(0, public = True) # reused for every upgrade, it is not a part of a CardList, so it does no layout
+    building = BuildingCard.from_state_index(0, public = True)
+    max_level_turn = max_state_turn = super_building_turn = 0
+
+    for turn in range(1, config.turns + 1):
+        warrior_changed = False # whether `warrior` holds a warrior that was drawn or upgraded in this turn
+        if bandage_indices and rng.random() < config.upgrade_rate:
+            bandage = BandageCard.STATES[bandage_indices.pop(rng.randrange(len(bandage_indices)))].face_value
+            if bandage != face_values.FACE_VALUE_BANDAGE and rng.random() < config.building_share:
+                position = rng.randrange(len(building_indices))
+                building.state_index = building_indices[position]
+                building.upgrade_level()
+                changed = building.state_index != building_indices[position]
+                building_indices[position] = building.state_index
+                if not super_building_turn and building.color in SUPER_COLORS:
+                    super_building_turn = turn
+            elif warrior_indices:
+                position = rng.randrange(len(warrior_indices))
+                warrior.state_index = warrior_indices[position]
+                if bandage != face_values.LEVEL_BANDAGE:
+                    warrior.upgrade_value()
+                if bandage != face_values.FACE_VALUE_BANDAGE:
+                    warrior.upgrade_level()
+                changed = warrior_changed = warrior.state_index != warrior_indices[position]
+                warrior_indices[position] = warrior.state_index
+            else:
+                changed = False
+            if changed:
+                result.upgrades += 1
+            else:
+                result.wasted_bandages += 1
+        elif rng.random() < config.warrior_share:
+            draw_a_card(WarriorCard, warriors, public = True, cruelty = config.cruelty, rng = rng)
+            result.warriors_drawn += 1
+            warrior.state_index = warrior_indices[-1]
+            warrior_changed = True
+        else:
+            draw_a_card(BandageCard, bandages, public = True, cruelty = config.cruelty, rng = rng)
+            result.bandages_drawn += 1
+
+        if warrior_changed:
+            if not max_level_turn and warrior.color == MAX_LEVEL:
+                max_level_turn = turn
+            if not max_state_turn and warrior.state_index == WarriorCard.LAST_STATE_INDEX:
+                max_state_turn = turn
+
+    result.sequences += 1
+    for state_index in warrior_indices:
+        result.warrior_states[state_index] += 1
+    for state_index in building_indices:
+        result.building_states[state_index] += 1
+    result.max_level_turns[max_level_turn] += 1
+    result.max_state_turns[max_state_turn] += 1
+    result.super_building_turns[super_building_turn] += 1
+
+def simulate_chunk(chunk: Tuple[SimulationConfig, int, int, int]) -> SimulationResult:
+    """Simulates the sequences first, ..., first + count - 1 of a seed, this runs in the pool's processes"""
+    config, seed, first, count = chunk
+    result = SimulationResult(config.turns)
+    for sequence in range(first, first + count):
+        simulate_sequence(config, make_rng(seed, stream = sequence), result)
+    return result
+
+def run_simulation(config: SimulationConfig, sequences: int, seed: int, processes: int = 1, chunk_size: int = 2000) -> SimulationResult:
+    chunks = [(config, seed, first, min(chunk_size, sequences - first)) for first in range(0, sequences, chunk_size)]
+    result = SimulationResult(config.turns)
+    if processes <= 1:
+        for chunk in chunks:
+            result.merge(simulate_chunk(chunk))
+        return result
+    with multiprocessing.Pool(processes) as pool:
+        for chunk_result in pool.imap_unordered(simulate_chunk, chunks):
+            result.merge(chunk_result)
+    return result
+
+##### REPORT #####
+
+def get_turn_stats(histogram: List[int]) -> Dict[str, Any]:
+    """Statistics of the sequences in which it happened at all, see the histograms of SimulationResult"""
+    reached = sum(histogram) - histogram[0]
+    stats: Dict[str, Any] = {"reached": round(reached / sum(histogram), 4) if sum(histogram) else 0.0}
+    if reached == 0:
+        return stats | {"mean": None, "p50": None, "p90": None}
+    def percentile(fraction: float) -> int:
+        seen = 0
+        for turn in range(1, len(histogram)):
+            seen += histogram[turn]
+            if seen >= fraction * reached:
+                return turn
+        return len(histogram) - 1
+    mean = sum(turn * count for turn, count in enumerate(histogram)) / reached
+    return stats | {"mean": round(mean, 2), "p50": percentile(0.5), "p90": percentile(0.9)}
+
+def get_state_shares(card_type: Type[Card], counts: List[int]) -> Dict[str, float]:
+    total = sum(counts)
+    return {f"{COLOR_NAMES[state.level]} {state.face_value}": round(count / total, 5) for state, count in zip(card_type.STATES, counts) if count} if total else {}
+
+def get_level_shares(card_type: Type[Card], counts: List[int]) -> Dict[str, float]:
+    total = sum(counts)
+    shares: Dict[str, float] = {}
+    for state, count in zip(card_type.STATES, counts):
+        name = COLOR_NAMES[state.level]
+        shares[name] = shares.get(name, 0.0) + (count / total if total else 0.0)
+    return {name: round(share, 5) for name, share in shares.items()}
+
+def get_report(config: SimulationConfig, result: SimulationResult, elapsed: float) -> Dict[str, Any]:
+    return {
+        "config": config._asdict(),
+        "sequences": result.sequences,
+        "elapsed_s": round(elapsed, 3),
+        "sequences_per_s": round(result.sequences / elapsed, 1) if elapsed else 0.0,
+        "warriors_drawn": result.warriors_drawn,
+        "bandages_drawn": result.bandages_drawn,
+        "upgrades": result.upgrades,
+        "wasted_bandages": result.wasted_bandages,
+        "warriors_per_hand": round(sum(result.warrior_states) / result.sequences, 3) if result.sequences else 0.0,
+        "warrior_levels": get_level_shares(WarriorCard, result.warrior_states),
+        "warrior_states": get_state_shares(WarriorCard, result.warrior_states),
+        "building_states": get_state_shares(BuildingCard, result.building_states),
+        "turns_to_max_level": get_turn_stats(result.max_level_turns),
+        "turns_to_max_state": get_turn_stats(result.max_state_turns),
+        "turns_to_super_building": get_turn_stats(result.super_building_turns)
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    config = report["config"]
+    print(f"cruelty {config['cruelty']}: {report['sequences']} sequences of {config['turns']} turns in {report['elapsed_s']} s ({report['sequences_per_s']} sequences/s)")
+    print(f"  drawn: {report['warriors_drawn']} warriors, {report['bandages_drawn']} bandages; {report['upgrades']} upgrades, {report['wasted_bandages']} wasted bandages")
+    print(f"  warriors per hand at the end: {report['warriors_per_hand']}, by level: " + ", ".join(f"{name} {share:.2%}" for name, share in report["warrior_levels"].items()))
+    for name in ("turns_to_max_level", "turns_to_max_state", "turns_to_super_building"):
+        stats = report[name]
+        print(f"  {name.replace('_', ' ')}: reached in {stats['reached']:.2%} of the sequences" + (f", mean {stats['mean']}, p50 {stats['p50']}, p90 {stats['p90']}" if stats["mean"] is not None else ""))
+#####
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Simulates many draw/upgrade sequences in parallel and reports the resulting card economy.")
+    parser.add_argument("--sequences", type = int, default = 100000)
+    parser.add_argument("--turns", type = int, default = 50, help = "turns of every sequence")
+    parser.add_argument("--cruelty", type = float, nargs = "+", default = [10], help = "one simulation is run for every value")
+    parser.add_argument("--upgrade-rate", type = float, default = 0.3, help = "the chance of applying a bandage in a turn when there is one")
+    parser.add_argument("--warrior-share", type = float, default = 0.7, help = "the chance that a draw is a warrior rather than a bandage")
+    parser.add_argument("--building-share", type = float, default = 0.2, help = "the chance that a level upgrade goes to a building rather than a warrior")
+    parser.add_argument("--processes", type = int, default = os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type = int, default = 2000, help = "sequences per task of the pool")
+    parser.add_argument("--seed", type = int, default = None, help = "random by default, it is printed so that a run can be repeated")
+    parser.add_argument("--json", action = "store_true", help = "print the reports as JSON")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.getrandbits(32)
+    reports: List[Dict[str, Any]] = []
+    for cruelty in args.cruelty:
+        config = SimulationConfig(turns = args.turns, cruelty = cruelty, upgrade_rate = args.upgrade_rate, warrior_share = args.warrior_share, building_share = args.building_share)
+        started_at = time.perf_counter()
+        result = run_simulation(config, args.sequences, seed, processes = args.processes, chunk_size = args.chunk_size)
+        report = get_report(config, result, time.perf_counter() - started_at)
+        reports.append(report)
+        if not args.json:
+            print_report(report)
+
+    if args.json:
+        print(json.dumps({"seed": seed, "processes": args.processes, "reports": reports}, indent = 2, ensure_ascii = False))
+    else:
+        print(f"seed: {seed}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Watches a live match on the server (see the spectators in handshake.py) and draws the field with the client's own renderer:
+
+    python spectate.py
+    python spectate.py --session 7 --player 2
+    python spectate.py --quiet
+
+Without --session the busiest match of the server is shown. loadgen.py uses SpectatorClient to put many spectators on a match.
+"""
+
+from shared_definitions import *
+from entity_sync import EntitySyncReceiver
+from handshake import get_spectate_request, parse_spectate_reply, parse_spectator_payload, get_compression
+import argparse
+import sys
+import time
+
+class SpectatorStats:
+    """Counters shared by all spectators of a load generator run"""
+    def __init__(self) -> None:
+        self.updates: int = 0
+        self.missed_updates: int = 0 # deltas that arrived after the spectator had been skipped, until its keyframes came
+        self.bytes_received: int = 0
+        self.errors: Dict[str, int] = {}
+
+    def add_error(self, error: str) -> None:
+        self.errors[error] = self.errors.get(error, 0) + 1
+
+class SpectatorClient:
+    def __init__(self, host: str = HOST, port: int = PORT, session_id: int = 0, stats: SpectatorStats | None = None,
+                 on_change: Callable[['SpectatorClient', int, List[Entity], List[Entity]], None] | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.session_id = session_id # 0 until the server has told which session is watched
+        self.stats = stats or SpectatorStats()
+        self.on_change = on_change # called with the player whose entities were removed and added, and with 0 when the turn changes
+        self.connection: StreamConnection = None
+        self.current_player_num: int = 1
+        self.receivers: Dict[int, EntitySyncReceiver] = {1: EntitySyncReceiver(), 2: EntitySyncReceiver()}
+
+    async def connect(self) -> bool:
+        """Returns False if the match has too many spectators, TerminationRequest is raised if there is no such match"""
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit = SOCKET_STREAM_LIMIT)
+        self.connection = StreamConnection(reader, writer)
+        await self.connection.send_message(SOCKET_SPECTATE, get_spectate_request(self.session_id))
+        message_type, payload = await asyncio.wait_for(self.connection.recv_message(), HEARTBEAT_TIMEOUT)
+        if message_type == SOCKET_LOBBY_FULL:
+            return False
+        self.session_id, accepted, self.current_player_num = parse_spectate_reply(payload)
+        self.connection.compression = get_compression(accepted)
+        return True
+
+    async def send_heartbeats(self) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL / 2)
+            if needs_heartbeat(self.connection, time.monotonic()):
+                self.connection.write_message(SOCKET_HEARTBEAT)
+
+    def on_message(self, message_type: int, payload: bytes) -> None:
+        if message_type == SOCKET_SHARED_ENTITIES_UPDATE:
+            player_num, update = parse_spectator_payload(payload)
+            changes = self.receivers[player_num].apply_update(update)
+            self.stats.updates += 1
+            if changes is None: # the server skipped this spectator for a while and sends keyframes next
+                self.stats.missed_updates += 1
+            elif self.on_change is not None:
+                self.on_change(self, player_num, *changes)
+        elif message_type == SOCKET_YOUR_TURN:
+            self.current_player_num = parse_spectator_payload(payload)[0]
+            if self.on_change is not None:
+                self.on_change(self, 0, [], [])
+
+    async def watch(self) -> None:
+        """Follows the match until it is over"""
+        heartbeat_task = asyncio.create_task(self.send_heartbeats()) if HEARTBEAT_INTERVAL > 0 else None
+        try:
+            while True:
+                message_type, payload = await self.connection.recv_message()
+                self.stats.bytes_received += self.connection.last_message_size
+                self.on_message(message_type, payload)
+        except TerminationRequest: # the match is over
+            pass
+        finally:
+            if heartbeat_task is not None:
+                heartbeat_task.cancel()
+            await self.connection.close()
+
+async def run_spectator(spectator: SpectatorClient) -> None:
+    """Watches a match with `spectator` and records the reason if it fails"""
+    try:
+        if not await spectator.connect():
+            spectator.stats.add_error("too many spectators")
+            return
+        await spectator.watch()
+    except TerminationRequest:
+        spectator.stats.add_error("no match to spectate")
+    except asyncio.TimeoutError:
+        spectator.stats.add_error("timeout")
+    except (ConnectionError, OSError):
+        spectator.stats.add_error("connection lost")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Watches a live match.")
+    parser.add_argument("--host", default = "127.0.0.1" if HOST == "0.0.0.0" else HOST)
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--session", type = int, default = 0, help = "the session to watch, the busiest one by default")
+    parser.add_argument("--player", type = int, choices = (1, 2), default = 1, help = "whose side of the field is at the bottom")
+    parser.add_argument("--quiet", action = "store_true", help = "only print how many updates arrived once the match is over")
+    args = parser.parse_args()
+
+    on_change = None
+    if not args.quiet:
+        from game import GameController, move_to_opponent_side, clear_screen # the terminal client is only needed to draw the field
+        GameController.player_num = args.player
+        GameController.player_color = PLAYER_COLORS[args.player]
+        GameController.add_player_side_borders()
+        clear_screen()
+
+        def on_change(spectator: SpectatorClient, player_num: int, removed: List[Entity], added: List[Entity]) -> None:
+            for entity in removed:
+                GameController.received_entities.remove(entity)
+            for entity in added:
+                if player_num != args.player:
+                    move_to_opponent_side(entity)
+                GameController.received_entities.add(entity)
+            whose_turn = "your" if spectator.current_player_num == args.player else "the opponent's"
+            GameController.set_footer(Entity(f"Session {spectator.session_id}: it's {whose_turn} turn", colors.NONE, coords = GameController.get_footer_start_coordinates()))
+            GameController.refresh_screen()
+
+    spectator = SpectatorClient(args.host, args.port, args.session, on_change = on_change)
+    asyncio.run(run_spectator(spectator))
+    if spectator.stats.errors:
+        sys.exit(f"Unable to watch: {', '.join(spectator.stats.errors)}")
+    print(f"The match of session {spectator.session_id} is over, {spectator.stats.updates} updates received")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Keyboard input of the game. The terminal stays in raw mode for the whole session and keys are decoded from buffered
+non-blocking reads, so that the keyboard can be waited for together with the server socket (see KeyReader.selectable).
+"""
+
+from os import name as _os_name
+from collections import deque
+from typing import Deque, List
+import os
+import sys
+
+if _os_name == "nt":
+    import msvcrt
+else:
+    import codecs
+    import select
+    import termios
+    import tty
+
+class escape_sequences:
+    if _os_name == "nt":
+        ESCAPE = "\xe0"
+        ARROW_UP = "\xe0H"
+        ARROW_DOWN = "\xe0P"
+        ARROW_LEFT = "\xe0K"
+        ARROW_RIGHT = "\xe0M"
+        CTRL_C = "\x03"
+    else:
+        ESCAPE = "\x1b"
+        ARROW_UP = "\x1b[A"
+        ARROW_DOWN = "\x1b[B"
+        ARROW_LEFT = "\x1b[D"
+        ARROW_RIGHT = "\x1b[C"
+        CTRL_C = "\x03"
+
+KEY_POLL_INTERVAL: float = 0.02 # how often the Windows console is polled for keys, it cannot be waited for with select
+ESCAPE_SEQUENCE_TIMEOUT: float = 0.05 # how long the rest of an escape sequence is waited for before the escape key is taken as pressed on its own
+
+class KeyReader:
+    def __init__(self) -> None:
+        self.__keys: Deque[str] = deque()
+        self.__pending: str = "" # the start of an escape sequence whose rest has not been read yet
+        self.__old_settings: List | None = None
+        if _os_name != "nt":
+            self.__decoder = codecs.getincrementaldecoder("utf-8")(errors = "replace")
+
+    @property
+    def selectable(self) -> bool:
+        """Whether the reader can be registered with select/selectors, otherwise read_keys() has to be polled"""
+        return _os_name != "nt"
+
+    def fileno(self) -> int:
+        return sys.stdin.fileno()
+
+    def __enter__(self) -> 'KeyReader':
+        if _os_name != "nt" and sys.stdin.isatty():
+            fd = self.fileno()
+            self.__old_settings = termios.tcgetattr(fd)
+            tty.setraw(fd)
+            mode = termios.tcgetattr(fd)
+            mode[1] |= termios.OPOST # keep translating "\n" into "\r\n" on output
+            termios.tcsetattr(fd, termios.TCSADRAIN, mode)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.__old_settings is not None:
+            termios.tcsetattr(self.fileno(), termios.TCSADRAIN, self.__old_settings)
+            self.__old_settings = None
+
+    def read_keys(self) -> List[str]:
+        """Returns all keys that were pressed since the last call without blocking"""
+        self.__read(block = False)
+        keys = list(self.__keys)
+        self.__keys.clear()
+        return keys
+
+    def get_key(self) -> str:
+        """Blocks until a key is pressed"""
+        while not self.__keys:
+            self.__read(block = True)
+        return self.__keys.popleft()
+
+    def __read(self, block: bool) -> None:
+        if _os_name == "nt":
+            if block: # msvcrt.getch() blocks until a key is pressed
+                self.__keys.append(self.__read_console_key())
+            while msvcrt.kbhit():
+                self.__keys.append(self.__read_console_key())
+            return
+
+        fd = self.fileno()
+        timeout: float | None = None if block else 0
+        while select.select([fd], [], [], timeout)[0]:
+            data = os.read(fd, 1024)
+            if not data:
+                raise EOFError("the keyboard input was closed")
+            self.__pending += self.__decoder.decode(data)
+            self.__split_keys()
+            timeout = ESCAPE_SEQUENCE_TIMEOUT if self.__pending else 0
+        if self.__pending: # nothing followed the escape key in time
+            self.__keys.append(self.__pending)
+            self.__pending = ""
+
+    def __read_console_key(self) -> str:
+        key = msvcrt.getch().decode("latin-1")
+        if key in ("\x00", escape_sequences.ESCAPE): # function and arrow keys are sent as two characters
+            key = escape_sequences.ESCAPE + msvcrt.getch().decode("latin-1")
+        return key
+
+    def __split_keys(self) -> None:
+        data = self.__pending
+        i = 0
+        while i < len(data):
+            if data[i] != escape_sequences.ESCAPE:
+                self.__keys.append(data[i])
+                i += 1
+                continue
+            end = self.__find_escape_sequence_end(data, i)
+            if end is None: # the sequence is incomplete, the rest is probably still on its way
+                break
+            key = data[i:end]
+            if key.startswith("\x1bO"): # arrows in the application cursor mode of some terminals
+                key = "\x1b[" + key[2:]
+            self.__keys.append(key)
+            i = end
+        self.__pending = data[i:]
+
+    @staticmethod
+    def __find_escape_sequence_end(data: str, start: int) -> int | None:
+        if start + 1 >= len(data):
+            return None
+        if data[start + 1] == "O":
+            return start + 3 if start + 2 < len(data) else None
+        if data[start + 1] != "[":
+            return start + 2 # alt + key
+        for i in range(start + 2, len(data)):
+            if "\x40" <= data[i] <= "\x7e": # the final byte of a control sequence
+                return i + 1
+        return None
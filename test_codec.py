@@ -0,0 +1,117 @@
+"""
+Encodes and decodes entities with the binary codec and feeds it malformed input:
+
+    python -m unittest test_codec
+"""
+
+from shared_definitions import *
+from codec import CodecError, CODEC_VERSION, CARD_TYPES, KIND_CARD, KIND_CARD_LIST, FLAG_HAS_COORDS, encode_entity, decode_entity, encode_entities, decode_entities, write_varint
+import unittest
+
+def get_fields(entity: Entity) -> Tuple:
+    """What the codec must preserve, the cards of a card list included"""
+    fields = (type(entity), entity.content, entity.coords, entity.selectable, entity.public)
+    if isinstance(entity, CardList):
+        return fields + (entity.card_type, entity.max_size, entity.empty_label, [get_fields(card) for card in entity])
+    if isinstance(entity, Card):
+        return fields + (entity.state_index,)
+    return fields + (entity.color,)
+
+class CodecTest(unittest.TestCase):
+    def make_card_list(self, card_type: Type[Card], state_indices: List[int], **kwargs: Any) -> CardList:
+        card_list = CardList(Coordinates(2, 5), card_type, **kwargs)
+        for i, state_index in enumerate(state_indices):
+            card_list.append(card_type.from_state_index(state_index, public = i % 2 == 0, selectable = i % 3 != 0))
+        return card_list
+
+    def assert_round_trip(self, entity: Entity) -> Entity:
+        data = encode_entity(entity)
+        decoded = decode_entity(data)
+        self.assertEqual(get_fields(decoded), get_fields(entity))
+        self.assertEqual(encode_entity(decoded), data)
+        return decoded
+
+    def test_entity_round_trip(self) -> None:
+        for color in (colors.NONE, colors.GRAY, colors.RAINBOW, colors.RED, "\033[35m"): # the last one is not in the color table
+            self.assert_round_trip(Entity("Pharaoh ☩", color = color, coords = Coordinates(3, 200), selectable = True, public = True))
+        self.assert_round_trip(Entity("", coords = None))
+        self.assert_round_trip(Entity("x" * 300, coords = Coordinates(0, 0), public = True))
+
+    def test_card_round_trip(self) -> None:
+        for card_type in CARD_TYPES:
+            for state_index in {0, card_type.COUNT // 2, card_type.LAST_STATE_INDEX}:
+                self.assert_round_trip(card_type.from_state_index(state_index, coords = Coordinates(7, 1), public = True))
+                self.assert_round_trip(card_type.from_state_index(state_index, selectable = False))
+
+    def test_card_list_round_trip(self) -> None:
+        card_lists = [
+            self.make_card_list(WarriorCard, [0, 13, WarriorCard.LAST_STATE_INDEX, 5]),
+            self.make_card_list(WarriorCard, [3], max_size = 1, empty_label = True, selectable = False),
+            self.make_card_list(BuildingCard, list(range(BuildingCard.COUNT)), max_size = 20),
+            self.make_card_list(BandageCard, [])
+        ]
+        for card_list in card_lists:
+            decoded = self.assert_round_trip(card_list)
+            # the coordinates of the cards are not sent, the decoded list lays them out again
+            self.assertEqual([card.coords for card in decoded], [card.coords for card in card_list])
+
+    def test_entities_round_trip(self) -> None:
+        entities = [Entity("Label", coords = Coordinates(1, 1)), WarriorCard(state_index = 2, coords = Coordinates(1, 2)), self.make_card_list(GuardCard, [0, 1])]
+        self.assertEqual([get_fields(entity) for entity in decode_entities(encode_entities(entities))], [get_fields(entity) for entity in entities])
+
+    def test_truncated_input(self) -> None:
+        data = encode_entity(self.make_card_list(WarriorCard, [0, 13, 5], max_size = 4))
+        for length in range(len(data)):
+            with self.assertRaises(CodecError):
+                decode_entity(data[:length])
+        with self.assertRaises(CodecError):
+            decode_entity(data + b"\x00")
+
+    def test_bad_varints(self) -> None:
+        with self.assertRaises(CodecError): # never ends
+            decode_entity(bytes((KIND_CARD, FLAG_HAS_COORDS)) + b"\xff" * 20)
+        with self.assertRaises(CodecError): # ends only after the maximum length
+            decode_entity(bytes((KIND_CARD, FLAG_HAS_COORDS)) + b"\x80" * 10 + b"\x01\x00\x00\x00")
+        with self.assertRaises(CodecError):
+            write_varint(bytearray(), -1)
+
+    def test_unknown_kinds_and_types(self) -> None:
+        with self.assertRaises(CodecError):
+            decode_entity(bytes((9, 0)))
+        with self.assertRaises(CodecError): # card type
+            decode_entity(bytes((KIND_CARD, 0, len(CARD_TYPES), 0)))
+        with self.assertRaises(CodecError): # card type of a card list
+            decode_entity(bytes((KIND_CARD_LIST, FLAG_HAS_COORDS, 0, 0, 0xFE, 0, 0)))
+        with self.assertRaises(CodecError): # color
+            decode_entity(bytes((0, 0, 0xF0, 0)))
+        with self.assertRaises(CodecError): # codec version
+            decode_entities(bytes((CODEC_VERSION + 1, 0)))
+
+    def test_out_of_range_state_indices(self) -> None:
+        for card_type in CARD_TYPES:
+            data = bytearray((KIND_CARD, 0, CARD_TYPES.index(card_type)))
+            write_varint(data, card_type.COUNT)
+            with self.assertRaises(CodecError):
+                decode_entity(bytes(data))
+
+    def test_oversized_lengths(self) -> None:
+        data = bytearray((0, 0, 0)) # a plain entity without coords and color
+        write_varint(data, 1000)
+        with self.assertRaises(CodecError): # the string is longer than the message
+            decode_entity(bytes(data) + b"abc")
+        data = bytearray((KIND_CARD_LIST, FLAG_HAS_COORDS, 0, 0, 0)) # at (0, 0), of warriors
+        write_varint(data, 2) # max size
+        write_varint(data, 3) # count
+        with self.assertRaises(CodecError): # more cards than the maximum size
+            decode_entity(bytes(data) + b"\x00\x00\x03" * 3)
+        data = bytearray((KIND_CARD_LIST, FLAG_HAS_COORDS, 0, 0, 0, 0))
+        write_varint(data, 1 << 40)
+        with self.assertRaises(CodecError): # more cards than the message holds
+            decode_entity(bytes(data) + b"\x00\x00\x03")
+        with self.assertRaises(CodecError): # a card list needs coordinates
+            decode_entity(bytes((KIND_CARD_LIST, 0, 0, 0, 0)))
+        with self.assertRaises(CodecError):
+            decode_entity(bytes((0, 0, 0, 2)) + b"\xff\xfe")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Compresses and decompresses payloads with the preset dictionary and relays compressed payloads between connections:
+
+    python -m unittest test_compression
+"""
+
+from shared_definitions import *
+from compression import PayloadCompression, COMPRESSION_THRESHOLD, get_sample_payloads
+import socket
+import unittest
+
+class PayloadCompressionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.compression = PayloadCompression()
+        self.payloads = [payload for payload in get_sample_payloads(seed = 1, turns = 40) if len(payload) >= COMPRESSION_THRESHOLD]
+
+    def test_round_trip(self) -> None:
+        compressed_count = 0
+        for payload in self.payloads:
+            message_type, compressed = self.compression.compress(SOCKET_SHARED_ENTITIES_UPDATE, payload)
+            if message_type & SOCKET_COMPRESSED_FLAG:
+                compressed_count += 1
+                self.assertLess(len(compressed), len(payload))
+                self.assertEqual(self.compression.decompress(message_type, compressed), (SOCKET_SHARED_ENTITIES_UPDATE, payload))
+            else: # it would not have been smaller
+                self.assertEqual(compressed, payload)
+        self.assertGreater(compressed_count, 0)
+
+    def test_below_threshold_is_passed_through(self) -> None:
+        payload = self.payloads[0][:COMPRESSION_THRESHOLD - 1]
+        self.assertEqual(self.compression.compress(SOCKET_SHARED_ENTITIES_UPDATE, payload), (SOCKET_SHARED_ENTITIES_UPDATE, payload))
+        self.assertEqual(self.compression.compress(SOCKET_YOUR_TURN, b""), (SOCKET_YOUR_TURN, b""))
+
+    def test_corrupted_payload(self) -> None:
+        message_type, compressed = self.compression.compress(SOCKET_SHARED_ENTITIES_UPDATE, max(self.payloads, key = len))
+        self.assertTrue(message_type & SOCKET_COMPRESSED_FLAG)
+        with self.assertRaises(ConnectionError):
+            self.compression.decompress(message_type, compressed[:len(compressed) // 2])
+        with self.assertRaises(ConnectionError):
+            WirePayload(b"\xff" * 16, self.compression).plain
+
+class RelayTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.connections: List[StreamConnection] = []
+
+    async def asyncTearDown(self) -> None:
+        for connection in self.connections:
+            await connection.close()
+
+    async def connect(self, compressed: bool) -> Tuple[StreamConnection, StreamConnection]:
+        ends = []
+        for sock in socket.socketpair():
+            connection = StreamConnection(*await asyncio.open_connection(sock = sock))
+            connection.compression = PayloadCompression() if compressed else None
+            self.connections.append(connection)
+            ends.append(connection)
+        return ends[0], ends[1]
+
+    async def test_compressed_payload_is_relayed_as_it_came(self) -> None:
+        payload = max(get_sample_payloads(seed = 1, turns = 40), key = len)
+        sender, relay = await self.connect(compressed = True)
+        relay_to_compressed, receiver = await self.connect(compressed = True)
+        relay_to_plain, plain_receiver = await self.connect(compressed = False)
+
+        await sender.send_message(SOCKET_SHARED_ENTITIES_UPDATE, payload)
+        message_type, wire_payload = await relay.recv_wire_message()
+        self.assertEqual(message_type, SOCKET_SHARED_ENTITIES_UPDATE)
+        self.assertTrue(wire_payload.compressed)
+        self.assertEqual(wire_payload.wire, PayloadCompression().compress(message_type, payload)[1])
+        self.assertEqual(relay.last_message_size, SOCKET_FRAME_HEADER.size + len(wire_payload.wire))
+
+        # the receiver with compression gets the same bytes, the one without gets the decompressed payload
+        size = await relay_to_compressed.send_message(message_type, wire_payload)
+        self.assertEqual(size, SOCKET_FRAME_HEADER.size + len(wire_payload.wire))
+        await relay_to_plain.send_message(message_type, wire_payload)
+        self.assertEqual(await receiver.recv_message(), (SOCKET_SHARED_ENTITIES_UPDATE, payload))
+        self.assertEqual(await plain_receiver.recv_message(), (SOCKET_SHARED_ENTITIES_UPDATE, payload))
+        self.assertEqual(plain_receiver.last_message_size, SOCKET_FRAME_HEADER.size + len(payload))
+
+    async def test_uncompressed_payload(self) -> None:
+        sender, relay = await self.connect(compressed = True)
+        await sender.send_message(SOCKET_ENTITIES_ACK, b"\x01\x02")
+        message_type, wire_payload = await relay.recv_wire_message()
+        self.assertEqual(message_type, SOCKET_ENTITIES_ACK)
+        self.assertFalse(wire_payload.compressed)
+        self.assertEqual(wire_payload.plain, b"\x01\x02")
+
+if __name__ == "__main__":
+    unittest.main()
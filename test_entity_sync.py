@@ -0,0 +1,107 @@
+"""
+Sends versions of a set of entities from an EntitySyncSender to an EntitySyncReceiver:
+
+    python -m unittest test_entity_sync
+"""
+
+from shared_definitions import *
+from codec import CodecError, encode_entity
+from entity_sync import EntitySyncSender, EntitySyncReceiver, SyncUpdate, parse_update, encode_update, encode_ack, decode_ack, get_public_view
+import unittest
+
+class EntitySyncTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sender = EntitySyncSender(keyframe_interval = 100)
+        self.receiver = EntitySyncReceiver()
+        self.label = Entity("Label", coords = Coordinates(1, 1), public = True)
+        self.card_list = CardList(Coordinates(1, 3), WarriorCard)
+        for state_index in (0, 4, 7):
+            self.card_list.append(WarriorCard(state_index = state_index, public = True))
+        self.entities: List[Entity] = [self.label, self.card_list]
+
+    def send(self, ack: bool = True) -> SyncUpdate:
+        """Sends the next version, the receiver acknowledges it if ack is set"""
+        data = self.sender.encode_update(self.entities)
+        self.receiver.apply_update(data)
+        if ack:
+            self.sender.on_ack(self.receiver.received_version, self.receiver.version)
+        return parse_update(data)
+
+    def assert_in_sync(self) -> None:
+        self.assertEqual(sorted(encode_entity(entity) for entity in self.receiver.entities.values()),
+                         sorted(encode_entity(get_public_view(entity)) for entity in self.entities))
+
+    def test_delta_applies_on_top_of_the_acked_version(self) -> None:
+        self.assertTrue(self.send().keyframe)
+        self.assert_in_sync()
+
+        self.card_list.append(WarriorCard(state_index = 2, public = True))
+        update = self.send()
+        self.assertFalse(update.keyframe)
+        self.assertEqual(update.base_version, 1)
+        self.assertEqual(len(update.upserts), 1) # only the card list has changed
+        self.assert_in_sync()
+
+        removed = self.entities.pop(0)
+        update = self.send()
+        self.assertFalse(update.keyframe)
+        self.assertEqual(update.base_version, 2)
+        self.assertEqual(len(update.removed), 1)
+        self.assertEqual(update.upserts, [])
+        self.assert_in_sync()
+        self.assertNotIn(removed, self.receiver.entities.values())
+
+    def test_keyframe_is_forced_when_the_previous_version_is_unacked(self) -> None:
+        self.send()
+        self.assertFalse(self.send(ack = False).keyframe)
+        update = self.send()
+        self.assertTrue(update.keyframe)
+        self.assertEqual(update.base_version, 0)
+        self.assert_in_sync()
+        self.assertFalse(self.send().keyframe) # the keyframe has been acked
+
+    def test_mismatched_ack_triggers_a_resend(self) -> None:
+        self.send()
+        self.label.content = "Changed"
+        data = self.sender.encode_update(self.entities)
+        lost = EntitySyncReceiver() # a receiver that has missed the first version can not apply the delta
+        self.assertIsNone(lost.apply_update(data))
+        self.assertEqual((lost.received_version, lost.version), (2, 0))
+        self.assertTrue(self.sender.on_ack(lost.received_version, lost.version))
+
+        self.receiver = lost
+        update = self.send()
+        self.assertTrue(update.keyframe)
+        self.assert_in_sync()
+
+    def test_ack_to_an_older_version_is_ignored(self) -> None:
+        self.send()
+        self.sender.encode_update(self.entities)
+        self.assertFalse(self.sender.on_ack(1, 0))
+        self.assertEqual(self.sender.acked_version, 1)
+
+    def test_parse_update_rejects_truncated_input(self) -> None:
+        data = self.sender.encode_update(self.entities)
+        self.assertEqual(encode_update(parse_update(data)), data)
+        for length in range(len(data)):
+            with self.assertRaises(CodecError):
+                parse_update(data[:length])
+
+    def test_parse_update_rejects_garbage(self) -> None:
+        data = self.sender.encode_update(self.entities)
+        for garbage in (bytes((data[0] + 1,)) + data[1:], # another codec version
+                        data + b"\x00", # trailing bytes
+                        data[:2] + b"\xff" * 12, # a varint that never ends
+                        encode_update(SyncUpdate(1, 0, True, [], [(1, b"")]))[:-1] + b"\x05", # an entity longer than the message
+                        b"\x80\x03\x7d\x71\x00\x2e"): # a pickle of a legacy client
+            with self.assertRaises(CodecError):
+                parse_update(garbage)
+
+    def test_ack(self) -> None:
+        self.assertEqual(decode_ack(encode_ack(300, 299)), (300, 299))
+        for garbage in (b"", b"\x81", b"\x01\x02\x03"):
+            with self.assertRaises(CodecError):
+                decode_ack(garbage)
+
+if __name__ == "__main__":
+    unittest.main()
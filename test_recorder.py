@@ -0,0 +1,84 @@
+"""
+Records a synthetic match into a temporary directory and replays every turn of it from the index:
+
+    python -m unittest test_recorder
+"""
+
+from shared_definitions import *
+from codec import encode_entity
+from compression import get_sample_payloads
+from entity_sync import EntitySyncReceiver, is_keyframe
+from recorder import MatchRecorder, MatchReplay, RecordingError, RECORDING_HEADER, NO_KEYFRAME
+import os
+import tempfile
+import unittest
+
+TURNS: int = 40
+
+def get_view(entities: Iterable[Entity]) -> List[bytes]:
+    return sorted(encode_entity(entity) for entity in entities)
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.recorder = MatchRecorder(directory.name)
+        self.recording = self.recorder.start_recording(session_id = 7)
+
+        # the players take turns, every turn is an update of the player that has moved followed by SOCKET_YOUR_TURN
+        self.payloads = get_sample_payloads(seed = 19, turns = TURNS)
+        self.expected_views: List[Dict[int, List[bytes]]] = [] # what a client has seen at the start of every turn
+        receivers = {1: EntitySyncReceiver(), 2: EntitySyncReceiver()}
+        for turn, payload in enumerate(self.payloads):
+            self.expected_views.append({player_num: get_view(receiver.entities.values()) for player_num, receiver in receivers.items()})
+            player_num = turn % 2 + 1
+            receivers[player_num].apply_update(payload)
+            self.recording.record(player_num, SOCKET_SHARED_ENTITIES_UPDATE, payload)
+            self.recording.record(player_num, SOCKET_YOUR_TURN, b"")
+        self.expected_views.append({player_num: get_view(receiver.entities.values()) for player_num, receiver in receivers.items()})
+        self.recording.close()
+        self.recorder.close()
+        self.path = self.recording.path + ".rec"
+
+    def test_every_turn_is_replayed_from_the_index(self) -> None:
+        with MatchReplay(self.path) as replay:
+            self.assertEqual(replay.session_id, 7)
+            self.assertEqual(replay.turn_count, TURNS + 1)
+            for turn in range(replay.turn_count):
+                entities = replay.get_entities(turn)
+                self.assertEqual({player_num: get_view(entities[player_num]) for player_num in (1, 2)}, self.expected_views[turn], f"turn {turn}")
+                self.assertEqual(replay.get_turn(turn)[3], turn % 2 + 1)
+
+    def test_index_points_to_keyframes(self) -> None:
+        with MatchReplay(self.path) as replay:
+            records = {offset: (player_num, message_type, payload) for offset, player_num, message_type, _, payload in replay.get_records(RECORDING_HEADER.size)}
+            for turn in range(replay.turn_count):
+                turn_offset, *keyframe_offsets, current_player_num = replay.get_turn(turn)
+                for player_num, keyframe_offset in zip((1, 2), keyframe_offsets):
+                    if keyframe_offset == NO_KEYFRAME:
+                        continue
+                    self.assertLess(keyframe_offset, turn_offset)
+                    recorded_player_num, message_type, payload = records[keyframe_offset]
+                    self.assertEqual((recorded_player_num, message_type), (player_num, SOCKET_SHARED_ENTITIES_UPDATE))
+                    self.assertTrue(is_keyframe(payload))
+                    # it is the last keyframe of the player before the turn
+                    self.assertFalse(any(offset > keyframe_offset and offset < turn_offset and player_num == other_player_num and is_keyframe(other_payload)
+                                         for offset, (other_player_num, _, other_payload) in records.items()))
+
+    def test_truncated_recording(self) -> None:
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as f: # as if the server had stopped in the middle of a record
+            f.truncate(size - 3)
+        with MatchReplay(self.path) as replay: # the complete records are still read, the partial one is skipped
+            entities = replay.get_entities(TURNS - 1)
+            self.assertEqual({player_num: get_view(entities[player_num]) for player_num in (1, 2)}, self.expected_views[TURNS - 1])
+            last_offset, _, last_message_type, _, _ = list(replay.get_records(RECORDING_HEADER.size))[-1]
+            self.assertEqual(last_message_type, SOCKET_SHARED_ENTITIES_UPDATE)
+            self.assertLess(last_offset, size - 3)
+        with open(self.path, "r+b") as f:
+            f.write(b"XXXX")
+        with self.assertRaises(RecordingError):
+            MatchReplay(self.path)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Renders frames with the diffing TerminalRenderer and replays what it writes on an emulated screen:
+
+    python -m unittest test_renderer
+"""
+
+from shared_definitions import *
+from renderer import TerminalRenderer, Framebuffer, Cell, BLANK_CELL, CLEAR_SCREEN, CLEAR_TO_END_OF_LINE, move_cursor
+import io
+import unittest
+
+ESCAPE_PATTERN: re.Pattern = re.compile(r'\x1B\[([0-9;]*)([A-Za-z])')
+
+class Screen:
+    """Just enough of a terminal for the sequences that the renderer writes"""
+    def __init__(self) -> None:
+        self.cells: Dict[Tuple[int, int], Cell] = {} # (row, column) -> cell, blank if missing
+        self.row: int = 0
+        self.column: int = 0
+        self.color: str | None = colors.NONE
+
+    def write(self, data: str) -> None:
+        pos = 0
+        while pos < len(data):
+            match = ESCAPE_PATTERN.match(data, pos)
+            if match is None:
+                self.cells[(self.row, self.column)] = (data[pos], self.color)
+                self.column += 1
+                pos += 1
+                continue
+            arguments, command = match.groups()
+            if command == "H":
+                row, column = arguments.split(";") if arguments else (1, 1)
+                self.row, self.column = int(row) - 1, int(column) - 1
+            elif command == "J":
+                self.cells.clear()
+            elif command == "K":
+                for key in [key for key in self.cells if key[0] == self.row and key[1] >= self.column]:
+                    del self.cells[key]
+            elif command == "m":
+                self.color = colors.NONE if match.group(0) == colors.ENDC else match.group(0)
+            pos = match.end()
+
+    def get_rows(self) -> List[List[Cell]]:
+        """The rows without the blank cells at their ends"""
+        rows: List[List[Cell]] = [[] for _ in range(max((row for row, _ in self.cells), default = -1) + 1)]
+        for (row, column), cell in self.cells.items():
+            if len(rows[row]) <= column:
+                rows[row].extend([BLANK_CELL] * (column + 1 - len(rows[row])))
+            rows[row][column] = cell
+        return [strip(row) for row in rows]
+
+def strip(row: List[Cell]) -> List[Cell]:
+    end = len(row)
+    while end > 0 and row[end - 1] == BLANK_CELL:
+        end -= 1
+    return row[:end]
+
+def get_rows(entities: List[Entity]) -> List[List[Cell]]:
+    framebuffer = Framebuffer()
+    for entity in entities:
+        framebuffer.draw(entity)
+    rows = [strip(row) for row in framebuffer.rows]
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+class TerminalRendererTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.output = io.StringIO()
+        self.renderer = TerminalRenderer(self.output)
+        self.screen = Screen()
+
+    def render(self, entities: List[Entity]) -> str:
+        self.output.seek(0)
+        self.output.truncate()
+        self.renderer.render(entities)
+        frame = self.output.getvalue()
+        self.screen.write(frame)
+        self.assertEqual(self.screen.get_rows(), get_rows(entities))
+        return frame
+
+    def test_unchanged_frame(self) -> None:
+        entities = [Entity("Pharaoh", colors.YELLOW, Coordinates(2, 1)), Entity("turn", colors.NONE, Coordinates(0, 3))]
+        self.assertTrue(self.render(entities).startswith(CLEAR_SCREEN))
+        self.assertEqual(self.render(entities), "")
+        self.assertEqual(self.renderer.last_frame_size, 0)
+
+    def test_one_cell_change(self) -> None:
+        self.render([Entity("abcdef", colors.NONE, Coordinates(4, 2)), Entity("last row", colors.NONE, Coordinates(0, 5))])
+        frame = self.render([Entity("abcXef", colors.NONE, Coordinates(4, 2)), Entity("last row", colors.NONE, Coordinates(0, 5))])
+        self.assertEqual(frame, move_cursor(2, 7) + "X" + move_cursor(6, 0)) # the cursor is parked below the frame
+
+        frame = self.render([Entity("abcXef", colors.NONE, Coordinates(4, 2)), Entity("last row", colors.RED, Coordinates(0, 5))])
+        self.assertEqual(frame, move_cursor(5, 0) + colors.RED + "last row" + colors.ENDC + move_cursor(6, 0))
+
+    def test_shrinking_rows(self) -> None:
+        self.render([Entity("a long line", colors.GREEN, Coordinates(0, 0)), Entity("gone", colors.NONE, Coordinates(3, 2))])
+        frame = self.render([Entity("a long", colors.GREEN, Coordinates(0, 0))])
+        self.assertIn(move_cursor(0, 6) + CLEAR_TO_END_OF_LINE, frame)
+        self.assertIn(move_cursor(2, 0) + CLEAR_TO_END_OF_LINE, frame)
+        self.assertNotIn("a long", frame)
+
+    def test_rainbow_and_multiline_entities(self) -> None:
+        rainbow = Entity("RAINBOW", colors.RAINBOW, Coordinates(1, 0))
+        self.render([rainbow, Entity("first\nsecond", colors.BLUE, Coordinates(5, 2))])
+        self.assertEqual([color for _, color in self.screen.get_rows()[0][1:]], [MAIN_COLORS[i % len(MAIN_COLORS)] for i in range(len("RAINBOW"))])
+        self.assertEqual("".join(glyph for glyph, _ in self.screen.get_rows()[3]), "second") # the next line starts at column 0
+        self.render([rainbow, Entity("first\nsec", colors.BLUE, Coordinates(5, 2))])
+        self.render([rainbow, Entity("one line", colors.BLUE, Coordinates(5, 2))])
+
+    def test_random_frames(self) -> None:
+        rng = random.Random(9)
+        palette = [colors.NONE, colors.GRAY, colors.RAINBOW] + MAIN_COLORS
+        entities: List[Entity] = []
+        for _ in range(200):
+            if entities and rng.random() < 0.4:
+                entities.pop(rng.randrange(len(entities)))
+            if rng.random() < 0.7:
+                content = "".join(rng.choice("ab ☩\n") for _ in range(rng.randint(1, 12)))
+                entities.append(Entity(content, rng.choice(palette), Coordinates(rng.randrange(30), rng.randrange(8))))
+            if entities and rng.random() < 0.3:
+                entities[rng.randrange(len(entities))].color = rng.choice(palette)
+            self.render(entities)
+
+    def test_invalidate(self) -> None:
+        entities = [Entity("x", colors.NONE, Coordinates(0, 0))]
+        self.render(entities)
+        self.renderer.invalidate()
+        self.assertTrue(self.render(entities).startswith(CLEAR_SCREEN))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Checks that a Sampler draws exactly what the original formula draws for the same random values:
+
+    python -m unittest test_sampler
+"""
+
+from bisect import bisect_right
+from unittest import mock
+import math
+import random
+import unittest
+import sampler
+from sampler import Sampler, get_index, make_rng
+
+POOLS = [(1, 10), (2, 10), (24, 10), (24, 1), (60, 10), (60, 3.5), (100, 0.5)] # (count, cruelty)
+
+class SamplerTest(unittest.TestCase):
+    def test_thresholds_match_the_formula(self) -> None:
+        rng = random.Random(16)
+        for count, cruelty in POOLS:
+            thresholds = Sampler(count, cruelty).thresholds
+            values = [rng.random() for _ in range(2000)] + [0.0, math.nextafter(1.0, 0.0)]
+            for threshold in thresholds: # the values at which the drawn index changes are where rounding matters most
+                values += [math.nextafter(threshold, 0.0), threshold, math.nextafter(threshold, 1.0)]
+            for r in values:
+                self.assertEqual(bisect_right(thresholds, r), get_index(r, count, cruelty), f"r = {r!r}, count = {count}, cruelty = {cruelty}")
+
+    def test_draw_matches_the_formula(self) -> None:
+        for count, cruelty in POOLS:
+            expected_rng, rng = make_rng(7, stream = count), make_rng(7, stream = count)
+            expected = [get_index(expected_rng.random(), count, cruelty) for _ in range(500)]
+            self.assertEqual([Sampler(count, cruelty).draw(rng) for _ in range(500)], expected)
+
+    def test_draw_many_matches_draw(self) -> None:
+        for count, cruelty in POOLS:
+            card_sampler = Sampler(count, cruelty)
+            rng = make_rng(3)
+            expected = [card_sampler.draw(rng) for _ in range(1000)]
+            self.assertEqual(card_sampler.draw_many(1000, make_rng(3)).tolist(), expected)
+
+    @unittest.skipIf(sampler.numpy is None, "NumPy is not installed")
+    def test_draw_many_with_and_without_numpy(self) -> None:
+        for count, cruelty in POOLS:
+            with_numpy = Sampler(count, cruelty).draw_many(1000, make_rng(5, stream = count))
+            with mock.patch.object(sampler, "numpy", None):
+                without_numpy = Sampler(count, cruelty).draw_many(1000, make_rng(5, stream = count))
+            self.assertEqual(with_numpy.typecode, without_numpy.typecode)
+            self.assertEqual(with_numpy, without_numpy)
+
+    def test_invalid_pools(self) -> None:
+        with self.assertRaises(ValueError):
+            Sampler(0)
+        with self.assertRaises(ValueError):
+            Sampler(10, cruelty = 0)
+
+if __name__ == "__main__":
+    unittest.main()
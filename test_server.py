@@ -0,0 +1,72 @@
+"""
+Runs a worker of the server in this process and plays the main process against it over the control channel:
+
+    python -m unittest test_server
+"""
+
+from shared_definitions import *
+import server
+import json
+import socket
+import time
+import unittest
+
+@unittest.skipUnless(hasattr(socket, "send_fds"), "worker processes require a platform that can pass sockets between processes")
+class WorkerStatsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        parent_socket, child_socket = socket.socketpair()
+        self.worker_task = asyncio.create_task(server.serve_worker(0, 1, child_socket))
+        self.worker = server.Worker(0, None, server.ControlChannel(parent_socket))
+        self.clients: List[socket.socket] = []
+
+    async def asyncTearDown(self) -> None:
+        self.worker.channel.send(server.CONTROL_SHUTDOWN)
+        await asyncio.wait_for(self.worker_task, server.CONTROL_TIMEOUT)
+        self.worker.channel.close()
+        for client in self.clients:
+            client.close()
+
+    def assign(self, legacy: bool = False) -> socket.socket:
+        """Hands a new connection over to the worker and returns the client end of it"""
+        server_end, client_end = socket.socketpair()
+        with server_end:
+            self.worker.assign(server_end, legacy)
+        self.clients.append(client_end)
+        return client_end
+
+    async def receive(self) -> List[Tuple[int, bytes, int | None]]:
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self.worker.channel.sock.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, server.CONTROL_TIMEOUT)
+        finally:
+            loop.remove_reader(self.worker.channel.sock.fileno())
+        return self.worker.channel.receive()
+
+    async def wait_for_stats(self, **expected: int) -> None:
+        deadline = time.monotonic() + server.CONTROL_TIMEOUT
+        while any(self.worker.stats[key] != value for key, value in expected.items()):
+            if time.monotonic() > deadline:
+                self.fail(f"the stats are {self.worker.stats}, expected {expected}")
+            for message_type, payload, _ in await self.receive():
+                if message_type == server.CONTROL_STATS:
+                    self.worker.on_stats(json.loads(payload))
+
+    async def test_connection_lost_before_handshake(self) -> None:
+        self.assign().close()
+        self.assign().sendall(b"garbage that is not a frame")
+        await self.wait_for_stats(handled = 2, accepted = 0, sessions = 0, waiting = 0, players = 0)
+
+        self.assign().sendall(encode_frame(SOCKET_CONNECTION_ESTABLISHED))
+        await self.wait_for_stats(handled = 3, accepted = 1, sessions = 1, waiting = 1, players = 1)
+
+    async def test_legacy_clients_wait_apart(self) -> None:
+        self.assign().sendall(encode_frame(SOCKET_CONNECTION_ESTABLISHED))
+        self.assign(legacy = True).sendall(LEGACY_SOCKET_TOKENS[SOCKET_CONNECTION_ESTABLISHED] + LEGACY_SOCKET_END_MSG)
+        await self.wait_for_stats(handled = 2, sessions = 2, waiting = 2, waiting_legacy = 1, players = 2)
+        self.assertEqual(self.worker.get_waiting(legacy = True), 1)
+        self.assertEqual(self.worker.get_waiting(legacy = False), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+"""
+Checks the cached and precomputed structures of shared_definitions.py against the plain computations they replace:
+
+    python -m unittest test_shared_definitions
+"""
+
+from shared_definitions import *
+from scene import SceneIndex, SceneLayer, SCENE_KEY
+import unittest
+
+def get_uncached_view(scope: Iterable[Entity]) -> List[Entity]:
+    return [entity for entity in flatten_iterable(scope) if entity.selectable]
+
+class CursorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.first = Entity("first", coords = Coordinates(0, 0), selectable = True)
+        self.last = Entity("last", coords = Coordinates(0, 6), selectable = True)
+        self.card_list = CardList(Coordinates(0, 3), WarriorCard)
+        for state_index in (0, 5):
+            self.card_list.append(WarriorCard(state_index = state_index))
+
+    def make_cursor(self, scope: SortedList[Entity]) -> Cursor:
+        scope.update([self.first, self.card_list, self.last])
+        cursor = Cursor(lambda entity: (0, 1), scope)
+        cursor.show()
+        return cursor
+
+    def assert_view(self, cursor: Cursor) -> None:
+        view = get_uncached_view(cursor.get_scope())
+        self.assertEqual(cursor.selectable_scope, view)
+        self.assertEqual(cursor.index_in_scope, index_by_identity(view, cursor.selected))
+
+    def check_mutations(self, cursor: Cursor, scope: SortedList[Entity]) -> None:
+        self.assert_view(cursor)
+        cursor.select(len(cursor.selectable_scope) - 1)
+        self.assertIs(cursor.selected, self.last)
+
+        self.card_list.append(WarriorCard(state_index = 9))
+        self.assert_view(cursor)
+        self.card_list.remove(self.card_list[0])
+        self.assert_view(cursor)
+        self.card_list[0] = WarriorCard(state_index = 1)
+        self.assert_view(cursor)
+
+        scope.remove(self.first)
+        self.assert_view(cursor)
+        scope.add(Entity("new", coords = Coordinates(0, 1), selectable = True))
+        self.assert_view(cursor)
+        self.assertIs(cursor.selected, self.last)
+
+    def test_scene_layer_scope(self) -> None:
+        scope = SceneLayer(SceneIndex(), key = SCENE_KEY)
+        self.check_mutations(self.make_cursor(scope), scope)
+
+    def test_plain_sorted_list_scope(self) -> None:
+        scope = SortedList(key = SCENE_KEY)
+        self.check_mutations(self.make_cursor(scope), scope)
+
+    def test_scope_switch(self) -> None:
+        scope = SceneLayer(SceneIndex(), key = SCENE_KEY)
+        cursor = self.make_cursor(scope)
+        cursor.scope_forward(SortedList(self.card_list, key = SCENE_KEY))
+        self.assertEqual(cursor.selectable_scope, list(self.card_list))
+        cursor.scope_backward()
+        self.card_list.append(WarriorCard(state_index = 2))
+        self.assert_view(cursor)
+
+def get_scratch_layout(card_list: CardList) -> List[Coordinates]:
+    """Where the cards of the list belong, computed from their contents without any cached widths or offsets"""
+    coords: List[Coordinates] = []
+    x = card_list.coords.x + len(card_list.label_string)
+    for card in card_list:
+        coords.append(Coordinates(x, card_list.coords.y))
+        x += len(card.content) + 1
+    return coords
+
+class CardListLayoutTest(unittest.TestCase):
+    def assert_layout(self, card_list: CardList) -> None:
+        expected = get_scratch_layout(card_list)
+        self.assertEqual([card.coords for card in card_list], expected)
+        copy = card_list.copy()
+        self.assertEqual([card.coords for card in copy], expected)
+        copy.update_card_coordinates(begin = 0, end = len(copy)) # a full re-layout from the cached offsets
+        self.assertEqual([card.coords for card in copy], expected)
+
+    def test_random_operations(self) -> None:
+        rng = random.Random(13)
+        for card_type, empty_label in ((WarriorCard, False), (BandageCard, False), (WarriorCard, True)):
+            card_list = CardList(Coordinates(4, 2), card_type, empty_label = empty_label)
+            for _ in range(400):
+                operation = rng.random()
+                if len(card_list) < 3 or operation < 0.3:
+                    card_list.append(card_type.from_state_index(rng.randrange(card_type.COUNT)))
+                elif operation < 0.45:
+                    card_list.remove(card_list[rng.randrange(len(card_list))])
+                elif operation < 0.6:
+                    card_list[rng.randrange(len(card_list))] = card_type.from_state_index(rng.randrange(card_type.COUNT))
+                elif operation < 0.75:
+                    card_list[rng.randrange(len(card_list))].upgrade_value(rng.randint(1, 3))
+                elif operation < 0.9:
+                    card_list[rng.randrange(len(card_list))].upgrade_level(rng.randint(1, 2))
+                else:
+                    card_list.set_coords(Coordinates(rng.randrange(10), rng.randrange(10)))
+                self.assert_layout(card_list)
+
+    def test_cards_leave_the_list(self) -> None:
+        card_list = CardList(Coordinates(0, 0), WarriorCard)
+        for state_index in (0, 9, 18):
+            card_list.append(WarriorCard(state_index = state_index))
+        removed = card_list[0]
+        card_list.remove(removed)
+        replaced = card_list[0]
+        card_list[0] = WarriorCard(state_index = 1)
+        removed.upgrade_value(5) # the list does not move its cards for cards that are not in it anymore
+        replaced.upgrade_level()
+        self.assertIsNone(removed.cardlist)
+        self.assertIsNone(replaced.cardlist)
+        self.assert_layout(card_list)
+
+    def test_remove_an_equal_card(self) -> None:
+        card_list = CardList(Coordinates(0, 0), WarriorCard)
+        first, second = WarriorCard(state_index = 3), WarriorCard(state_index = 3)
+        for card in (first, WarriorCard(state_index = 20), second):
+            card_list.append(card)
+        card_list.remove(second)
+        self.assertIs(card_list[0], first)
+        self.assertIs(first.cardlist, card_list)
+        first.upgrade_value(10)
+        self.assert_layout(card_list)
+        with self.assertRaises(ValueError):
+            card_list.remove(second)
+
+CARD_TYPES: List[Type[Card]] = [WarriorCard, BandageCard, BuildingCard, GuardCard]
+
+def get_reference_level_upgrade(card_type: Type[Card], state_index: int, by: int) -> int:
+    """The linear walk over STATES that LEVEL_UPGRADES replaces"""
+    state = card_type.STATES[state_index]
+    index_iterator = state_index
+    while index_iterator < card_type.LAST_STATE_INDEX and by > 0:
+        index_iterator += 1
+        new_state = card_type.STATES[index_iterator]
+        if new_state.level != state.level and new_state.pos_in_level == state.pos_in_level:
+            state_index, state = index_iterator, new_state
+            by -= 1
+    if card_type.SUPPORTS_VALUE_UPGRADES and index_iterator == card_type.LAST_STATE_INDEX and by > 0:
+        state_index = index_iterator
+    return state_index
+
+def get_state_index(card_type: Type[Card], state: CardState) -> int:
+    card = card_type.__new__(card_type)
+    Card.__init__(card, state = state) # BuildingCard has a constructor of its own
+    return card.state_index
+
+class CardStateTest(unittest.TestCase):
+    def test_upgrade_level(self) -> None:
+        for card_type in CARD_TYPES:
+            for state_index in range(card_type.COUNT):
+                for by in range(card_type.COUNT + 2):
+                    card = card_type.from_state_index(state_index)
+                    card.upgrade_level(by)
+                    self.assertEqual(card.state_index, get_reference_level_upgrade(card_type, state_index, by), f"{card_type.__name__} {state_index} by {by}")
+
+    def test_state_lookups(self) -> None:
+        for card_type in CARD_TYPES:
+            for state_index, state in enumerate(card_type.STATES):
+                self.assertEqual(get_state_index(card_type, state), card_type.STATES.index(state))
+                # an equal state that is not one of STATES
+                self.assertEqual(get_state_index(card_type, CardState(level = state.level, face_value = state.face_value, pos_in_level = state.pos_in_level)), state_index)
+                first_pos_in_level = next(other.pos_in_level for other in card_type.STATES if other.face_value == state.face_value)
+                self.assertEqual(CardState(card_type = card_type, level = state.level, face_value = state.face_value).pos_in_level, first_pos_in_level)
+            with self.assertRaises(ValueError):
+                get_state_index(card_type, CardState(level = colors.GRAY, face_value = "?", pos_in_level = 0))
+
+    def test_building_lookups(self) -> None:
+        for level in MAIN_COLORS + SUPER_COLORS + [colors.GRAY]:
+            for building_type in BUILDING_FACE_VALUES + SUPER_BUILDING_FACE_VALUES:
+                expected = next((i for i, state in enumerate(BuildingCard.STATES) if state.level == level and state.face_value == building_type), None)
+                if expected is None:
+                    with self.assertRaises(ValueError):
+                        BuildingCard(building_type, level)
+                else:
+                    self.assertEqual(BuildingCard(building_type, level).state_index, expected)
+
+    def test_hash(self) -> None:
+        for card_type in CARD_TYPES:
+            states = card_type.STATES
+            copies = [CardState(level = state.level, face_value = state.face_value, pos_in_level = state.pos_in_level) for state in states]
+            for state, copy in zip(states, copies):
+                self.assertEqual(hash(state), hash(copy))
+            index_by_state: Dict[CardState, int] = {state: i for i, state in enumerate(states)}
+            self.assertEqual(len(index_by_state), len(states)) # no two states of a type are equal
+            self.assertEqual([index_by_state[copy] for copy in copies], list(range(len(states))))
+            self.assertEqual(len(set(states) | set(copies)), len(states))
+
+            cards = [card_type.from_state_index(i) for i in range(card_type.COUNT)]
+            self.assertEqual(len(set(cards) | {card.copy() for card in cards}), card_type.COUNT)
+            self.assertEqual(hash(cards[0]), hash(cards[0].copy()))
+
+if __name__ == "__main__":
+    unittest.main()